@@ -10,7 +10,7 @@ pipe = simpy.Store(env)
 bus_width = 32
 
 pkt = Ether()/IP()/TCP()/'hello there pretty world!!!'
-tuser = Tuser(len(pkt), 0b00000001, 0b00000100)
+tuser = Tuser(len(pkt), 0b00000001, 0b00000100, 0, 0)
 pkt_list = [(pkt, tuser)]*3
 
 master = AXI_S_master(env, period, pipe, bus_width, pkt_list)
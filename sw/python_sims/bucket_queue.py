@@ -0,0 +1,314 @@
+from __future__ import print_function
+import simpy
+from hwsim_utils import HW_sim_object, Fifo, OUT_REG_IMPLS, MEM_IMPLS, Op_profiler
+
+# Width of the rank fields in the hardware metadata (LEShortField)
+RANK_BITS = 16
+# Width of the bitmap words, a priority encoder finds the first set bit of a word
+BITMAP_WIDTH = 64
+# Cycles taken by the priority encoder to find the first set bit of a word
+FFS_LATENCY = 1
+
+
+def ffs(word):
+    """Index of the least significant set bit of word (-1 if word is 0)
+    """
+    return (word & -word).bit_length() - 1
+
+
+class Bucket_queue(HW_sim_object):
+    """Calendar/bucket queue for bounded integer ranks, a drop-in replacement
+       for the skip lists behind the same out reg and enqueue FIFO.
+
+       There is one FIFO bucket per rank (per 2**rank_shift ranks if the
+       ranks are quantized), kept as a linked list of entries: the bucket
+       memory holds the head and tail ptrs of each bucket, the node memory
+       holds the entries and the link memory their next ptrs.
+       A hierarchical bitmap marks the non-empty buckets: each bit of a level
+       is set if the corresponding word of the level below is non-zero. The
+       top word is held in a register, the other levels are stored in their
+       own memories. The min bucket is found by a find-first-set scan from
+       the top word down, which costs one read per stored level and
+       FFS_LATENCY cycles per level whatever the number of entries.
+    """
+    def __init__(self, env, period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency, outreg_impl='list', rng=None, profile=False, mem_impl='bram', search_prefetch=False,
+                 rank_bits=RANK_BITS, rank_shift=0, bitmap_width=BITMAP_WIDTH):
+        super(Bucket_queue, self).__init__(env, period)
+
+        self.env = env
+        self.period = period
+        self.outreg_width = outreg_width
+        self.outreg_latency = outreg_latency
+        self.enq_fifo_depth = enq_fifo_depth
+        self.rd_latency = rd_latency
+        # the bucket queue is deterministic and does not search, so rng and
+        # search_prefetch are not used
+
+        self.rank_bits = rank_bits
+        # ranks are quantized to buckets of 2**rank_shift consecutive ranks,
+        # entries of the same bucket are dequeued in FIFO order
+        self.rank_shift = rank_shift
+        self.num_buckets = 2**(rank_bits - rank_shift)
+        self.bitmap_width = bitmap_width
+
+        # Process communication pipes
+        self.enq_in_pipe = simpy.Store(env)
+        self.enq_out_pipe = simpy.Store(env)
+        self.deq_in_pipe = simpy.Store(env)
+        self.deq_out_pipe = simpy.Store(env)
+        self.outreg_ins_in_pipe = simpy.Store(env)
+        self.outreg_ins_out_pipe = simpy.Store(env)
+        self.outreg_rem_in_pipe = simpy.Store(env)
+        self.outreg_rem_out_pipe = simpy.Store(env)
+
+        # Profiler attributing memory accesses and cycles to each operation
+        self.profiler = Op_profiler(env, profile)
+        # maps: node ptr --> [rank, hsp, mdp]
+        self.nodes = self.memory(mem_impl, size, rd_latency, wr_latency)
+        # maps: node ptr --> ptr of the next node in the same bucket
+        self.links = self.memory(mem_impl, size, rd_latency, wr_latency)
+        # maps: bucket --> (head ptr, tail ptr), None if the bucket is empty
+        self.buckets = self.memory(mem_impl, self.num_buckets, rd_latency, wr_latency)
+        # bitmap levels below the top word, level 0 has one bit per bucket
+        self.bitmaps = []
+        num_words = (self.num_buckets + bitmap_width - 1)//bitmap_width
+        while num_words > 1:
+            bitmap = self.memory(mem_impl, num_words, rd_latency, wr_latency)
+            bitmap.mem = num_words*[0]
+            self.bitmaps.append(bitmap)
+            num_words = (num_words + bitmap_width - 1)//bitmap_width
+        # top bitmap word register
+        self.top = 0
+
+        # FIFO for free node list
+        self.free_node_list = Fifo(size)
+        for addr in range(size):
+            self.free_node_list.push(addr)
+        self.free_node_list.reset_watermarks()
+        # Output register on dequeue side
+        self.outreg = OUT_REG_IMPLS[outreg_impl](self.env, period, self.outreg_ins_in_pipe, self.outreg_ins_out_pipe, self.outreg_rem_in_pipe, self.outreg_rem_out_pipe, outreg_width, outreg_latency)
+        # FIFO for enqueing into the bucket queue
+        self.enq_fifo = Fifo(enq_fifo_depth)
+
+        self.num_entries = 0
+        # number of entries held in the buckets
+        self.num_stored = 0
+
+        # Busy flag
+        self.busy = 0
+        # set while an entry moves from the buckets to the out reg, the slot
+        # it will take in the out reg is then reserved
+        self.refilling = False
+        self.enqueuing = False
+
+        # Lists to store time measurements
+        self.bg_search_nclks_list = []
+        self.bg_enq_nclks_list = []
+        self.bg_deq_nclks_list = []
+
+        # register processes for simulation
+        self.run(env)
+
+    def run(self, env):
+        self.env.process(self.enqueue())
+        self.env.process(self.dequeue())
+        self.enq_sl_proc = self.env.process(self.enq_sl())
+        self.deq_sl_proc = self.env.process(self.deq_sl())
+
+    def memory(self, mem_impl, depth, rd_latency, wr_latency):
+        mem = MEM_IMPLS[mem_impl](self.env, self.period, simpy.Store(self.env), simpy.Store(self.env), simpy.Store(self.env), simpy.Store(self.env),
+                                  depth, wr_latency, rd_latency)
+        if self.profiler.enabled:
+            mem.profiler = self.profiler
+        return mem
+
+    def read(self, mem, addr):
+        mem.r_in_pipe.put(addr)
+        return mem.r_out_pipe.get()
+
+    def write(self, mem, addr, data):
+        mem.w_in_pipe.put((addr, data))
+        return mem.w_out_pipe.get()
+
+    def scan_cycles(self):
+        """Cycles taken by a find-first-set scan of the bitmap
+        """
+        return (len(self.bitmaps) + 1)*FFS_LATENCY + len(self.bitmaps)*self.rd_latency
+
+    def __str__(self):
+        outStr = ""
+        for b in range(self.num_buckets):
+            if self.buckets.mem[b] is None:
+                continue
+            (ptr, tail) = self.buckets.mem[b]
+            outStr += "{}:".format(b)
+            while True:
+                outStr += " " + str(self.nodes.mem[ptr][0])
+                if ptr == tail:
+                    break
+                ptr = self.links.mem[ptr]
+            outStr += "\n"
+        return outStr
+
+    def bucket(self, value):
+        if not 0 <= value < 2**self.rank_bits:
+            print ("ERROR: rank {} does not fit in {} bits".format(value, self.rank_bits))
+            value = min(max(value, 0), 2**self.rank_bits - 1)
+        return value >> self.rank_shift
+
+    def set_bit(self, b):
+        """Mark bucket b as non-empty, the levels above are only updated if
+           the word of the level below was zero
+        """
+        for bitmap in self.bitmaps:
+            (addr, bit) = divmod(b, self.bitmap_width)
+            word = yield self.read(bitmap, addr)
+            yield self.write(bitmap, addr, word | (1 << bit))
+            if word != 0:
+                return
+            b = addr
+        self.top |= 1 << b
+
+    def scan(self):
+        """Find-first-set scan from the top word down to the min non-empty bucket
+           Returns (bucket, list of (addr, word) read from each stored level, bottom first)
+        """
+        prof = self.profiler.begin('scan')
+        yield self.wait_clocks(FFS_LATENCY)
+        b = ffs(self.top)
+        words = []
+        for bitmap in reversed(self.bitmaps):
+            word = yield self.read(bitmap, b)
+            words.insert(0, (b, word))
+            yield self.wait_clocks(FFS_LATENCY)
+            b = b*self.bitmap_width + ffs(word)
+        self.profiler.end(prof)
+        self.env.exit((b, words))
+
+    def clear_bit(self, b, words):
+        """Mark bucket b as empty, using the words read by the scan that found it
+        """
+        for (bitmap, (addr, word)) in zip(self.bitmaps, words):
+            word &= ~(1 << (b % self.bitmap_width))
+            yield self.write(bitmap, addr, word)
+            if word != 0:
+                return
+            b = addr
+        self.top &= ~(1 << b)
+
+    def enq_sl (self):
+        while True:
+            try:
+                yield self.env.timeout(self.period)
+                # If enq_fifo not empty and there's room in the bucket queue, process entry
+                if self.enq_fifo.fill_level() > 0 and self.free_node_list.fill_level() > 0 and self.busy == 0:
+                    self.busy = 1
+                    t1 = self.env.now
+                    prof = self.profiler.begin('enq_sl')
+                    (value, (hsp, mdp)) = self.enq_fifo.pop()
+                    b = self.bucket(value)
+
+                    # Write the new node while reading its bucket
+                    m = self.free_node_list.pop()
+                    wr = self.write(self.nodes, m, [value, hsp, mdp])
+                    bucket = yield self.read(self.buckets, b)
+                    if bucket is None:
+                        yield self.write(self.buckets, b, (m, m))
+                        yield self.env.process(self.set_bit(b))
+                    else:
+                        # Append to the tail of the bucket
+                        (head, tail) = bucket
+                        link = self.write(self.links, tail, m)
+                        yield self.write(self.buckets, b, (head, m))
+                        yield link
+                    yield wr
+                    self.num_stored += 1
+
+                    # Write time measurements to lists
+                    self.bg_search_nclks_list.append(0)
+                    self.bg_enq_nclks_list.append(self.env.now - t1)
+                    self.profiler.end(prof)
+                    self.busy = 0
+
+            except simpy.Interrupt as i:
+                break
+
+    def enqueue (self):
+        while True:
+            # Wait for enqueue command
+            (value, hsp, mdp) = yield self.enq_in_pipe.get()
+            t1 = self.env.now
+            # Wait if out reg and enqueue FIFO are full, or the last free out reg slot is reserved
+            while (self.outreg.num_entries == self.outreg.width and self.enq_fifo.fill_level() == self.enq_fifo_depth) or self.outreg.busy == 1 or \
+                  (self.refilling and self.outreg.num_entries >= self.outreg.width - 1):
+                yield self.env.timeout(self.period)
+            self.enqueuing = True
+            # Insert into output reg
+            self.outreg_ins_in_pipe.put((value, [hsp, mdp]))
+            (out_reg_val, out_reg_ptrs) = yield self.outreg_ins_out_pipe.get()
+            if out_reg_val != -1:
+                # out reg insert returned an entry (either same new entry or one that was evicted from out reg)
+                # push entry into enqueue FIFO
+                self.enq_fifo.push((out_reg_val, out_reg_ptrs))
+            self.enqueuing = False
+
+            enq_nclks = self.env.now - t1
+            self.enq_out_pipe.put((0, enq_nclks))
+            self.num_entries += 1
+
+    def deq_sl (self):
+        while True:
+            try:
+                # Wait one clock
+                yield self.env.timeout(self.period)
+                # If there's room in out reg and there are entries in the buckets and it's not busy.
+                # Entries waiting in the enqueue FIFO are inserted first, they may be smaller than the min bucket
+                if (self.outreg.num_entries < self.outreg.width) and self.num_stored > 0 and self.enq_fifo.fill_level() == 0 and self.busy == 0 and \
+                   not self.enqueuing and self.outreg.busy == 0:
+                    t1 = self.env.now
+                    self.busy = 1
+                    self.refilling = True
+                    prof = self.profiler.begin('deq_sl')
+                    (b, words) = yield self.env.process(self.scan())
+                    (head, tail) = yield self.read(self.buckets, b)
+                    # Read the head node and its next ptr
+                    nxt = self.read(self.links, head)
+                    (dqVal, dqHsp, dqMdp) = yield self.read(self.nodes, head)
+                    nxt = yield nxt
+
+                    # Send dequeued value to out reg
+                    self.outreg.ins_in_pipe.put((dqVal, [dqHsp, dqMdp]))
+                    (tmpVal, tmpPtrs) = yield self.outreg_ins_out_pipe.get()
+                    # tmpVal should be -1 because there was room available in out reg
+                    if tmpVal != -1:
+                        print ("Dequeue Error!: Received non-null value from out reg:", tmpVal, tmpPtrs)
+                    self.refilling = False
+
+                    if head == tail:
+                        yield self.write(self.buckets, b, None)
+                        yield self.env.process(self.clear_bit(b, words))
+                    else:
+                        yield self.write(self.buckets, b, (nxt, tail))
+                    self.free_node_list.push(head)
+                    self.num_stored -= 1
+
+                    deq_nclks = self.env.now - t1
+                    self.bg_deq_nclks_list.append(deq_nclks)
+                    self.profiler.end(prof)
+                    self.busy = 0
+
+            except simpy.Interrupt as i:
+                break
+
+    def dequeue (self):
+        while True:
+            # Wait for dequeue command
+            yield self.deq_in_pipe.get()
+            t1 = self.env.now
+            # Send remove request to out reg
+            self.outreg_rem_in_pipe.put(True)
+            (retVal, (retHsp, retMdp)) = yield self.outreg_rem_out_pipe.get()
+            self.num_entries -= 1
+            # Output deq result
+            deq_nclks = self.env.now - t1
+            self.deq_out_pipe.put((retVal, retHsp, retMdp, deq_nclks))
@@ -1,7 +1,8 @@
 from __future__ import print_function
 import simpy
+import random
 import math
-from hwsim_utils import HW_sim_object, BRAM, Fifo, out_reg
+from hwsim_utils import HW_sim_object, Fifo, OUT_REG_IMPLS, MEM_IMPLS, Op_profiler, SL_NODE_FIELDS
 
 MAX_CONS_NODES = 3
 MAX_SIZE = 128
@@ -10,7 +11,7 @@ NEG_INF = -2**32
 POS_INF = 2**32 - 1
 
 class SkipList(HW_sim_object):
-    def __init__(self, env, period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency):
+    def __init__(self, env, period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency, outreg_impl='list', rng=None, profile=False, mem_impl='bram', search_prefetch=False):
         super(SkipList, self).__init__(env, period)
         
         self.env = env
@@ -18,7 +19,9 @@ class SkipList(HW_sim_object):
         self.outreg_width = outreg_width
         self.outreg_latency = outreg_latency
         self.enq_fifo_depth = enq_fifo_depth
-        
+        # random number generator used by this skip list
+        self.rng = rng if rng is not None else random.Random()
+
         # Process communication pipes
         self.search_in_pipe = simpy.Store(env)
         self.search_out_pipe = simpy.Store(env)
@@ -35,14 +38,20 @@ class SkipList(HW_sim_object):
         self.nodes_w_in_pipe = simpy.Store(env)
         self.nodes_w_out_pipe = simpy.Store(env)
         
-        # Block RAM for node memory
+        # Block RAM for node memory, entries are stored with the SL_NODE_FIELDS layout
         depth = size
-        self.nodes = BRAM(self.env, period, self.nodes_r_in_pipe, self.nodes_r_out_pipe, self.nodes_w_in_pipe, self.nodes_w_out_pipe,
-                          depth, wr_latency, rd_latency)
+        self.nodes = MEM_IMPLS[mem_impl](self.env, period, self.nodes_r_in_pipe, self.nodes_r_out_pipe, self.nodes_w_in_pipe, self.nodes_w_out_pipe,
+                          depth, wr_latency, rd_latency, fields=SL_NODE_FIELDS)
+        # Profiler attributing node memory accesses and cycles to each operation
+        self.profiler = Op_profiler(env, profile)
+        if profile:
+            self.nodes.profiler = self.profiler
         # FIFO for free node list
         self.free_node_list = Fifo(size)
         # Output register on dequeue side
-        self.outreg = out_reg(self.env, period, self.outreg_ins_in_pipe, self.outreg_ins_out_pipe, self.outreg_rem_in_pipe, self.outreg_rem_out_pipe, outreg_width, outreg_latency)
+        self.outreg = OUT_REG_IMPLS[outreg_impl](self.env, period, self.outreg_ins_in_pipe, self.outreg_ins_out_pipe, self.outreg_rem_in_pipe, self.outreg_rem_out_pipe, outreg_width, outreg_latency)
+        # enq_sl and deq_sl wait for the out reg to change when idle
+        self.outreg.watchers.append(self.bg_notify)
         # FIFO for enqueing into the skip list
         self.enq_fifo = Fifo(enq_fifo_depth)
                           
@@ -53,6 +62,7 @@ class SkipList(HW_sim_object):
         # Push all free nodes in free list FIFO
         for addr in range(size):
             self.free_node_list.push(addr)
+        self.free_node_list.reset_watermarks()
 
         # log2_size is max height skip list will grow to
         self.log2_size = int(math.log(size, 2))
@@ -67,6 +77,14 @@ class SkipList(HW_sim_object):
         # Next value to be output
         self.next_val = None
                                               
+        # Issue a speculative read of the next down candidate along with each read while searching
+        # (pays off with a pipelined mem_impl)
+        self.search_prefetch = search_prefetch
+        # Node with an outstanding speculative read, and prefetch statistics
+        self.prefetch_addr = None
+        self.prefetch_reads = 0
+        self.prefetch_hits = 0
+
         # Lists to store time measurements
         self.bg_search_nclks_list = []
         self.bg_enq_nclks_list = []
@@ -120,6 +138,7 @@ class SkipList(HW_sim_object):
         return outStr
             
     def initSkipList(self):
+        prof = self.profiler.begin('init')
         prev_h = -1
         prev_t = -1
         # Initialize head and tail pointers up to log2(maxsize) levels
@@ -154,8 +173,40 @@ class SkipList(HW_sim_object):
             prev_h = h
             prev_t = t
             
-            self.busy = 0
-#            print ("sl init done @", self.env.now)
+        self.busy = 0
+        self.bg_notify()
+        self.profiler.end(prof)
+#        print ("sl init done @", self.env.now)
+
+    def read_node(self, addr):
+        """Issue a read of node addr and return the event of its response. A
+           pending speculative read of the same node is claimed instead of
+           issuing a new read, any other one is discarded.
+        """
+        if self.prefetch_addr is not None:
+            if self.prefetch_addr == addr:
+                self.prefetch_addr = None
+                self.prefetch_hits += 1
+                return self.nodes_r_out_pipe.get()
+            self.drop_prefetch()
+        self.nodes_r_in_pipe.put(addr)
+        return self.nodes_r_out_pipe.get()
+
+    def prefetch_read(self, addr):
+        """Speculatively read node addr, the response is claimed or discarded
+           by the next read_node()
+        """
+        if addr < 0:
+            return
+        self.nodes_r_in_pipe.put(addr)
+        self.prefetch_addr = addr
+        self.prefetch_reads += 1
+
+    def drop_prefetch(self):
+        if self.prefetch_addr is not None:
+            # responses are returned in order, so this consumes the unused one
+            self.nodes_r_out_pipe.get()
+            self.prefetch_addr = None
 
     # Search for insertion point for new value
     def search (self):
@@ -163,6 +214,7 @@ class SkipList(HW_sim_object):
             # wait for search command
             value = yield self.search_in_pipe.get()
             t1 = self.env.now
+            prof = self.profiler.begin('search')
             level = self.currMaxLevel
             n = self.head[level]
             u = self.head[level + 1]
@@ -171,8 +223,7 @@ class SkipList(HW_sim_object):
                 print ("level:", level)
                 cons_nodes = 0
                 # Read node n
-                self.nodes_r_in_pipe.put(n)
-                nVal, nHsp, nMdp, nLvl, nR, nL, nU, nD = yield self.nodes_r_out_pipe.get()
+                nVal, nHsp, nMdp, nLvl, nR, nL, nU, nD = yield self.read_node(n)
                 d, dVal, dHsp, dMdp, dLvl, dR, dL, dU, dD = n, nVal, nHsp, nMdp, nLvl, nR, nL, nU, nD
                 # While traversing this level searcing for consecutive nodes...
                 while nR != -1:
@@ -181,8 +232,11 @@ class SkipList(HW_sim_object):
                     print ("curr node: @", n, "val:", nVal, "level", nLvl)
                     # Move right
                     n = nR
-                    self.nodes_r_in_pipe.put(n)
-                    nVal, nHsp, nMdp, nLvl, nR, nL, nU, nD = yield self.nodes_r_out_pipe.get()
+                    rd = self.read_node(n)
+                    if self.search_prefetch:
+                        # Node to drop down to if this level ends at n
+                        self.prefetch_read(dD)
+                    nVal, nHsp, nMdp, nLvl, nR, nL, nU, nD = yield rd
                     # Save the node at which we will drop down
                     if nVal > value:
                         d, dVal, dHsp, dMdp, dLvl, dR, dL, dU, dD = n, nVal, nHsp, nMdp, nLvl, nR, nL, nU, nD
@@ -196,8 +250,7 @@ class SkipList(HW_sim_object):
                     if cons_nodes == MAX_CONS_NODES:
                         # Insert new node one level above
                         # Read node in level above
-                        self.nodes_r_in_pipe.put(u)
-                        uVal, uHsp, uMdp, uLvl, uR, uL, uU, uD = yield self.nodes_r_out_pipe.get()
+                        uVal, uHsp, uMdp, uLvl, uR, uL, uU, uD = yield self.read_node(u)
                         print ("read u: @", u, "val:", uVal)
                         # Get new node
                         m = self.free_node_list.pop()
@@ -207,8 +260,7 @@ class SkipList(HW_sim_object):
                         print ("adding node: @", m, "val:", lVal, "level:", level+1, "r:", uR, "l:", u, "u:", -1, "d:", l)
                         # Connect right neighbor to new node
                         # Read right neighbor of upper node
-                        self.nodes_r_in_pipe.put(uR)
-                        uRVal, uRHsp, uRMdp, uRLvl, uRR, uRL, uRU, uRD = yield self.nodes_r_out_pipe.get()
+                        uRVal, uRHsp, uRMdp, uRLvl, uRR, uRL, uRU, uRD = yield self.read_node(uR)
                         print ("read uR: @", uR, "val:", uRVal)
                         # Write back
                         self.nodes_w_in_pipe.put((uR, [uRVal, uRHsp, uRMdp, uRLvl, uRR, m, uRU, uRD]))
@@ -234,20 +286,26 @@ class SkipList(HW_sim_object):
                 u = d
                 n = dD
                 level -= 1
+            self.drop_prefetch()
             # Output result
             nclks = self.env.now - t1
+            self.profiler.end(prof)
             self.search_out_pipe.put(((d, dVal, dHsp, dMdp, dLvl, dR, dL, dU, dD), nclks))
 
 
     def enq_sl (self):
+        ready = True
         while True:
             try:
-                yield self.env.timeout(self.period)
+                # Wait one clock, or until the state changes if there was nothing to do
+                yield self.env.timeout(self.period) if ready else self.bg_wait()
                 # If enq_fifo not empty and there's room in skip list, process entry
-                if self.enq_fifo.fill_level() > 0 and self.free_node_list.fill_level() >= (self.currMaxLevel + 1) and self.busy == 0:
+                ready = self.enq_fifo.fill_level() > 0 and self.free_node_list.fill_level() >= (self.currMaxLevel + 1) and self.busy == 0
+                if ready:
                     #print ("enq_sl:", self.env.now)
                     self.busy = 1
                     t1 = self.env.now
+                    prof = self.profiler.begin('enq_sl')
                     (value, (hsp, mdp)) = self.enq_fifo.pop()
 
                     # Find insertion point
@@ -276,7 +334,9 @@ class SkipList(HW_sim_object):
                     self.bg_search_nclks_list.append(search_nclks)
                     enq_nclks = self.env.now - t1 - search_nclks
                     self.bg_enq_nclks_list.append(enq_nclks)
+                    self.profiler.end(prof)
                     self.busy = 0
+                    self.bg_notify()
                     
             except simpy.Interrupt as i:
 #                print ("enq_sl stopped")
@@ -302,16 +362,20 @@ class SkipList(HW_sim_object):
             enq_nclks = self.env.now - t1
             self.enq_out_pipe.put((0, enq_nclks))
             self.num_entries += 1
+            self.bg_notify()
 
     def deq_sl (self):
+        ready = True
         while True:
             try:
-                # Wait one clock
-                yield self.env.timeout(self.period)
+                # Wait one clock, or until the state changes if there was nothing to do
+                yield self.env.timeout(self.period) if ready else self.bg_wait()
                 # If there's room in out reg and there are entries in skip list and it's not busy
-                if (self.outreg.num_entries < self.outreg.width) and self.num_entries > self.outreg.num_entries and self.busy == 0:
+                ready = (self.outreg.num_entries < self.outreg.width) and self.num_entries > self.outreg.num_entries and self.busy == 0
+                if ready:
                     t1 = self.env.now
                     self.busy = 1
+                    prof = self.profiler.begin('deq_sl')
                     # Point to tail node in level 0
                     t = self.tail[0]
                     # Read tail
@@ -343,6 +407,9 @@ class SkipList(HW_sim_object):
                     self.free_node_list.push(tL)
                     
                     # Loop to free any nodes above
+                    collapse = None
+                    if dqU != -1:
+                        collapse = self.profiler.begin('deq_collapse')
                     while dqU != -1:
                         # Read up neighbor
                         self.nodes_r_in_pipe.put(dqU)
@@ -367,10 +434,13 @@ class SkipList(HW_sim_object):
                         self.free_node_list.push(dqU)
                         # Move up
                         dqU = uU
+                    self.profiler.end(collapse)
     
                     deq_nclks = self.env.now - t1
                     self.bg_deq_nclks_list.append(deq_nclks)
+                    self.profiler.end(prof)
                     self.busy = 0
+                    self.bg_notify()
             
             except simpy.Interrupt as i:
 #                print ("deq_sl stopped")
@@ -386,6 +456,7 @@ class SkipList(HW_sim_object):
             self.outreg_rem_in_pipe.put(True)
             (retVal, (retHsp, retMdp)) = yield self.outreg_rem_out_pipe.get()
             self.num_entries -= 1
+            self.bg_notify()
             # Output deq result
             deq_nclks = self.env.now - t1
             self.deq_out_pipe.put((retVal, retHsp, retMdp, deq_nclks))
@@ -1,8 +1,14 @@
 
-import sys, os
+import sys, os, struct
 from scapy.all import *
 import simpy
-from collections import OrderedDict
+from array import array
+from collections import deque, Counter
+import heapq
+from functools import partial
+
+# Field layout of the skip list node entries stored in BRAM
+SL_NODE_FIELDS = ('val', 'hsp', 'mdp', 'lvl', 'r', 'l', 'u', 'd')
 
 class Tuser(object):
     def __init__(self, pkt_len, src_port, dst_port, rank, pkt_id):
@@ -18,18 +24,24 @@ class Tuser(object):
 class Fifo(object):
     def __init__(self, maxsize):
         self.maxsize = maxsize
-        self.items = []
+        self.items = deque()
+        # occupancy statistics
+        self.high_watermark = 0
+        self.low_watermark = 0
 
     def push(self, item):
         if len(self.items) < self.maxsize:
             self.items.append(item)
+            if len(self.items) > self.high_watermark:
+                self.high_watermark = len(self.items)
         else:
             print >> sys.stderr, "ERROR: attempted to write to full FIFO"
 
     def pop(self):
         if len(self.items) > 0:
-            item = self.items[0]
-            self.items = self.items[1:]
+            item = self.items.popleft()
+            if len(self.items) < self.low_watermark:
+                self.low_watermark = len(self.items)
             return item
         else:
             print >> sys.stderr, "ERROR: attempted to read from empty FIFO"
@@ -38,8 +50,15 @@ class Fifo(object):
     def fill_level(self):
         return (len(self.items))
 
+    def reset_watermarks(self):
+        """Restart the occupancy statistics from the current fill level
+           (e.g. once the free lists have been initialized)
+        """
+        self.high_watermark = len(self.items)
+        self.low_watermark = len(self.items)
+
     def __str__(self):
-        return str(self.items)
+        return str(list(self.items))
 
 class AXI_S_message(object):
     def __init__(self, tdata, tvalid, tkeep, tlast, tuser):
@@ -52,19 +71,184 @@ class AXI_S_message(object):
     def __str__(self):
         return "{{tdata: {}, tvalid: {}, tkeep: {:08x}, tlast: {}, tuser: {} }}".format(''.join('{:02x}'.format(ord(c)) for c in self.tdata), self.tvalid, self.tkeep, self.tlast, self.tuser)
 
+class Wakeup(simpy.Event):
+    """Event a background process waits on until it is woken up
+    """
+    def trigger_after(self, delay):
+        # scheduled like a Timeout created now
+        self._ok = True
+        self._value = None
+        self.env.schedule(self, delay=delay)
+
 class HW_sim_object(object):
+    # Fast-path timing mode: when set, wait_clock() and wait_clocks() model any
+    # number of cycles with a single timeout instead of one process per cycle
+    fast_clock = False
+    # Reference mode of bg_wait(): when set, background processes check
+    # their state every cycle instead of waiting for bg_notify()
+    poll_bg = False
+
     def __init__(self, env, period):
         self.env = env
         self.period = period
+        # background processes waiting in bg_wait()
+        self.bg_waiters = []
 
     def clock(self):
         yield self.env.timeout(self.period)
 
+    def clocks(self, n):
+        for i in range(n):
+            yield self.wait_clock()
+
+    def fast_clocks(self, n):
+        # A process completes one event after its final timeout fires, so the
+        # waiter is resumed through an extra event to keep the same ordering
+        # relative to other events scheduled in the same cycle
+        done = self.env.event()
+        self.env.timeout(n*self.period).callbacks.append(lambda t: done.succeed())
+        return done
+
     def wait_clock(self):
+        if self.fast_clock:
+            return self.fast_clocks(1)
         return self.env.process(self.clock())
 
+    def wait_clocks(self, n):
+        """Wait for n clock cycles (e.g. to model an n cycle latency)
+        """
+        if self.fast_clock:
+            return self.fast_clocks(n)
+        return self.env.process(self.clocks(n))
+
+    def bg_wait(self):
+        """Wait after a background process found nothing to do, until the
+           next cycle at which its state may have changed. A check every
+           cycle does not see the changes made during the cycle it runs in
+           (they come from events scheduled during that cycle, after the
+           check's timeout), so the process is woken up one period after the
+           first bg_notify() and the idle cycles cost no events.
+        """
+        if self.poll_bg:
+            return self.env.timeout(self.period)
+        wakeup = Wakeup(self.env)
+        self.bg_waiters.append(wakeup)
+        return wakeup
+
+    def bg_notify(self):
+        """Called whenever the state checked by the background processes changes
+        """
+        if self.bg_waiters:
+            waiters = self.bg_waiters
+            self.bg_waiters = []
+            for wakeup in waiters:
+                wakeup.trigger_after(self.period)
+
+class Field_mem(object):
+    """Preallocated memory with a typed-field layout: each field is stored in
+       its own signed integer array. Entries are read and written as lists of
+       field values in the order given by fields. None field values are stored
+       as FIELD_NONE and read back as None.
+    """
+    # reserved field value standing for None (the most negative long)
+    FIELD_NONE = -sys.maxint - 1
+
+    def __init__(self, depth, fields, fill=-1):
+        self.depth = depth
+        self.fields = fields
+        self.cols = [array('l', [fill])*depth for f in fields]
+
+    def __getitem__(self, addr):
+        return [None if col[addr] == self.FIELD_NONE else col[addr] for col in self.cols]
+
+    def __setitem__(self, addr, data):
+        for col, d in zip(self.cols, data):
+            col[addr] = self.FIELD_NONE if d is None else d
+
+    def __len__(self):
+        return self.depth
+
+class Op_profiler(object):
+    """Attributes memory accesses and clock cycles to the operation in progress
+       (e.g. search, enq_sl, deq_sl). Operations may nest, the accesses and
+       cycles of an inner operation are then excluded from the outer one.
+       Accesses are tagged with the innermost operation in progress when they
+       are issued. Disabled profilers do not record anything. Profilers of
+       concurrent pipeline stages can share one samples dict.
+    """
+    def __init__(self, env, enabled=True, samples=None):
+        self.env = env
+        self.enabled = enabled
+        # operations in progress, each frame is [op, start time, reads, writes, nested cycles]
+        self.stack = []
+        # op -> list of (reads, writes, cycles) tuples, one per occurrence
+        self.samples = samples if samples is not None else {}
+        # accesses issued while no operation was in progress
+        self.untagged_reads = 0
+        self.untagged_writes = 0
+
+    def begin(self, op):
+        """Start an occurrence of op, returns the frame to pass to end()
+        """
+        if not self.enabled:
+            return None
+        frame = [op, self.env.now, 0, 0, 0]
+        self.stack.append(frame)
+        return frame
+
+    def end(self, frame):
+        if frame is None:
+            return
+        # the frame is not necessarily on top if processes overlapped
+        i = self.stack.index(frame)
+        del self.stack[i]
+        (op, start, reads, writes, nested) = frame
+        cycles = self.env.now - start
+        if i > 0:
+            self.stack[i-1][4] += cycles
+        self.samples.setdefault(op, []).append((reads, writes, cycles - nested))
+
+    def read(self):
+        if len(self.stack) > 0:
+            self.stack[-1][2] += 1
+        else:
+            self.untagged_reads += 1
+
+    def write(self):
+        if len(self.stack) > 0:
+            self.stack[-1][3] += 1
+        else:
+            self.untagged_writes += 1
+
+    def histograms(self):
+        """Returns {op: {'reads': Counter, 'writes': Counter, 'cycles': Counter}}
+        """
+        hists = {}
+        for (op, samples) in self.samples.items():
+            hists[op] = dict((name, Counter(s[j] for s in samples)) for (j, name) in enumerate(('reads', 'writes', 'cycles')))
+        return hists
+
+    @staticmethod
+    def merge(profilers):
+        """Returns the samples of several profilers combined per op
+        """
+        samples = {}
+        for p in profilers:
+            for (op, s) in p.samples.items():
+                samples.setdefault(op, []).extend(s)
+        return samples
+
+    def __str__(self):
+        lines = []
+        for op in sorted(self.samples.keys()):
+            samples = self.samples[op]
+            n = len(samples)
+            lines.append('{}: count = {}, avg reads = {:.2f}, avg writes = {:.2f}, avg cycles = {:.2f}'.format(
+                op, n, sum(s[0] for s in samples)/float(n), sum(s[1] for s in samples)/float(n), sum(s[2] for s in samples)/float(n)))
+        return '\n'.join(lines)
+
 class BRAM(HW_sim_object):
-    def __init__(self, env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe=None, depth=128, write_latency=1, read_latency=1):
+    def __init__(self, env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe=None, depth=128, write_latency=1, read_latency=1, fields=None):
         super(BRAM, self).__init__(env, period)
         self.r_in_pipe = r_in_pipe
         self.r_out_pipe = r_out_pipe
@@ -75,9 +259,14 @@ class BRAM(HW_sim_object):
         self.write_latency = write_latency
         self.read_latency = read_latency
         self.depth = depth
-        self.mem = OrderedDict()
-        for addr in range(depth):
-            self.mem[addr] = None
+        # fields - optional tuple of field names (e.g. SL_NODE_FIELDS), entries are then
+        #          stored as typed integer fields rather than arbitrary python objects
+        if fields is None:
+            self.mem = depth*[None]
+        else:
+            self.mem = Field_mem(depth, fields)
+        # optional Op_profiler the accesses are reported to
+        self.profiler = None
 
         # register processes for simulation
         self.run()
@@ -86,6 +275,9 @@ class BRAM(HW_sim_object):
         self.env.process(self.write_sm())
         self.env.process(self.read_sm())
 
+    def valid_addr(self, addr):
+        return addr is not None and 0 <= addr < self.depth
+
     def write_sm(self):
         """
         State machine to write incomming data into memory
@@ -93,11 +285,12 @@ class BRAM(HW_sim_object):
         while True:
             # wait to receive incoming data
             (addr, data) = yield self.w_in_pipe.get()
+            if self.profiler is not None:
+                self.profiler.write()
             # model write latency
-            for i in range(self.write_latency):
-                yield self.wait_clock()
+            yield self.wait_clocks(self.write_latency)
             # try to write data into memory
-            if addr in self.mem.keys():
+            if self.valid_addr(addr):
                 self.mem[addr] = data
             else:
                 print >> sys.stderr, "ERROR: BRAM write_sm: specified address {} is out of range".format(addr)
@@ -114,11 +307,12 @@ class BRAM(HW_sim_object):
         while True:
             # wait to receive a read request
             addr = yield self.r_in_pipe.get()
+            if self.profiler is not None:
+                self.profiler.read()
             # model read latency
-            for i in range(self.read_latency):
-                yield self.wait_clock()
+            yield self.wait_clocks(self.read_latency)
             # try to read data from memory
-            if addr in self.mem.keys():
+            if self.valid_addr(addr):
                 data = self.mem[addr]
             else:
                 print >> sys.stderr, "ERROR: BRAM read_sm: specified address {} is out of range".format(addr)
@@ -127,6 +321,151 @@ class BRAM(HW_sim_object):
             # write data back
             self.r_out_pipe.put(data)
 
+class Mem_port(object):
+    """A port of a Pipelined_BRAM: read/write request and response pipes and
+       the queue of requests waiting to be issued
+    """
+    def __init__(self, env, r_in_pipe=None, r_out_pipe=None, w_in_pipe=None, w_out_pipe=None):
+        self.r_in_pipe = r_in_pipe if r_in_pipe is not None else simpy.Store(env)
+        self.r_out_pipe = r_out_pipe if r_out_pipe is not None else simpy.Store(env)
+        self.w_in_pipe = w_in_pipe if w_in_pipe is not None else simpy.Store(env)
+        self.w_out_pipe = w_out_pipe
+        # requests waiting to be issued: (write, addr, data, time queued)
+        self.queue = deque()
+        # statistics
+        self.issued = 0
+        self.conflicts = 0
+        self.wait_cycles = 0
+        self.max_queue = 0
+
+class Pipelined_BRAM(BRAM):
+    """Pipelined memory with num_ports ports and num_banks banks. Each port
+       issues at most one access per cycle and an access completes after the
+       read/write latency without blocking the port. Entries are interleaved
+       across the banks (bank = addr % num_banks) and each bank serves at most
+       bank_ports accesses per cycle, an access to a bank that is already in
+       use waits in its port queue (bank conflict).
+       Reads on the r pipes use port 0 and writes on the w pipes use port 1
+       (port 0 for a single port memory), any further ports are created with
+       their own pipes and are available in self.ports.
+    """
+    def __init__(self, env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe=None, depth=128, write_latency=1, read_latency=1, fields=None, num_ports=2, num_banks=1, bank_ports=2):
+        self.num_ports = num_ports
+        self.num_banks = num_banks
+        self.bank_ports = bank_ports
+        # statistics
+        self.bank_conflicts = 0
+        self.bank_accesses = num_banks*[0]
+        # requests waiting in the port queues
+        self.pending = 0
+        # port given priority in the next arbitration round
+        self.rr_port = 0
+        self.wakeup = None
+        super(Pipelined_BRAM, self).__init__(env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe, depth, write_latency, read_latency, fields)
+
+    def run(self):
+        # the ports are built here since BRAM.__init__ registers the processes
+        self.ports = [Mem_port(self.env) for i in range(self.num_ports)]
+        self.ports[0].r_in_pipe = self.r_in_pipe
+        self.ports[0].r_out_pipe = self.r_out_pipe
+        w_port = self.ports[1 % self.num_ports]
+        w_port.w_in_pipe = self.w_in_pipe
+        w_port.w_out_pipe = self.w_out_pipe
+        for port in self.ports:
+            self.env.process(self.request_sm(port, False))
+            self.env.process(self.request_sm(port, True))
+        self.env.process(self.arbiter_sm())
+
+    def bank(self, addr):
+        return addr % self.num_banks if self.valid_addr(addr) else 0
+
+    def request_sm(self, port, write):
+        """
+        State machine to queue the incoming read or write requests of a port
+        """
+        in_pipe = port.w_in_pipe if write else port.r_in_pipe
+        while True:
+            req = yield in_pipe.get()
+            (addr, data) = req if write else (req, None)
+            if self.profiler is not None:
+                if write:
+                    self.profiler.write()
+                else:
+                    self.profiler.read()
+            port.queue.append((write, addr, data, self.env.now))
+            port.max_queue = max(port.max_queue, len(port.queue))
+            self.pending += 1
+            if self.wakeup is not None and not self.wakeup.triggered:
+                self.wakeup.succeed()
+
+    def arbiter_sm(self):
+        """
+        State machine to issue up to one request per port every clock cycle
+        """
+        while True:
+            if self.pending == 0:
+                self.wakeup = self.env.event()
+                yield self.wakeup
+            self.issue()
+            yield self.wait_clock()
+
+    def issue(self):
+        bank_use = self.num_banks*[0]
+        for i in range(self.num_ports):
+            port = self.ports[(self.rr_port + i) % self.num_ports]
+            if len(port.queue) == 0:
+                continue
+            (write, addr, data, t_queued) = port.queue[0]
+            bank = self.bank(addr)
+            if bank_use[bank] == self.bank_ports:
+                self.bank_conflicts += 1
+                port.conflicts += 1
+                continue
+            bank_use[bank] += 1
+            self.bank_accesses[bank] += 1
+            port.queue.popleft()
+            self.pending -= 1
+            port.issued += 1
+            port.wait_cycles += (self.env.now - t_queued)/self.period
+            latency = self.write_latency if write else self.read_latency
+            self.env.timeout(latency*self.period).callbacks.append(self.completion(port, write, addr, data))
+        self.rr_port = (self.rr_port + 1) % self.num_ports
+
+    def completion(self, port, write, addr, data):
+        """Returns the callback that performs an access once its latency has elapsed
+        """
+        def complete(event):
+            if write:
+                if self.valid_addr(addr):
+                    self.mem[addr] = data
+                else:
+                    print >> sys.stderr, "ERROR: Pipelined_BRAM: write address {} is out of range".format(addr)
+                self.wr_count += 1
+                if port.w_out_pipe is not None:
+                    port.w_out_pipe.put(1)
+            else:
+                if self.valid_addr(addr):
+                    rd_data = self.mem[addr]
+                else:
+                    print >> sys.stderr, "ERROR: Pipelined_BRAM: read address {} is out of range".format(addr)
+                    rd_data = None
+                self.rd_count += 1
+                port.r_out_pipe.put(rd_data)
+        return complete
+
+    def __str__(self):
+        return 'reads = {}, writes = {}, bank conflicts = {}, bank accesses = {}, port wait cycles = {}'.format(
+            self.rd_count, self.wr_count, self.bank_conflicts, self.bank_accesses, [p.wait_cycles for p in self.ports])
+
+# Node/data memory models selectable with mem_impl
+MEM_IMPLS = {'bram': BRAM,
+             # true dual port: one read and one write every cycle
+             'dual_port': Pipelined_BRAM,
+             # single port: reads and writes share one access per cycle
+             'single_port': partial(Pipelined_BRAM, bank_ports=1),
+             # four interleaved single port banks
+             'banked': partial(Pipelined_BRAM, num_banks=4, bank_ports=1)}
+
 class FIFO(HW_sim_object):
     def __init__(self, env, period, r_in_pipe, r_out_pipe, w_in_pipe, w_out_pipe=None, maxsize=128, write_latency=1, read_latency=1, init_items=[]):
         super(FIFO, self).__init__(env, period)
@@ -137,7 +476,10 @@ class FIFO(HW_sim_object):
         self.write_latency = write_latency
         self.read_latency = read_latency
         self.maxsize = maxsize
-        self.items = init_items
+        self.items = deque(init_items)
+        # occupancy statistics
+        self.high_watermark = len(self.items)
+        self.low_watermark = len(self.items)
 
         # register processes for simulation
         self.run()
@@ -154,11 +496,12 @@ class FIFO(HW_sim_object):
             # wait to receive incoming data
             data = yield self.w_in_pipe.get()
             # model write latency
-            for i in range(self.write_latency):
-                yield self.wait_clock()
+            yield self.wait_clocks(self.write_latency)
             # try to write data into FIFO
             if len(self.items) < self.maxsize:
                 self.items.append(data)
+                if len(self.items) > self.high_watermark:
+                    self.high_watermark = len(self.items)
             else:
                 print >> sys.stderr, "ERROR: FIFO push_sm: FIFO full, cannot push {}".format(data)
             # indicate write_completion
@@ -174,20 +517,23 @@ class FIFO(HW_sim_object):
             # wait to receive a read request
             req = yield self.r_in_pipe.get()
             # model read latency
-            for i in range(self.read_latency):
-                yield self.wait_clock()
+            yield self.wait_clocks(self.read_latency)
             # try to read head element
             if len(self.items) > 0:
-                data = self.items[0]
-                self.items = self.items[1:]
+                data = self.items.popleft()
+                if len(self.items) < self.low_watermark:
+                    self.low_watermark = len(self.items)
             else:
                 print >> sys.stderr, "ERROR: FIFO pop_sm: attempted to read from empty FIFO"
                 data = None
             # write data back
             self.r_out_pipe.put(data)
 
+    def fill_level(self):
+        return (len(self.items))
+
     def __str__(self):
-        return str(self.items)
+        return str(list(self.items))
 
 class AXI_S_master(HW_sim_object):
     def __init__(self, env, period, out_pipe, bus_width, pkt_list):
@@ -206,55 +552,57 @@ class AXI_S_master(HW_sim_object):
         Inputs:
           - pkt_list : list of tuples of the form (scapy pkt, Tuser object)
         """
+        pkts = deque(pkt_list)
         while True:
             # wait for the next transmission
             yield self.wait_clock()
 
             # send one word at a time
-            if len(pkt_list) == 0:
+            if len(pkts) == 0:
                 # no more data to send so send blanks
                 tdata = '\x00'*self.bus_width
-                tuser = Tuser(0, 0, 0)
+                tuser = Tuser(0, 0, 0, 0, 0)
                 msg = AXI_S_message(tdata,0,0,0,tuser)
                 self.out_pipe.put(msg)
             else:
                 # send packets
-                pkt = pkt_list[0]
-                yield self.env.process(self.send_pkt(pkt))
-                # remove the pkt we just sent from the pkt_list
-                pkt_list = pkt_list[1:]
+                yield self.env.process(self.send_pkt(pkts.popleft()))
 
     def send_pkt(self, pkt_tuple):
         """Send a single packet (and associated metadata over AXI_stream interface)
         Input:
-          - pkt_tuple: 0th element is a scapy packet, 1st element is a Tuser object
-                       for that packet
+          - pkt_tuple: 0th element is a scapy packet (or raw bytes), 1st element
+                       is a Tuser object for that packet
         """
-        pkt_str = str(pkt_tuple[0])
+        pkt_str = bytes(pkt_tuple[0])
         tuser = pkt_tuple[1]
-        while len(pkt_str) > self.bus_width:
+        offset = 0
+        while len(pkt_str) - offset > self.bus_width:
             # at least one more word of this packet after this one
-            tdata = pkt_str[0:self.bus_width]
+            tdata = pkt_str[offset:offset+self.bus_width]
             tvalid = 1
             tkeep = (1<<self.bus_width)-1
             tlast = 0
             msg = AXI_S_message(tdata, tvalid, tkeep, tlast, tuser)
             self.out_pipe.put(msg)
             yield self.wait_clock()
-            pkt_str = pkt_str[self.bus_width:]
+            offset += self.bus_width
         # this is the last word of the packet
-        tdata = pkt_str + '\x00'*(self.bus_width - len(pkt_str))
+        tdata = pkt_str[offset:] + '\x00'*(self.bus_width - (len(pkt_str) - offset))
         tvalid = 1
-        tkeep = (1<<len(pkt_str))-1
-        tlast = 0
+        tkeep = (1<<(len(pkt_str) - offset))-1
+        tlast = 1
         msg = AXI_S_message(tdata, tvalid, tkeep, tlast, tuser)
         self.out_pipe.put(msg)
 
 class AXI_S_slave(HW_sim_object):
-    def __init__(self, env, period, in_pipe, bus_width):
+    def __init__(self, env, period, in_pipe, bus_width, out_pipe=None):
         super(AXI_S_slave, self).__init__(env, period)
         self.in_pipe = in_pipe
         self.bus_width = bus_width # Bytes
+        # pipe receiving (pkt bytes, Tuser object) on the last word of each pkt,
+        # every word is printed instead if None
+        self.out_pipe = out_pipe
 
         # register the processes for simulation
         self.run()
@@ -263,42 +611,123 @@ class AXI_S_slave(HW_sim_object):
         self.env.process(self.read_pkts())
 
     def read_pkts(self):
+        words = []
         while True:
             msg = yield self.in_pipe.get()
-            print ('slave @ {:03d} msg received : {}'.format(self.env.now, msg))
+            if self.out_pipe is None:
+                print ('slave @ {:03d} msg received : {}'.format(self.env.now, msg))
+                continue
+            if msg.tvalid == 0:
+                continue
+            # tkeep is contiguous from the first byte of the word
+            words.append(msg.tdata[:bin(msg.tkeep).count('1')])
+            if msg.tlast == 1:
+                self.out_pipe.put((''.join(words), msg.tuser))
+                words = []
+
+class AXI_S_tlm_master(HW_sim_object):
+    """Transaction-level version of AXI_S_master: each pkt is sent as a
+       single AXI_S_message holding the whole pkt, put at the cycle at which
+       the beat-level master puts its last word (ceil(len/bus_width) cycles
+       per pkt). The process ends when pkt_list has been sent instead of
+       sending blank words.
+    """
+    def __init__(self, env, period, out_pipe, bus_width, pkt_list):
+        super(AXI_S_tlm_master, self).__init__(env, period)
+        self.out_pipe = out_pipe
+        self.bus_width = bus_width # Bytes
+
+        # register the processes for simulation
+        self.run(pkt_list)
+
+    def run(self, pkt_list):
+        self.env.process(self.write_pkts(pkt_list))
 
+    def num_beats(self, pkt_len):
+        return max(1, (pkt_len + self.bus_width - 1)//self.bus_width)
+
+    def write_pkts(self, pkt_list):
+        """Send pkt_list over AXI_stream interface
+        Inputs:
+          - pkt_list : list of tuples of the form (scapy pkt or raw bytes, Tuser object)
+        """
+        for (pkt, tuser) in pkt_list:
+            pkt_str = bytes(pkt)
+            yield self.env.timeout(self.num_beats(len(pkt_str))*self.period)
+            msg = AXI_S_message(pkt_str, 1, (1<<len(pkt_str))-1, 1, tuser)
+            self.out_pipe.put(msg)
+
+class AXI_S_tlm_slave(HW_sim_object):
+    """Transaction-level version of AXI_S_slave, receives whole pkts from
+       AXI_S_tlm_master
+    """
+    def __init__(self, env, period, in_pipe, bus_width, out_pipe=None):
+        super(AXI_S_tlm_slave, self).__init__(env, period)
+        self.in_pipe = in_pipe
+        self.bus_width = bus_width # Bytes
+        # pipe receiving (pkt bytes, Tuser object), every pkt is printed instead if None
+        self.out_pipe = out_pipe
+
+        # register the processes for simulation
+        self.run()
+
+    def run(self):
+        self.env.process(self.read_pkts())
+
+    def read_pkts(self):
+        while True:
+            msg = yield self.in_pipe.get()
+            if self.out_pipe is None:
+                print ('slave @ {:03d} msg received : {}'.format(self.env.now, msg))
+            else:
+                self.out_pipe.put((msg.tdata, msg.tuser))
+
+# AXI stream master/slave pairs: one message per bus word or per pkt
+AXI_S_MASTER_IMPLS = {'beat': AXI_S_master, 'tlm': AXI_S_tlm_master}
+AXI_S_SLAVE_IMPLS = {'beat': AXI_S_slave, 'tlm': AXI_S_tlm_slave}
 
 class out_reg(HW_sim_object):
     def __init__(self, env, period, ins_in_pipe, ins_out_pipe, rem_in_pipe, rem_out_pipe, width=16, latency=1):
         super(out_reg, self).__init__(env, period)
-        self.val = width*[None]
-        self.ptrs = width*[None]
         self.ins_in_pipe = ins_in_pipe
         self.ins_out_pipe = ins_out_pipe
         self.rem_in_pipe = rem_in_pipe
         self.rem_out_pipe = rem_out_pipe
         self.width = width
         self.latency = latency
+        self.init_entries()
         self.num_entries = 0
         self.next = -1
         self.next_valid = 0
         self.busy = 0
+        # callbacks called whenever next, next_valid or busy change
+        self.watchers = []
         
         # register processes for simulation
         self.run()
+
+    def init_entries(self):
+        """Allocate the storage of the register entries
+        """
+        self.val = self.width*[None]
+        self.ptrs = self.width*[None]
     
     def run(self):
         self.env.process(self.insert())
         self.env.process(self.remove())
 
+    def notify(self):
+        for watcher in self.watchers:
+            watcher()
+
     def insert(self):
         while True:
             # Wait for insert request
             (val, ptrs) = yield self.ins_in_pipe.get()
             self.busy = 1
             self.next_valid = 0
-            for i in range(self.latency):
-                yield self.wait_clock()
+            self.notify()
+            yield self.wait_clocks(self.latency)
             # Room available in register, just add the entry to the register
             if self.num_entries < self.width:
                 self.val[self.num_entries] = val
@@ -327,6 +756,7 @@ class out_reg(HW_sim_object):
             self.next = min(self.val[:self.num_entries])
             self.next_valid = 1
             self.busy = 0
+            self.notify()
             
     def remove(self):
         while True:
@@ -334,6 +764,7 @@ class out_reg(HW_sim_object):
             yield self.rem_in_pipe.get()
             self.busy = 1
             self.next_valid = 0
+            self.notify()
 #            for i in range(self.latency):
 #                yield self.wait_clock()
             yield self.wait_clock()
@@ -350,13 +781,160 @@ class out_reg(HW_sim_object):
                 self.next = min(self.val[:self.num_entries])
                 self.next_valid = 1
             self.busy = 0
+            self.notify()
            
             # Send removed value through pipe
             self.rem_out_pipe.put((min_val, min_ptrs))
 
+class heap_out_reg(out_reg):
+    """out_reg variant that keeps its entries in a pair of indexed heaps so
+       that insert, evict and remove cost O(log W) rather than several O(W)
+       passes over the register. Each entry carries the position it would have
+       in out_reg (appended entries get a new position, an entry that evicts
+       the max takes over the max's position) so ties are broken exactly as
+       in out_reg.
+    """
+    def init_entries(self):
+        # maps: entry ID --> (val, ptrs, pos)
+        self.entries = {}
+        # heaps of (val, pos, entry ID) and (-val, pos, entry ID), stale IDs are skipped lazily
+        self.min_heap = []
+        self.max_heap = []
+        self.next_pos = 0
+        self.next_id = 0
+
+    @property
+    def val(self):
+        return [e[0] for e in sorted(self.entries.values(), key=lambda e: e[2])] + (self.width - self.num_entries)*[None]
+
+    @property
+    def ptrs(self):
+        return [e[1] for e in sorted(self.entries.values(), key=lambda e: e[2])] + (self.width - self.num_entries)*[None]
+
+    def add_entry(self, val, ptrs, pos):
+        eid = self.next_id
+        self.next_id += 1
+        self.entries[eid] = (val, ptrs, pos)
+        heapq.heappush(self.min_heap, (val, pos, eid))
+        heapq.heappush(self.max_heap, (-val, pos, eid))
+        # drop the stale entries once they dominate the heaps
+        if len(self.min_heap) + len(self.max_heap) > 8*self.width:
+            self.min_heap = [(v, p, i) for (i, (v, d, p)) in self.entries.items()]
+            self.max_heap = [(-v, p, i) for (i, (v, d, p)) in self.entries.items()]
+            heapq.heapify(self.min_heap)
+            heapq.heapify(self.max_heap)
+
+    def top_id(self, heap):
+        while heap[0][2] not in self.entries:
+            heapq.heappop(heap)
+        return heap[0][2]
+
+    def insert(self):
+        while True:
+            # Wait for insert request
+            (val, ptrs) = yield self.ins_in_pipe.get()
+            self.busy = 1
+            self.next_valid = 0
+            self.notify()
+            yield self.wait_clocks(self.latency)
+            # Room available in register, just add the entry to the register
+            if self.num_entries < self.width:
+                self.add_entry(val, ptrs, self.next_pos)
+                self.next_pos += 1
+                self.num_entries += 1
+                # -1 signals to the caller that there was room in the register to insert the entry without displacing another one
+                self.ins_out_pipe.put((-1, [-1, -1]))
+            else:
+                # No room available
+                # Find max value in register
+                max_id = self.top_id(self.max_heap)
+                (max_val, max_ptrs, max_pos) = self.entries[max_id]
+                # If new value is smaller than max
+                if val < max_val:
+                    # Replace max value with new value
+                    del self.entries[max_id]
+                    self.add_entry(val, ptrs, max_pos)
+                    # Return removed max value and data through pipe
+                    # so can they can be inserted in skip list
+                    self.ins_out_pipe.put((max_val, max_ptrs))
+                else:
+                    # Send new val and data through pipe so they can be inserted in skip list
+                    self.ins_out_pipe.put((val, ptrs))
+            # Output min value
+            self.next = self.entries[self.top_id(self.min_heap)][0]
+            self.next_valid = 1
+            self.busy = 0
+            self.notify()
+
+    def remove(self):
+        while True:
+            # Wait for remove request
+            yield self.rem_in_pipe.get()
+            self.busy = 1
+            self.next_valid = 0
+            self.notify()
+            yield self.wait_clock()
+            # Find min value in register
+            min_id = self.top_id(self.min_heap)
+            (min_val, min_ptrs, min_pos) = self.entries.pop(min_id)
+            heapq.heappop(self.min_heap)
+            self.num_entries -= 1
+            if self.num_entries > 0:
+                self.next = self.entries[self.top_id(self.min_heap)][0]
+                self.next_valid = 1
+            self.busy = 0
+            self.notify()
+
+            # Send removed value through pipe
+            self.rem_out_pipe.put((min_val, min_ptrs))
+
+# maps: out_reg implementation name --> class
+OUT_REG_IMPLS = {'list': out_reg, 'heap': heap_out_reg}
+
 def pad_pkt(pkt, size):
     if len(pkt) >= size:
         return pkt
     else:
         return pkt / ('\x00'*(size - len(pkt)))
 
+def csum_update(csum, old, new):
+    """Incrementally update a 16-bit internet checksum when one of the
+       16-bit words it covers changes from old to new (RFC 1624)
+    """
+    s = (~csum & 0xffff) + (~old & 0xffff) + new
+    s = (s & 0xffff) + (s >> 16)
+    s = (s & 0xffff) + (s >> 16)
+    return ~s & 0xffff
+
+class Pkt_template(object):
+    """Raw bytes of a zero padded Ether/IP/TCP pkt, built once with scapy
+       Every pkt is a copy of the template cut to its length, with the IP
+       length and the TCP ports patched and the checksums updated, so no
+       scapy pkt is built per pkt
+    """
+    def __init__(self, max_len):
+        pkt = pad_pkt(Ether()/IP()/TCP(sport=0, dport=0), max_len)
+        self.buf = bytearray(bytes(pkt))
+        self.ip_offset = len(Ether())
+        self.tcp_offset = self.ip_offset + len(IP())
+        self.min_len = self.tcp_offset + len(TCP())
+        (self.ip_len, self.ip_csum) = struct.unpack_from('!H6xH', self.buf, self.ip_offset + 2)
+        self.tcp_csum = struct.unpack_from('!H', self.buf, self.tcp_offset + 16)[0]
+
+    def make(self, pkt_len, sport, dport):
+        """Returns the bytearray of a pkt of pkt_len bytes (at least the
+           headers and at most the template) with the given TCP ports
+        """
+        pkt_len = min(max(pkt_len, self.min_len), len(self.buf))
+        pkt = self.buf[:pkt_len]
+        ip_len = pkt_len - self.ip_offset
+        ip_csum = csum_update(self.ip_csum, self.ip_len, ip_len)
+        struct.pack_into('!H', pkt, self.ip_offset + 2, ip_len)
+        struct.pack_into('!H', pkt, self.ip_offset + 10, ip_csum)
+        # the TCP length of the pseudo header changes with the IP length
+        tcp_csum = csum_update(self.tcp_csum, self.ip_len - (self.tcp_offset - self.ip_offset), ip_len - (self.tcp_offset - self.ip_offset))
+        tcp_csum = csum_update(csum_update(tcp_csum, 0, sport), 0, dport)
+        struct.pack_into('!HH', pkt, self.tcp_offset, sport, dport)
+        struct.pack_into('!H', pkt, self.tcp_offset + 16, tcp_csum)
+        return pkt
+
@@ -2,26 +2,48 @@
 import sys, os
 from scapy.all import *
 import simpy
-from hwsim_utils import HW_sim_object, BRAM, Tuser, Fifo
+from collections import deque
+from hwsim_utils import HW_sim_object, MEM_IMPLS, Tuser, Fifo
 
 SEG_SIZE = 64 # bytes of packet data
 MAX_SEGMENTS = 20
 MAX_PKTS = 20
 
 class Pkt_segment(object):
-    def __init__(self, tdata, next_seg=None):
+    def __init__(self, tdata, next_seg=None, next_next_seg=None):
         # SEG_SIZE pkt segment
         self.tdata = tdata
 
         # pointer to the next pkt segment
         self.next_seg = next_seg
+        # pointer to the segment after the next one, so that it can be
+        # prefetched while the next one is read
+        self.next_next_seg = next_next_seg
 
     def __str__(self):
         return "{{tdata: {}, next_seg: {} }}".format(''.join('{:02x}'.format(ord(c)) for c in self.tdata), self.next_seg)
 
 
 class Pkt_storage(HW_sim_object):
-    def __init__(self, env, period, pkt_in_pipe, pkt_out_pipe, ptr_in_pipe, ptr_out_pipe, max_segments=MAX_SEGMENTS, max_pkts=MAX_PKTS, rd_latency=1, wr_latency=1):
+    """Stores packets as linked lists of SEG_SIZE segments and their metadata
+       The segments are memoryview slices of the bytes of the packet, so
+       segmenting does not copy the payload. With raw_pkts, removed packets
+       are output as raw bytes instead of being parsed back into scapy pkts.
+
+       The ptrs of a pkt are output as soon as it is accepted, so the skip
+       list enqueue overlaps with the segment writes. At most ingress_depth
+       pkts can have segment writes in flight (no limit if None), the next
+       pkt is accepted once the oldest one is written.
+
+       Pkts are read one at a time, one segment after the other, unless
+       egress_depth is set. Then up to egress_depth pkts are read at the same
+       time, and each segment read also prefetches the segment after the
+       next one, so that two segment reads of a pkt are in flight. The
+       reads only overlap with a pipelined memory (e.g. mem_impl='dual_port').
+       Pkts are output in the order they were requested. A pkt is not read
+       before all its segments are written.
+    """
+    def __init__(self, env, period, pkt_in_pipe, pkt_out_pipe, ptr_in_pipe, ptr_out_pipe, max_segments=MAX_SEGMENTS, max_pkts=MAX_PKTS, rd_latency=1, wr_latency=1, mem_impl='bram', raw_pkts=False, ingress_depth=None, egress_depth=None):
         super(Pkt_storage, self).__init__(env, period)
 
         # read the incomming pkt and metadata from here
@@ -37,17 +59,41 @@ class Pkt_storage(HW_sim_object):
         self.segments_r_in_pipe = simpy.Store(env)
         self.segments_r_out_pipe = simpy.Store(env)
         self.segments_w_in_pipe = simpy.Store(env)
+        self.segments_w_out_pipe = simpy.Store(env)
         # maps: segment ID --> Pkt_seg object
-        self.segments = BRAM(env, period, self.segments_r_in_pipe, self.segments_r_out_pipe, self.segments_w_in_pipe, depth=max_segments, write_latency=wr_latency, read_latency=rd_latency)
+        self.segments = MEM_IMPLS[mem_impl](env, period, self.segments_r_in_pipe, self.segments_r_out_pipe, self.segments_w_in_pipe, self.segments_w_out_pipe, depth=max_segments, write_latency=wr_latency, read_latency=rd_latency)
 
         self.metadata_r_in_pipe = simpy.Store(env)
         self.metadata_r_out_pipe = simpy.Store(env)
         self.metadata_w_in_pipe = simpy.Store(env)
         # maps: metadata ptr --> tuser object
-        self.metadata = BRAM(env, period, self.metadata_r_in_pipe, self.metadata_r_out_pipe, self.metadata_w_in_pipe, depth=max_pkts, write_latency=wr_latency, read_latency=rd_latency)
+        self.metadata = MEM_IMPLS[mem_impl](env, period, self.metadata_r_in_pipe, self.metadata_r_out_pipe, self.metadata_w_in_pipe, depth=max_pkts, write_latency=wr_latency, read_latency=rd_latency)
 
         self.max_segments = max_segments
         self.max_pkts = max_pkts
+        self.raw_pkts = raw_pkts
+
+        # max number of pkts being written, None for no limit
+        self.ingress_depth = ingress_depth
+        # [segment writes left, meta_ptr] of each pkt being written, oldest first
+        self.ingress_pkts = deque()
+        # meta_ptr --> event triggered once the pkt is written (None until waited on)
+        self.unwritten = {}
+        # event an incoming pkt waits on until a pkt is written
+        self.ingress_slot = None
+        # ingress statistics
+        self.written_pkts = 0
+        self.last_write_time = 0
+
+        # max number of pkts being read, None for reading one pkt at a time
+        self.egress_depth = egress_depth
+        # [pkt, tuser] of the pkts being read, in request order, pkt is None until read
+        self.egress_pkts = deque()
+        # event a read request waits on until a pkt is output
+        self.egress_slot = None
+        # events of the outstanding reads of each memory, in issue order
+        self.segment_reads = deque()
+        self.metadata_reads = deque()
 
         # stores ID of free segments
         self.free_seg_list = Fifo(max_segments)
@@ -70,16 +116,26 @@ class Pkt_storage(HW_sim_object):
         for i in range(self.max_pkts):
             self.free_meta_list.push(i)
 
+        self.free_seg_list.reset_watermarks()
+        self.free_meta_list.reset_watermarks()
+
     def run(self):
         """Register the processes with the simulation environment
         """
         self.env.process(self.insertion_sm())
-        self.env.process(self.removal_sm())
+        self.env.process(self.write_done_sm())
+        if self.egress_depth is None:
+            self.env.process(self.removal_sm())
+        else:
+            self.env.process(self.egress_sm())
+            self.env.process(self.read_done_sm(self.segments_r_out_pipe, self.segment_reads))
+            self.env.process(self.read_done_sm(self.metadata_r_out_pipe, self.metadata_reads))
 
 
     def insertion_sm(self):
         """Constantly read the in_pipe and write incomming data into packet storage
-           Items that come out of the in_pipe should be of the form: (scapy pkt, Tuser object)
+           Items that come out of the in_pipe should be of the form: (pkt, Tuser object),
+           pkt is a scapy pkt or its raw bytes
            Reads:
              - self.pkt_in_pipe
            Writes:
@@ -89,32 +145,59 @@ class Pkt_storage(HW_sim_object):
             # wait for a pkt to come in
             (pkt, tuser) = yield self.pkt_in_pipe.get() 
 
+            # wait until there is room in the ingress pipeline
+            while self.ingress_depth is not None and len(self.ingress_pkts) >= self.ingress_depth:
+                self.ingress_slot = self.env.event()
+                yield self.ingress_slot
+
             # get a free metadata block
             meta_ptr = self.free_meta_list.pop()
-            # get a free segment
-            cur_seg_ptr = self.free_seg_list.pop()
+            # get the free segments
+            pkt_data = memoryview(pkt if isinstance(pkt, (bytes, bytearray)) else bytes(pkt))
+            num_segs = max(1, (len(pkt_data) + SEG_SIZE - 1)//SEG_SIZE)
+            seg_ptrs = [self.free_seg_list.pop() for i in range(num_segs)] + [None, None]
 
-            head_seg_ptr = cur_seg_ptr
+            head_seg_ptr = seg_ptrs[0]
             # write the head_seg_ptr and meta_ptr so skip list can start insertion ASAP
             self.ptr_out_pipe.put((head_seg_ptr, meta_ptr))
 
             # write the metadata block into BRAM
             self.metadata_w_in_pipe.put((meta_ptr, tuser))
 
-            # write the pkt into segments
-            pkt_str = str(pkt)
-            while len(pkt_str) > SEG_SIZE:
-                tdata = pkt_str[0:SEG_SIZE]
-                next_seg_ptr = self.free_seg_list.pop()
-                # create the new segment
-                self.segments_w_in_pipe.put((cur_seg_ptr, Pkt_segment(tdata, next_seg_ptr)))
-                pkt_str = pkt_str[SEG_SIZE:]
-                cur_seg_ptr = next_seg_ptr 
-            tdata = pkt_str
-            next_seg_ptr = None
-            # create the final segment for the packet
-            self.segments_w_in_pipe.put((cur_seg_ptr, Pkt_segment(tdata, next_seg_ptr)))
+            # write the pkt into segments, slicing the view does not copy the data
+            self.ingress_pkts.append([num_segs, meta_ptr])
+            self.unwritten[meta_ptr] = None
+            for i in range(num_segs):
+                tdata = pkt_data[i*SEG_SIZE:(i+1)*SEG_SIZE]
+                self.segments_w_in_pipe.put((seg_ptrs[i], Pkt_segment(tdata, seg_ptrs[i+1], seg_ptrs[i+2])))
+
+
+    def write_done_sm(self):
+        """
+        Counts the completed segment writes to track the pkts being written
+        Reads:
+          - self.segments_w_out_pipe
+        """
+        while True:
+            yield self.segments_w_out_pipe.get()
+            self.ingress_pkts[0][0] -= 1
+            if self.ingress_pkts[0][0] == 0:
+                (num_segs, meta_ptr) = self.ingress_pkts.popleft()
+                written = self.unwritten.pop(meta_ptr)
+                if written is not None:
+                    written.succeed()
+                self.written_pkts += 1
+                self.last_write_time = self.env.now
+                if self.ingress_slot is not None:
+                    self.ingress_slot.succeed()
+                    self.ingress_slot = None
 
+    def written_event(self, meta_ptr):
+        """Returns the event triggered once the pkt of meta_ptr is written
+        """
+        if self.unwritten[meta_ptr] is None:
+            self.unwritten[meta_ptr] = self.env.event()
+        return self.unwritten[meta_ptr]
 
     def removal_sm(self):
         """
@@ -127,6 +210,8 @@ class Pkt_storage(HW_sim_object):
         while True:
             # wait for a read request
             (head_seg_ptr, meta_ptr) = yield self.ptr_in_pipe.get()
+            if meta_ptr in self.unwritten:
+                yield self.written_event(meta_ptr)
 
             # read the metadata
             self.metadata_r_in_pipe.put(meta_ptr) # send read request
@@ -134,7 +219,7 @@ class Pkt_storage(HW_sim_object):
             self.free_meta_list.push(meta_ptr) # add meta_ptr to free list
    
             # read the packet
-            pkt_str = ''
+            pkt_data = bytearray()
             cur_seg_ptr = head_seg_ptr
             while (cur_seg_ptr is not None):
                 # send the read request
@@ -142,13 +227,90 @@ class Pkt_storage(HW_sim_object):
                 # wait for response
                 pkt_seg = yield self.segments_r_out_pipe.get()
 
-                pkt_str += pkt_seg.tdata
+                # appending to the bytearray only copies the new segment
+                pkt_data += pkt_seg.tdata
                 # add segment to free list
                 self.free_seg_list.push(cur_seg_ptr)
                 cur_seg_ptr = pkt_seg.next_seg
     
-            # reconstruct the final scapy packet
-            pkt = Ether(pkt_str)
+            # reconstruct the final packet
+            pkt = bytes(pkt_data) if self.raw_pkts else Ether(bytes(pkt_data))
             # Write the final pkt and metadata
             self.pkt_out_pipe.put((pkt, tuser))
 
+    def read(self, r_in_pipe, reads, addr):
+        """Send a read request, returns the event triggered with the data
+        """
+        read = self.env.event()
+        reads.append(read)
+        r_in_pipe.put(addr)
+        return read
+
+    def read_done_sm(self, r_out_pipe, reads):
+        """
+        Passes the read responses of a memory to the outstanding reads, the
+        responses come back in the order of the requests
+        Reads:
+          - r_out_pipe
+        """
+        while True:
+            data = yield r_out_pipe.get()
+            reads.popleft().succeed(data)
+
+    def egress_sm(self):
+        """
+        Receives requests to dequeue pkts and metadata from storage and
+        starts reading up to egress_depth pkts at the same time
+        Reads:
+          - self.ptr_in_pipe
+        """
+        while True:
+            # wait for a read request
+            (head_seg_ptr, meta_ptr) = yield self.ptr_in_pipe.get()
+            # wait until there is room in the egress pipeline
+            while len(self.egress_pkts) >= self.egress_depth:
+                self.egress_slot = self.env.event()
+                yield self.egress_slot
+            entry = [None, None]
+            self.egress_pkts.append(entry)
+            self.env.process(self.read_pkt(head_seg_ptr, meta_ptr, entry))
+
+    def read_pkt(self, head_seg_ptr, meta_ptr, entry):
+        """
+        Reads a pkt, the segment after the next one is prefetched with each
+        segment so that two segment reads are in flight
+        Writes:
+          - self.pkt_out_pipe
+        """
+        if meta_ptr in self.unwritten:
+            yield self.written_event(meta_ptr)
+        # read the metadata and the head segment at the same time
+        meta_read = self.read(self.metadata_r_in_pipe, self.metadata_reads, meta_ptr)
+        seg_reads = deque([(head_seg_ptr, self.read(self.segments_r_in_pipe, self.segment_reads, head_seg_ptr))])
+        tuser = yield meta_read
+        self.free_meta_list.push(meta_ptr)
+
+        pkt_data = bytearray()
+        head = True
+        while len(seg_reads) > 0:
+            (seg_ptr, seg_read) = seg_reads.popleft()
+            pkt_seg = yield seg_read
+            pkt_data += pkt_seg.tdata
+            self.free_seg_list.push(seg_ptr)
+            # the next segment was prefetched, except after the head segment
+            if head and pkt_seg.next_seg is not None:
+                seg_reads.append((pkt_seg.next_seg, self.read(self.segments_r_in_pipe, self.segment_reads, pkt_seg.next_seg)))
+            if pkt_seg.next_next_seg is not None:
+                seg_reads.append((pkt_seg.next_next_seg, self.read(self.segments_r_in_pipe, self.segment_reads, pkt_seg.next_next_seg)))
+            head = False
+
+        # reconstruct the final packet
+        entry[0] = bytes(pkt_data) if self.raw_pkts else Ether(bytes(pkt_data))
+        entry[1] = tuser
+        # output the pkts that are read in request order
+        while len(self.egress_pkts) > 0 and self.egress_pkts[0][0] is not None:
+            (pkt, tuser) = self.egress_pkts.popleft()
+            self.pkt_out_pipe.put((pkt, tuser))
+        if self.egress_slot is not None:
+            self.egress_slot.succeed()
+            self.egress_slot = None
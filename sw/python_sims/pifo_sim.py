@@ -5,15 +5,121 @@ from matplotlib.backends.backend_pdf import PdfPages
 import matplotlib.pyplot as plt
 
 import sys, os
+import time, random
+import inspect
+import multiprocessing
 import numpy as np
 import simpy
-from pifo_tb import Pifo_tb
+from hwsim_utils import HW_sim_object, Op_profiler, OUT_REG_IMPLS
+from pifo_tb import Pifo_tb, MAX_RANK
+from pifo_tree import simulate_tree, cycles_per_pkt, CLK_RATE
+from pifo_top import simulate_ingress, simulate_egress
+from pipe_skip_list import SkipList as SkipList_pipe
+from sim_cache import Sim_cache, MAX_CACHE_BYTES
+from stream_stats import Stream_stats, QUANTILES
 
-LINE_STYLES = {'prob':'--', 'det':'-'}
+LINE_STYLES = {'prob':'--', 'det':'-', 'pipe':':', 'bucket':'-.'}
+# skip list operations reported by the profiler
+PROFILE_OPS = ['init', 'search', 'enq_sl', 'push_up', 'deq_sl', 'deq_collapse', 'scan']
+# columns of the per-operation profile samples
+PROFILE_FIELDS = ['reads', 'writes', 'cycles']
+# columns of the free list watermarks: free entries at most and least
+FREE_LIST_FIELDS = ['size', 'high', 'low']
+
+def simulate(fill_level, pkt_len, num_skipLists, num_samples=100, outreg_width=1, enq_fifo_depth=1, rd_latency=1, wr_latency=1, sl_impl='det', outreg_latency=1, outreg_impl='list', fast_clock=False, seed=None, keep_samples=True, profile=False, mem_impl='bram', search_prefetch=False, max_rank=MAX_RANK, shard_policy='min_entries', raw_pkts=False, poll_bg=False, ingress_depth=None, egress_depth=None):
+    """Run a single simulation point and return its Sim_results
+    """
+    # the modes below are class attributes, restore them once the point is done
+    # so that they do not leak into later simulations in the same process
+    saved_modes = (HW_sim_object.fast_clock, HW_sim_object.poll_bg)
+    # select the timing mode used to model clock cycles and latencies
+    HW_sim_object.fast_clock = fast_clock
+    # reference mode where background processes check their state every cycle
+    HW_sim_object.poll_bg = poll_bg
+    try:
+        env = simpy.Environment()
+        period = 1
+        snd_rate = 1 # not currently used
+        # instantiate the testbench
+        ps_tb = Pifo_tb(env, period, snd_rate, fill_level, pkt_len, num_skipLists, num_samples, outreg_width, enq_fifo_depth, rd_latency, wr_latency, sl_impl, outreg_latency, outreg_impl, keep_samples, seed, profile, mem_impl, search_prefetch, max_rank, shard_policy, raw_pkts, ingress_depth, egress_depth)
+        # run the simulation
+        env.run()
+    finally:
+        (HW_sim_object.fast_clock, HW_sim_object.poll_bg) = saved_modes
+    # collect the results
+    enq_latencies = np.array(ps_tb.enq_latencies)
+    deq_latencies = np.array(ps_tb.deq_latencies)
+    op_profile = None
+    if profile:
+        samples = Op_profiler.merge([sl.profiler for sl in ps_tb.pifo.skip_list_wrapper.sl])
+        op_profile = dict((op, np.array(s, dtype=int).reshape(-1, len(PROFILE_FIELDS))) for (op, s) in samples.items())
+    pifo = ps_tb.pifo
+    free_lists = {}
+    for (i, sl) in enumerate(pifo.skip_list_wrapper.sl):
+        if isinstance(sl, SkipList_pipe):
+            # the pipelined skip list has one free list per level
+            for (j, level) in enumerate(sl.levels):
+                free_lists['sl_nodes_{}_level_{:02d}'.format(i, j)] = free_list_watermarks(level.free_node_list)
+        else:
+            free_lists['sl_nodes_{}'.format(i)] = free_list_watermarks(sl.free_node_list)
+    free_lists['pkt_segments'] = free_list_watermarks(pifo.pkt_store.free_seg_list)
+    free_lists['pkt_metadata'] = free_list_watermarks(pifo.pkt_store.free_meta_list)
+    sim_res = Sim_results(enq_latencies, deq_latencies, ps_tb.enq_stats, ps_tb.deq_stats, ps_tb.seed, op_profile, free_lists)
+    return sim_res
+
+def free_list_watermarks(free_list):
+    """Returns the FREE_LIST_FIELDS of a free list Fifo, the watermarks are
+       counted from the end of its initialization
+    """
+    return np.array([free_list.maxsize, free_list.high_watermark, free_list.low_watermark])
+
+def time_out_reg(outreg_impl, width, num_ops, seed):
+    """Drive an out_reg of the given implementation on its own with num_ops
+       random replace (remove then insert) or insert operations once it is
+       full, and return the wall clock seconds spent in the simulation
+    """
+    rng = random.Random(seed)
+    env = simpy.Environment()
+    pipes = [simpy.Store(env) for i in range(4)]
+    reg = OUT_REG_IMPLS[outreg_impl](env, 1, pipes[0], pipes[1], pipes[2], pipes[3], width)
+
+    def drive():
+        for i in range(width + num_ops):
+            if i >= width and rng.random() < 0.5:
+                reg.rem_in_pipe.put(True)
+                yield reg.rem_out_pipe.get()
+            reg.ins_in_pipe.put((rng.randint(0, MAX_RANK), [i, i]))
+            yield reg.ins_out_pipe.get()
+
+    env.process(drive())
+    start = time.time()
+    env.run()
+    return time.time() - start
+
+def run_point(point):
+    """Worker function for parallel sweeps
+    Input:
+      - point : tuple of (index, simulate() keyword arguments)
+    """
+    (index, params) = point
+    return (index, simulate(**params))
+
+def sim_params(*args, **kwargs):
+    """Returns the complete dict of simulate() arguments (defaults included) for a call
+    """
+    return inspect.getcallargs(simulate, *args, **kwargs)
 
 class Pifo_sim(object):
-    def __init__(self, outDir):
+    def __init__(self, outDir, num_procs=1, seed=None, cache_dir=None, cache_size=MAX_CACHE_BYTES):
         self.outDir = outDir
+        # number of worker processes used to run the points of a sweep
+        self.num_procs = num_procs
+        # base seed for sweeps, point i is seeded with seed + i
+        self.seed = seed
+        # persistent cache of seeded simulation results
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = Sim_cache(cache_dir, cache_size)
         if not os.path.exists(outDir):
             os.makedirs(outDir)
 
@@ -30,95 +136,390 @@ class Pifo_sim(object):
     def test_fill_level(self, levels, pkt_len, num_skipLists, sl_impls):
         print 'testing fill level...'
         for impl in sl_impls:
-            results = []
-            for level in levels:
-                sim_res = self.run_sim(level, pkt_len, num_skipLists, sl_impl=impl)
-                print 'finished sim for level = {}'.format(level)
-                results.append(sim_res)
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_skipLists, sl_impl=impl) for level in levels]
+            results = self.sweep('fill_level_{}'.format(impl), points)
+            for (level, r) in zip(levels, results):
+                print 'impl = {}, fill level = {}, free lists:\n{}'.format(impl, level, r.free_list_report())
             self.plot_results(levels, results, 'fill_level', 'lower right', 'nodes', impl)
 
     def test_num_skipLists(self, level, pkt_len, num_skipLists, outreg_width, enq_fifo_depth, sl_impls, outreg_latency):
         print 'testing num_skipLists...'
         for impl in sl_impls:
-            results = []
-            for num_sl in num_skipLists:
-                sim_res = self.run_sim(level, pkt_len, num_sl, outreg_width=outreg_width, enq_fifo_depth=enq_fifo_depth, sl_impl=impl, outreg_latency=outreg_latency)
-                print 'finished sim for num_sl = {}'.format(num_sl)
-                results.append(sim_res)
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_sl, outreg_width=outreg_width, enq_fifo_depth=enq_fifo_depth,
+                           sl_impl=impl, outreg_latency=outreg_latency) for num_sl in num_skipLists]
+            results = self.sweep('num_skip_lists_{}'.format(impl), points)
             print 'impl = {}, enq_avg = {}, deq_avg = {}'.format(impl, [r.enq_avg for r in results], [r.deq_avg for r in results])
             self.plot_results(num_skipLists, results, 'num_skip_lists', 'upper right', '', impl)
 
+    def test_shard_policy(self, level, pkt_len, num_skipLists, outreg_width, enq_fifo_depth, sl_impl, shard_policies):
+        """The dequeue latency of each policy is reported relative to the
+           first one, for each number of skip lists
+        """
+        print 'testing shard policy...'
+        policy_results = []
+        for policy in shard_policies:
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_sl, outreg_width=outreg_width, enq_fifo_depth=enq_fifo_depth,
+                           sl_impl=sl_impl, shard_policy=policy) for num_sl in num_skipLists]
+            results = self.sweep('shard_policy_{}_{}'.format(sl_impl, policy), points)
+            print 'policy = {}, enq_avg = {}, deq_avg = {}'.format(policy, [r.enq_avg for r in results], [r.deq_avg for r in results])
+            self.plot_results(num_skipLists, results, 'num_skip_lists_policy', 'upper right', '', sl_impl, policy)
+            policy_results.append(results)
+        report = []
+        for (policy, results) in zip(shard_policies, policy_results):
+            for (num_sl, base, r) in zip(num_skipLists, policy_results[0], results):
+                report.append('policy = {}, num_skipLists = {}: deq_avg = {:.2f} ({:+.1f}%), deq_p99 = {:.2f} ({:+.1f}%), enq_avg = {:.2f}'.format(
+                    policy, num_sl, r.deq_avg, 100.0*(r.deq_avg - base.deq_avg)/base.deq_avg, r.deq_p99, 100.0*(r.deq_p99 - base.deq_p99)/base.deq_p99, r.enq_avg))
+        print '\n'.join(report)
+        filename = 'shard_policy_{}.txt'.format(sl_impl)
+        with open(os.path.join(self.outDir, filename), 'w') as f:
+            f.write('\n'.join(report) + '\n')
+        print 'saved report: {}'.format(filename)
+
     def test_outreg_latency(self, level, pkt_len, num_skipLists, outreg_width, enq_fifo_depth, sl_impls, outreg_latencies):
         print 'testing outreg_latency...'
         for impl in sl_impls:
-            results = []
-            for outreg_latency in outreg_latencies:
-                sim_res = self.run_sim(level, pkt_len, num_skipLists, outreg_width=outreg_width, enq_fifo_depth=enq_fifo_depth, sl_impl=impl, outreg_latency=outreg_latency)
-                print 'finished sim for outreg_latency = {}'.format(outreg_latency)
-                results.append(sim_res)
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_skipLists, outreg_width=outreg_width, enq_fifo_depth=enq_fifo_depth,
+                           sl_impl=impl, outreg_latency=outreg_latency) for outreg_latency in outreg_latencies]
+            results = self.sweep('outreg_latency_{}'.format(impl), points)
             print 'impl = {}, enq_avg = {}, deq_avg = {}'.format(impl, [r.enq_avg for r in results], [r.deq_avg for r in results])
             self.plot_results(outreg_latencies, results, 'outreg_latency', 'lower right', 'cycles', impl)
 
-    def test_pkt_len(self, level, pkt_lens, num_skipLists, sl_impls):
+    def test_pkt_len(self, level, pkt_lens, num_skipLists, sl_impls, raw_pkts=False):
+        """With raw_pkts, pkts are raw bytes patched from a template, no scapy
+           pkt is built or parsed per pkt
+        """
         print 'testing pkt_len...'
         for impl in sl_impls:
-            results = []
-            for pkt_len in pkt_lens:
-                sim_res = self.run_sim(level, pkt_len, num_skipLists, sl_impl=impl)
-                print 'finished sim for pkt_len = {}'.format(pkt_len)
-                results.append(sim_res)
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_skipLists, sl_impl=impl, raw_pkts=raw_pkts) for pkt_len in pkt_lens]
+            results = self.sweep('pkt_len_{}{}'.format(impl, '_raw' if raw_pkts else ''), points)
             self.plot_results(pkt_lens, results, 'pkt_len', 'lower right', 'bytes', impl)
 
-    def test_mem_latency(self, level, pkt_len, num_skipLists, mem_latencies, sl_impls):
+    def test_mem_latency(self, level, pkt_len, num_skipLists, mem_latencies, sl_impls, mem_impl='bram', search_prefetch=False):
+        """With search_prefetch, the sweep is also run without prefetching and
+           the search cycles saved at each latency are reported
+        """
         print 'testing mem latency...'
         for impl in sl_impls:
-            results = []
-            for lat in mem_latencies:
-                sim_res = self.run_sim(level, pkt_len, num_skipLists, rd_latency=lat, wr_latency=lat, sl_impl=impl)
-                print 'finished sim for mem latency = {}'.format(lat)
-                results.append(sim_res)
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_skipLists, rd_latency=lat, wr_latency=lat, sl_impl=impl,
+                           mem_impl=mem_impl, search_prefetch=search_prefetch, profile=search_prefetch) for lat in mem_latencies]
+            name = 'mem_latency_{}'.format(impl)
+            if mem_impl != 'bram':
+                name += '_{}'.format(mem_impl)
+            if search_prefetch:
+                name += '_prefetch'
+            results = self.sweep(name, points)
             self.plot_results(mem_latencies, results, 'mem_latency', 'lower right', 'cycles', impl)
+            if search_prefetch:
+                serial_results = self.sweep(name.replace('_prefetch', '_serial'), [dict(p, search_prefetch=False) for p in points])
+                self.report_search_cycles(mem_latencies, serial_results, results, 'rd_latency', '{}_{}'.format(impl, mem_impl))
 
-    def test_outreg_width(self, level, pkt_len, num_skipLists, outreg_widths, enq_fifo_depth, sl_impls):
+    def report_search_cycles(self, xdata, serial_results, prefetch_results, variable, name):
+        """Report the average search cycles with and without prefetching
+        """
+        report = []
+        for (x, serial, prefetch) in zip(xdata, serial_results, prefetch_results):
+            serial_avg = np.average(serial.op_samples('search', 'cycles'))
+            prefetch_avg = np.average(prefetch.op_samples('search', 'cycles'))
+            saved = serial_avg - prefetch_avg
+            report.append('{} = {}: search cycles = {:.2f} (serial) / {:.2f} (prefetch), saved = {:.2f} per search ({:.1f}%)'.format(
+                variable, x, serial_avg, prefetch_avg, saved, 100.0*saved/serial_avg))
+        print '\n'.join(report)
+        filename = 'search_prefetch_{}.txt'.format(name)
+        with open(os.path.join(self.outDir, filename), 'w') as f:
+            f.write('\n'.join(report) + '\n')
+        print 'saved report: {}'.format(filename)
+
+    def test_outreg_width(self, level, pkt_len, num_skipLists, outreg_widths, enq_fifo_depth, sl_impls, outreg_impl='list'):
         print 'testing outreg width...'
         for impl in sl_impls:
-            results = []
-            for width in outreg_widths:
-                sim_res = self.run_sim(level, pkt_len, num_skipLists, outreg_width=width, enq_fifo_depth=enq_fifo_depth, sl_impl=impl)
-                print 'finished sim for outreg width = {}'.format(width)
-                results.append(sim_res)
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_skipLists, outreg_width=width, enq_fifo_depth=enq_fifo_depth,
+                           sl_impl=impl, outreg_impl=outreg_impl) for width in outreg_widths]
+            results = self.sweep('outreg_width_{}'.format(impl), points)
             self.plot_results(outreg_widths, results, 'outreg_width', 'upper right', 'nodes', impl)
 
-    def run_sim(self, fill_level, pkt_len, num_skipLists, num_samples=100, outreg_width=1, enq_fifo_depth=1, rd_latency=1, wr_latency=1, sl_impl='det', outreg_latency=1):
-        env = simpy.Environment()
-        period = 1
-        snd_rate = 1 # not currently used
-        # instantiate the testbench
-        ps_tb = Pifo_tb(env, period, snd_rate, fill_level, pkt_len, num_skipLists, num_samples, outreg_width, enq_fifo_depth, rd_latency, wr_latency, sl_impl, outreg_latency)
-        # run the simulation
-        env.run()
-        # collect the results
-        
-        enq_latencies = np.array(ps_tb.enq_latencies)
-        deq_latencies = np.array(ps_tb.deq_latencies)
-        sim_res = Sim_results(enq_latencies, deq_latencies)
+    def test_outreg_impl(self, level, pkt_len, num_skipLists, outreg_widths, enq_fifo_depth, sl_impl, outreg_impls, num_ops):
+        """Wall clock time of each out_reg implementation for each width, for
+           the register alone (num_ops operations) and for a whole simulation
+           point, whose results must not depend on the implementation
+        """
+        print 'testing outreg impl time...'
+        report = []
+        for width in outreg_widths:
+            reg_times = [time_out_reg(impl, width, num_ops, self.seed) for impl in outreg_impls]
+            sim_times = []
+            sim_results = []
+            for impl in outreg_impls:
+                start = time.time()
+                sim_results.append(simulate(level, pkt_len, num_skipLists, outreg_width=width, enq_fifo_depth=enq_fifo_depth, sl_impl=sl_impl,
+                                            outreg_impl=impl, seed=self.seed))
+                sim_times.append(time.time() - start)
+            same = all(np.array_equal(r.enq_data, sim_results[0].enq_data) and np.array_equal(r.deq_data, sim_results[0].deq_data) for r in sim_results)
+            report.append('outreg_width = {}: reg us/op = {}, sim s = {}, same results = {}'.format(width,
+                ', '.join('{}: {:.1f}'.format(impl, 1e6*t/num_ops) for (impl, t) in zip(outreg_impls, reg_times)),
+                ', '.join('{}: {:.2f}'.format(impl, t) for (impl, t) in zip(outreg_impls, sim_times)), same))
+        print '\n'.join(report)
+        filename = 'outreg_impl_time.txt'
+        with open(os.path.join(self.outDir, filename), 'w') as f:
+            f.write('\n'.join(report) + '\n')
+        print 'saved report: {}'.format(filename)
+
+    def test_rank_bits(self, level, pkt_len, num_skipLists, rank_bits, outreg_width, enq_fifo_depth, sl_impls):
+        """Ranks drawn from 0..2**bits-1 for each number of rank bits, up to
+           the 16-bit rank fields of the hardware metadata
+        """
+        print 'testing rank bits...'
+        report = []
+        for impl in sl_impls:
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_skipLists, outreg_width=outreg_width, enq_fifo_depth=enq_fifo_depth,
+                           sl_impl=impl, max_rank=2**bits-1) for bits in rank_bits]
+            results = self.sweep('rank_bits_{}'.format(impl), points)
+            for (bits, r) in zip(rank_bits, results):
+                report.append('impl = {}, rank_bits = {}: enq_avg = {:.2f}, enq_p99 = {:.2f}, deq_avg = {:.2f}, deq_p99 = {:.2f}'.format(
+                    impl, bits, r.enq_avg, r.enq_p99, r.deq_avg, r.deq_p99))
+            self.plot_results(rank_bits, results, 'rank_bits', 'upper right', 'bits', impl)
+        print '\n'.join(report)
+        filename = 'rank_bits.txt'
+        with open(os.path.join(self.outDir, filename), 'w') as f:
+            f.write('\n'.join(report) + '\n')
+        print 'saved report: {}'.format(filename)
+
+    def test_op_profile(self, level, pkt_len, num_skipLists, outreg_widths, enq_fifo_depth, sl_impl):
+        """Profile the memory accesses and cycles spent in each skip list
+           operation for every num_skipLists/outreg_width configuration
+        """
+        print 'testing op profile...'
+        report = []
+        for num_sl in num_skipLists:
+            points = [dict(fill_level=level, pkt_len=pkt_len, num_skipLists=num_sl, outreg_width=width, enq_fifo_depth=enq_fifo_depth,
+                           sl_impl=sl_impl, profile=True) for width in outreg_widths]
+            results = self.sweep('op_profile_{}_{}sl'.format(sl_impl, num_sl), points)
+            for (width, r) in zip(outreg_widths, results):
+                report.append('num_skipLists = {}, outreg_width = {}'.format(num_sl, width))
+                report.append(r.profile_report())
+            self.plot_profile(outreg_widths, results, 'outreg_width', 'nodes', '{}_{}sl'.format(sl_impl, num_sl))
+        filename = 'op_profile_{}.txt'.format(sl_impl)
+        with open(os.path.join(self.outDir, filename), 'w') as f:
+            f.write('\n'.join(report) + '\n')
+        print 'saved report: {}'.format(filename)
+
+    def test_tree_depth(self, depths, fanout, pkt_len, rates, num_pkts, node_impl, sl_impl, hop_latency):
+        """Dequeue cycles per packet of PIFO trees of increasing depth, reports
+           the max depth whose dequeues keep up with each line rate at CLK_RATE
+        """
+        print 'testing tree depth...'
+        deq_cycles = []
+        for depth in depths:
+            (enq_nclks, deq_nclks, pkts, dequeued) = simulate_tree(depth, fanout, num_pkts, pkt_len, hop_latency, node_impl, sl_impl, seed=self.seed)
+            deq_cycles.append(deq_nclks.mean())
+            print 'depth = {}, enq_avg = {}, deq_avg = {}'.format(depth, enq_nclks.mean(), deq_nclks.mean())
+
+        name = node_impl if node_impl != 'sl' else '{}_{}'.format(node_impl, sl_impl)
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+        ax.plot(depths, deq_cycles, marker='o', label='deq ({})'.format(name))
+        report = ['depth = {}, deq cycles/pkt = {:.2f}'.format(depth, cycles) for (depth, cycles) in zip(depths, deq_cycles)]
+        for rate in rates:
+            budget = cycles_per_pkt(pkt_len, rate)
+            max_depth = 0
+            for (depth, cycles) in zip(depths, deq_cycles):
+                if cycles > budget:
+                    break
+                max_depth = depth
+            report.append('{} Gbps: budget = {:.2f} cycles/pkt at {} MHz, max depth = {}'.format(rate, budget, CLK_RATE, max_depth))
+            ax.axhline(budget, linestyle='--', color='gray')
+            ax.text(depths[0], budget, '{} Gbps'.format(rate), va='bottom')
+        ax.set_xlabel('tree depth (levels)')
+        ax.set_ylabel('Deq cycles per packet')
+        ax.set_title('PIFO Tree Dequeue Cycles vs Depth ({}B pkts, fanout {})'.format(pkt_len, fanout))
+        ax.legend(loc='upper left')
+
+        filename = 'tree_depth_{}.pdf'.format(name)
+        pp = PdfPages(os.path.join(self.outDir, filename))
+        pp.savefig(fig)
+        pp.close()
+        plt.close(fig)
+        print 'saved plot: {}'.format(filename)
+        filename = 'tree_depth_{}.txt'.format(name)
+        with open(os.path.join(self.outDir, filename), 'w') as f:
+            f.write('\n'.join(report) + '\n')
+        print 'saved report: {}'.format(filename)
+
+    def test_ingress_rate(self, pkt_lens, ingress_depths, num_pkts, num_skipLists, mem_impl, wr_latency):
+        """Ingress rate of Pifo_top for back-to-back pkts at each ingress
+           pipeline depth (None for no limit), in Mpps at CLK_RATE
+        """
+        print 'testing ingress rate...'
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+        xdata = range(len(ingress_depths))
+        report = []
+        for pkt_len in pkt_lens:
+            mpps = []
+            for depth in ingress_depths:
+                (nclks, write_nclks, enq_nclks) = simulate_ingress(num_pkts, pkt_len, depth, num_skipLists, wr_latency, wr_latency, mem_impl=mem_impl, seed=self.seed)
+                mpps.append(num_pkts*CLK_RATE/float(nclks))
+                report.append('pkt_len = {}, ingress_depth = {}, cycles/pkt = {:.2f}, write cycles/pkt = {:.2f}, enq_avg = {:.2f}, {:.2f} Mpps ({:.1f}% of {} MHz)'.format(
+                    pkt_len, depth, nclks/float(num_pkts), write_nclks/float(num_pkts), enq_nclks.mean(), mpps[-1], 100.0*mpps[-1]/CLK_RATE, CLK_RATE))
+                print report[-1]
+            ax.plot(xdata, mpps, marker='o', label='{}B'.format(pkt_len))
+        ax.set_xticks(xdata)
+        ax.set_xticklabels([str(depth) if depth is not None else 'inf' for depth in ingress_depths])
+        ax.set_xlabel('ingress depth (pkts)')
+        ax.set_ylabel('Ingress rate (Mpps)')
+        ax.set_title('Ingress Rate vs Ingress Depth ({}, wr_latency {})'.format(mem_impl, wr_latency))
+        ax.legend(loc='upper left')
+
+        name = '{}_wr{}'.format(mem_impl, wr_latency)
+        filename = 'ingress_rate_{}.pdf'.format(name)
+        pp = PdfPages(os.path.join(self.outDir, filename))
+        pp.savefig(fig)
+        pp.close()
+        plt.close(fig)
+        print 'saved plot: {}'.format(filename)
+        filename = 'ingress_rate_{}.txt'.format(name)
+        with open(os.path.join(self.outDir, filename), 'w') as f:
+            f.write('\n'.join(report) + '\n')
+        print 'saved report: {}'.format(filename)
+
+    def test_egress_depth(self, pkt_len, egress_depths, rd_latencies, num_pkts, num_skipLists, mem_impl):
+        """Egress rate of Pifo_top for back-to-back dequeues at each egress
+           depth (None for one pkt read at a time without prefetching) and
+           memory read latency, in Mpps at CLK_RATE
+        """
+        print 'testing egress depth...'
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+        xdata = range(len(egress_depths))
+        report = []
+        for lat in rd_latencies:
+            mpps = []
+            for depth in egress_depths:
+                (nclks, ranks) = simulate_egress(num_pkts, pkt_len, depth, num_skipLists, lat, lat, mem_impl=mem_impl, seed=self.seed)
+                if ranks != sorted(ranks):
+                    print >> sys.stderr, 'ERROR: egress_depth = {}, rd_latency = {}: pkts out of order'.format(depth, lat)
+                mpps.append(num_pkts*CLK_RATE/float(nclks))
+                report.append('rd_latency = {}, egress_depth = {}, cycles/pkt = {:.2f}, {:.2f} Mpps ({:.1f}% of {} MHz)'.format(
+                    lat, depth, nclks/float(num_pkts), mpps[-1], 100.0*mpps[-1]/CLK_RATE, CLK_RATE))
+                print report[-1]
+            ax.plot(xdata, mpps, marker='o', label='rd_latency = {}'.format(lat))
+        ax.set_xticks(xdata)
+        ax.set_xticklabels([str(depth) if depth is not None else 'serial' for depth in egress_depths])
+        ax.set_xlabel('egress depth (pkts)')
+        ax.set_ylabel('Egress rate (Mpps)')
+        ax.set_title('Egress Rate vs Egress Depth ({}B pkts, {})'.format(pkt_len, mem_impl))
+        ax.legend(loc='upper left')
+
+        name = '{}_{}'.format(pkt_len, mem_impl)
+        filename = 'egress_depth_{}.pdf'.format(name)
+        pp = PdfPages(os.path.join(self.outDir, filename))
+        pp.savefig(fig)
+        pp.close()
+        plt.close(fig)
+        print 'saved plot: {}'.format(filename)
+        filename = 'egress_depth_{}.txt'.format(name)
+        with open(os.path.join(self.outDir, filename), 'w') as f:
+            f.write('\n'.join(report) + '\n')
+        print 'saved report: {}'.format(filename)
+
+    def run_sim(self, fill_level, pkt_len, num_skipLists, num_samples=100, outreg_width=1, enq_fifo_depth=1, rd_latency=1, wr_latency=1, sl_impl='det', outreg_latency=1, outreg_impl='list', fast_clock=False, seed=None, keep_samples=True, profile=False, mem_impl='bram', search_prefetch=False, max_rank=MAX_RANK, shard_policy='min_entries', raw_pkts=False, poll_bg=False, ingress_depth=None, egress_depth=None):
+        params = sim_params(fill_level, pkt_len, num_skipLists, num_samples, outreg_width, enq_fifo_depth, rd_latency, wr_latency, sl_impl, outreg_latency, outreg_impl, fast_clock, seed, keep_samples, profile, mem_impl, search_prefetch, max_rank, shard_policy, raw_pkts, poll_bg, ingress_depth, egress_depth)
+        sim_res = self.cached_results(params)
+        if sim_res is None:
+            sim_res = simulate(**params)
+            self.cache_results(params, sim_res)
         return sim_res
 
-    def plot_results(self, xdata, results, variable, loc, units, sl_impl):
+    def cached_results(self, params):
+        """Look up the results of a seeded simulation point in the cache
+        """
+        if self.cache is None or params['seed'] is None:
+            return None
+        arrays = self.cache.get(params)
+        if arrays is None:
+            return None
+        return Sim_results.from_arrays(arrays)
+
+    def cache_results(self, params, sim_res):
+        if self.cache is None or params['seed'] is None:
+            return
+        self.cache.put(params, sim_res.arrays())
+
+    def sweep(self, name, points):
+        """Run the simulation points of a sweep, in parallel if num_procs > 1
+        Inputs:
+          - name : name of the sweep, completed points are saved in outDir/name
+                   so an interrupted sweep resumes where it stopped
+          - points : list of dicts of simulate() keyword arguments
+        Returns the list of Sim_results in the same order as points
+        """
+        sweepDir = os.path.join(self.outDir, name)
+        if not os.path.exists(sweepDir):
+            os.makedirs(sweepDir)
+
+        results = len(points)*[None]
+        todo = []
+        for (i, point) in enumerate(points):
+            params = sim_params(**point)
+            if self.seed is not None and params['seed'] is None:
+                params['seed'] = self.seed + i
+            sim_res = Sim_results.load(self.point_file(sweepDir, i), params)
+            if sim_res is None:
+                sim_res = self.cached_results(params)
+                if sim_res is not None:
+                    sim_res.save(self.point_file(sweepDir, i), params)
+            if sim_res is not None:
+                print 'loaded sim for point {}: {}'.format(i, point)
+                results[i] = sim_res
+            else:
+                todo.append((i, params))
+
+        if self.num_procs > 1 and len(todo) > 1:
+            pool = multiprocessing.Pool(min(self.num_procs, len(todo)))
+            completed = pool.imap_unordered(run_point, todo)
+        else:
+            pool = None
+            completed = (run_point(point) for point in todo)
+
+        params = dict(todo)
+        try:
+            for (i, sim_res) in completed:
+                sim_res.save(self.point_file(sweepDir, i), params[i])
+                self.cache_results(params[i], sim_res)
+                print 'finished sim for point {}: {}'.format(i, points[i])
+                results[i] = sim_res
+        except BaseException:
+            # do not leave workers running the remaining points
+            if pool is not None:
+                pool.terminate()
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return results
+
+    def point_file(self, sweepDir, index):
+        return os.path.join(sweepDir, 'point_{:04d}.npz'.format(index))
+
+    def plot_results(self, xdata, results, variable, loc, units, sl_impl, name=None):
         avg_enq = [r.enq_avg for r in results]
+        p99_enq = [r.enq_p99 for r in results]
+        p999_enq = [r.enq_p999 for r in results]
         max_enq = [r.enq_max for r in results]
 
         avg_deq = [r.deq_avg for r in results]
+        p99_deq = [r.deq_p99 for r in results]
+        p999_deq = [r.deq_p999 for r in results]
         max_deq = [r.deq_max for r in results]
 
         linestyle = LINE_STYLES[sl_impl]
-        labels = ['{} ({})'.format(l, sl_impl) for l in ['avg', 'max']]
+        labels = ['{} ({})'.format(l, name if name is not None else sl_impl) for l in ['avg', 'p99', 'p99.9', 'max']]
 
         # plot Enqueue Data
-        self.plot_data([xdata, xdata], [avg_enq, max_enq], labels, '{} ({})'.format(variable, units), 'Enq Latency (cycles)', 'Enqueue Latency vs {}'.format(variable), loc, self.enq_ax, linestyle)
+        self.plot_data(4*[xdata], [avg_enq, p99_enq, p999_enq, max_enq], labels, '{} ({})'.format(variable, units), 'Enq Latency (cycles)', 'Enqueue Latency vs {}'.format(variable), loc, self.enq_ax, linestyle)
 
         # plot Dequeue Data
-        self.plot_data([xdata, xdata], [avg_deq, max_deq], labels, '{} ({})'.format(variable, units), 'Deq Latency (cycles)', 'Dequeue Latency vs {}'.format(variable), loc, self.deq_ax, linestyle)
+        self.plot_data(4*[xdata], [avg_deq, p99_deq, p999_deq, max_deq], labels, '{} ({})'.format(variable, units), 'Deq Latency (cycles)', 'Dequeue Latency vs {}'.format(variable), loc, self.deq_ax, linestyle)
 
         filename = 'enq_deq_v_{}.pdf'.format(variable)
         fig = plt.gcf()
@@ -127,6 +528,28 @@ class Pifo_sim(object):
         pp.close()
         print 'saved plot: {}'.format(filename)
 
+    def plot_profile(self, xdata, results, variable, units, name):
+        """Plot the total cycles spent in each skip list operation, which shows
+           the phase that limits throughput at each point
+        """
+        fig = plt.figure()
+        ax = fig.add_subplot(111)
+        for op in PROFILE_OPS:
+            total_cycles = [r.op_total(op, 'cycles') for r in results]
+            if any(total_cycles):
+                ax.plot(xdata, total_cycles, marker='o', label=op)
+        ax.set_xlabel('{} ({})'.format(variable, units))
+        ax.set_ylabel('Total cycles')
+        ax.set_title('Skip List Cycles per Operation vs {} ({})'.format(variable, name))
+        ax.legend(loc='upper right')
+
+        filename = 'op_profile_v_{}_{}.pdf'.format(variable, name)
+        pp = PdfPages(os.path.join(self.outDir, filename))
+        pp.savefig(fig)
+        pp.close()
+        plt.close(fig)
+        print 'saved plot: {}'.format(filename)
+
     def plot_data(self, xdata, ydata, labels, xlabel, ylabel, title, loc, ax, linestyle):
         for (x, y, label) in zip(xdata, ydata, labels):
             ax.plot(x, y, marker='o', label=label, linestyle=linestyle)
@@ -138,13 +561,132 @@ class Pifo_sim(object):
 
 
 class Sim_results(object):
-    def __init__(self, enq_data, deq_data):
+    """Enq/deq latency results of a simulation point. Averages, maxima and
+       percentiles are exact when the raw samples are available and come from
+       the streaming accumulators otherwise.
+    """
+    def __init__(self, enq_data, deq_data, enq_stats=None, deq_stats=None, seed=None, op_profile=None, free_lists=None):
+        # seed the simulation was run with, drawn by the testbench for unseeded runs (None if unknown)
+        self.seed = seed
+        # skip list operation -> array of (reads, writes, cycles) samples (None if not profiled)
+        self.op_profile = op_profile
+        # free list name (sl_nodes_<i>[_level_<j>], pkt_segments, pkt_metadata) -> array of FREE_LIST_FIELDS
+        self.free_lists = free_lists
+
         self.enq_data = enq_data
-        self.enq_avg = np.average(enq_data)
-        self.enq_max = np.max(enq_data)
+        self.enq_stats = enq_stats if enq_stats is not None else Sim_results.stream(enq_data)
+        (self.enq_avg, self.enq_max, self.enq_std, self.enq_p50, self.enq_p99, self.enq_p999) = Sim_results.summarize(enq_data, self.enq_stats)
 
         self.deq_data = deq_data
-        self.deq_avg = np.average(deq_data)
-        self.deq_max = np.max(deq_data)
-      
+        self.deq_stats = deq_stats if deq_stats is not None else Sim_results.stream(deq_data)
+        (self.deq_avg, self.deq_max, self.deq_std, self.deq_p50, self.deq_p99, self.deq_p999) = Sim_results.summarize(deq_data, self.deq_stats)
+
+    @staticmethod
+    def stream(data):
+        stats = Stream_stats()
+        for x in data:
+            stats.add(x)
+        return stats
+
+    @staticmethod
+    def summarize(data, stats):
+        if len(data) > 0:
+            return (np.average(data), np.max(data), np.std(data)) + tuple(np.percentile(data, 100*p) for p in QUANTILES)
+        return (stats.mean, stats.max, stats.std()) + tuple(stats.quantile(p) for p in QUANTILES)
+
+    def arrays(self):
+        """Returns the raw data and accumulator state as a dict of arrays
+        """
+        arrays = dict(enq_data=self.enq_data, deq_data=self.deq_data, enq_stats=self.enq_stats.state(), deq_stats=self.deq_stats.state())
+        if self.seed is not None:
+            arrays['seed'] = np.array(self.seed)
+        if self.op_profile is not None:
+            arrays['profile_ops'] = np.array(sorted(self.op_profile.keys()))
+            for (op, samples) in self.op_profile.items():
+                arrays['profile_' + op] = samples
+        if self.free_lists is not None:
+            arrays['free_list_names'] = np.array(sorted(self.free_lists.keys()))
+            for (name, watermarks) in self.free_lists.items():
+                arrays['free_list_' + name] = watermarks
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays):
+        keys = arrays.keys()
+        seed = arrays['seed'].item() if 'seed' in keys else None
+        op_profile = None
+        if 'profile_ops' in keys:
+            op_profile = dict((str(op), arrays['profile_' + op]) for op in arrays['profile_ops'])
+        free_lists = None
+        if 'free_list_names' in keys:
+            free_lists = dict((str(name), arrays['free_list_' + name]) for name in arrays['free_list_names'])
+        return Sim_results(arrays['enq_data'], arrays['deq_data'], Stream_stats.from_state(arrays['enq_stats']), Stream_stats.from_state(arrays['deq_stats']), seed, op_profile, free_lists)
+
+    def op_samples(self, op, field):
+        """Returns the per-occurrence samples of field ('reads', 'writes' or 'cycles') for op
+        """
+        if self.op_profile is None or op not in self.op_profile:
+            return np.array([], dtype=int)
+        return self.op_profile[op][:, PROFILE_FIELDS.index(field)]
+
+    def op_total(self, op, field):
+        return int(np.sum(self.op_samples(op, field)))
+
+    def op_histogram(self, op, field):
+        """Returns (values, counts) of field for op
+        """
+        return np.unique(self.op_samples(op, field), return_counts=True)
+
+    def profile_report(self):
+        """Returns a text summary of the op profile, one line per operation
+           with the average and histogram of each field
+        """
+        if self.op_profile is None:
+            return 'no op profile'
+        lines = []
+        busy_cycles = sum(self.op_total(op, 'cycles') for op in self.op_profile)
+        for op in PROFILE_OPS:
+            if op not in self.op_profile:
+                continue
+            count = len(self.op_profile[op])
+            cycles = self.op_total(op, 'cycles')
+            lines.append('  {}: count = {}, cycles = {} ({:.1f}%)'.format(op, count, cycles, 100.0*cycles/max(busy_cycles, 1)))
+            for field in PROFILE_FIELDS:
+                (values, counts) = self.op_histogram(op, field)
+                hist = ', '.join('{}:{}'.format(v, c) for (v, c) in zip(values, counts))
+                lines.append('    {}: avg = {:.2f}, hist = {{{}}}'.format(field, np.average(self.op_samples(op, field)), hist))
+        return '\n'.join(lines)
+
+    def free_list_used(self, name):
+        """Returns the maximum number of entries of free list name in use at once
+        """
+        (size, high, low) = self.free_lists[name]
+        return int(size - low)
+
+    def free_list_report(self):
+        """Returns a text summary of the free list watermarks, one line per free list
+        """
+        if self.free_lists is None:
+            return 'no free list watermarks'
+        lines = []
+        for name in sorted(self.free_lists.keys()):
+            (size, high, low) = self.free_lists[name]
+            lines.append('  {}: size = {}, free high = {}, free low = {}, max used = {}'.format(name, size, high, low, self.free_list_used(name)))
+        return '\n'.join(lines)
+
+    def save(self, filename, params):
+        """Save the raw latency data along with the parameters that produced it
+        """
+        np.savez(filename, params=repr(sorted(params.items())), **self.arrays())
 
+    @staticmethod
+    def load(filename, params):
+        """Load results saved with save(), returns None if the file does not
+           exist or was produced with different parameters
+        """
+        if not os.path.exists(filename):
+            return None
+        with np.load(filename) as data:
+            if str(data['params']) != repr(sorted(params.items())) or 'enq_stats' not in data.files:
+                return None
+            return Sim_results.from_arrays(data)
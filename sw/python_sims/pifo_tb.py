@@ -2,8 +2,10 @@
 import sys, os, random
 import simpy
 from scapy.all import *
-from hwsim_utils import HW_sim_object, Tuser, pad_pkt
+from hwsim_utils import HW_sim_object, Tuser, pad_pkt, Pkt_template
 from pifo_top import Pifo_top
+from packet_storage import SEG_SIZE
+from stream_stats import Stream_stats
 from collections import OrderedDict
 import numpy as np
 
@@ -15,6 +17,9 @@ MAX_PKT = 1500
 
 MAX_RANK = 64
 
+# decode and print every pkt sent and received (with scapy in raw_pkts mode)
+DEBUG_PKTS = False
+
 MAX_SEGMENTS = 2048
 MAX_PKTS = 2048
 
@@ -24,10 +29,18 @@ class Pifo_tb(HW_sim_object):
     """The top level testbench for the PIFO
     """
 
-    def __init__(self, env, period, snd_rate, fill_level, pkt_len, num_skipLists, num_samples, outreg_width, enq_fifo_depth, rd_latency=1, wr_latency=1, sl_impl='det', outreg_latency=1):
+    def __init__(self, env, period, snd_rate, fill_level, pkt_len, num_skipLists, num_samples, outreg_width, enq_fifo_depth, rd_latency=1, wr_latency=1, sl_impl='det', outreg_latency=1, outreg_impl='list', keep_samples=True, seed=None, profile=False, mem_impl='bram', search_prefetch=False, max_rank=MAX_RANK, shard_policy='min_entries', raw_pkts=False, ingress_depth=None, egress_depth=None):
         super(Pifo_tb, self).__init__(env, period)
 
         self.num_samples = num_samples
+        # seed of the simulation, the testbench and the PIFO draw from separate random streams derived from it.
+        # Unseeded runs draw a seed of their own so that they can be reproduced from the recorded seed
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        seed_rng = random.Random(seed)
+        self.rng = random.Random(seed_rng.getrandbits(64))
+        pifo_rng = random.Random(seed_rng.getrandbits(64))
         self.num_skipLists = num_skipLists
         self.sim_complete = False
         
@@ -47,12 +60,19 @@ class Pifo_tb(HW_sim_object):
         # desired fill level of the skip_list
         self.fill_level = fill_level # number of entries
 
+        # ranks are drawn uniformly from 0..max_rank
+        self.max_rank = max_rank
+
         # clock rate (MHz)
         self.clk_rate = 200
 
         # length of pkts to send
         self.pkt_len = pkt_len
 
+        # with raw_pkts, pkts are raw bytes patched from a template instead of scapy pkts
+        self.raw_pkts = raw_pkts
+        self.pkt_template = Pkt_template(pkt_len) if raw_pkts else None
+
         # number of packets in a single schedule
         self.pkt_schedule_len = 100
 
@@ -63,18 +83,25 @@ class Pifo_tb(HW_sim_object):
         # bool to indicate that dequeuing should start
         self.start_deq = False
 
-        # latency measurements
+        # latency measurements, the individual samples are only kept if keep_samples is set
+        self.keep_samples = keep_samples
         self.enq_latencies = []
         self.deq_latencies = []
+        self.enq_stats = Stream_stats()
+        self.deq_stats = Stream_stats()
 
-        # Instantiate the top-level Pifo
-        self.pifo = Pifo_top(env, period, self.pifo_pkt_in_pipe, self.pifo_pkt_out_pipe, self.pifo_enq_out_pipe, self.pifo_deq_in_pipe, MAX_SEGMENTS, MAX_PKTS, num_skipLists, outreg_width, enq_fifo_depth, rd_latency=rd_latency, wr_latency=wr_latency, sl_impl=sl_impl, outreg_latency=outreg_latency)
+        # Instantiate the top-level Pifo, with enough segments to hold MAX_PKTS pkts
+        max_segments = max(MAX_SEGMENTS, MAX_PKTS*((pkt_len + SEG_SIZE - 1)//SEG_SIZE))
+        self.pifo = Pifo_top(env, period, self.pifo_pkt_in_pipe, self.pifo_pkt_out_pipe, self.pifo_enq_out_pipe, self.pifo_deq_in_pipe, max_segments, MAX_PKTS, num_skipLists, outreg_width, enq_fifo_depth, rd_latency=rd_latency, wr_latency=wr_latency, sl_impl=sl_impl, outreg_latency=outreg_latency, outreg_impl=outreg_impl, rng=pifo_rng, profile=profile, mem_impl=mem_impl, search_prefetch=search_prefetch, shard_policy=shard_policy, max_rank=max_rank, raw_pkts=raw_pkts, ingress_depth=ingress_depth, egress_depth=egress_depth)
 
         # determine whether we want to gen/read pkts such that a constant fill level is maintained
         const_fill_level = True
         if fill_level is None:
             const_fill_level = False
 
+        # the generator and receiver wait for the PIFO fill level to change when idle
+        self.pifo.skip_list_wrapper.watchers.append(self.bg_notify)
+
         # register processes for simulation
         self.run(const_fill_level)
 
@@ -84,16 +111,30 @@ class Pifo_tb(HW_sim_object):
         self.env.process(self.receive_pkts(const_fill_level))
 
 
+    def decode(self, pkt):
+        """Returns pkt as a scapy pkt, for debugging
+        """
+        return Ether(bytes(pkt)) if self.raw_pkts else pkt
+
+    def wait_idle(self):
+        """Wait after the generator or receiver found nothing to do, until
+           the next cycle at which the fill level or start_deq may have changed
+        """
+        if self.poll_bg:
+            return self.wait_clock()
+        return self.bg_wait()
+
     def generate_pkts(self, const_fill_level):
-        """Generate scapy pkts and insert into PIFO
+        """Generate scapy pkts (raw pkts with raw_pkts) and insert into PIFO
         """
         # the last clk cycle at which a pkt was sent
         last_pkt_time = 0
         sched_index = 0
         pkt_schedule = None
         last_rank = None
+        gen_pkt = True
         while not self.sim_complete:
-            yield self.wait_clock()
+            yield self.wait_clock() if gen_pkt else self.wait_idle()
 #            if (sched_index == self.pkt_schedule_len or pkt_schedule is None):
 #                # create the packet schedule so we can send at the appropriate rate
 #                cycles_per_pkt = (self.pkt_len*8.0*self.clk_rate*1e6)/(self.snd_rate*1e9)
@@ -117,15 +158,19 @@ class Pifo_tb(HW_sim_object):
 
             if gen_pkt:
                 # create pkt and metadata to send
-                pkt = Ether()/IP()/TCP()
-                pkt = pad_pkt(pkt, self.pkt_len)
-                src_port = random.randint(0, (2**8)-1)
-                dst_port = random.randint(0, (2**8)-1)
-                rank = random.randint(0, MAX_RANK)
+                src_port = self.rng.randint(0, (2**8)-1)
+                dst_port = self.rng.randint(0, (2**8)-1)
+                if self.raw_pkts:
+                    pkt = self.pkt_template.make(self.pkt_len, src_port, dst_port)
+                else:
+                    pkt = Ether()/IP()/TCP()
+                    pkt = pad_pkt(pkt, self.pkt_len)
+                rank = self.rng.randint(0, self.max_rank)
                 pkt_id = self.pkt_id
                 self.pkt_id += 1
                 metadata = Tuser(len(pkt), src_port, dst_port, rank, pkt_id)
-#                print '@{} - sending pkt: {}'.format(self.env.now, pkt.summary())
+                if DEBUG_PKTS:
+                    print '@{} - sending pkt: {}'.format(self.env.now, self.decode(pkt).summary())
 
                 start_time = self.env.now
                 # insert pkt into PIFO
@@ -157,6 +202,7 @@ class Pifo_tb(HW_sim_object):
                     # start dequeuing when all pkts have been sent
                     if self.pkt_id >= self.num_samples + WARM_UP_PKTS:
                         self.start_deq = True
+                        self.bg_notify()
                 elif const_fill_level and num_entries == self.fill_level - 1:
                     # record enq delay for only pkts dequeued at the desired fill level
                     self.active_pkts[pkt_id] = enq_nclks
@@ -187,18 +233,23 @@ class Pifo_tb(HW_sim_object):
                 deq_nclks = end_time - start_time    
 
                 if pkt_out is not None and meta_out is not None:
+                    if DEBUG_PKTS:
+                        print '@{} - received pkt: {}'.format(self.env.now, self.decode(pkt_out).summary())
                     rcv_time = self.env.now
                     pkt_id = meta_out.pkt_id
                     enq_nclks = self.active_pkts.pop(pkt_id, None)
                     # only care about packets for which we have recorded enq delay
                     if enq_nclks is not None:
-                        self.enq_latencies.append(enq_nclks)
-                        self.deq_latencies.append(deq_nclks)
-                        self.sim_complete = len(self.enq_latencies) >= self.num_samples
+                        if self.keep_samples:
+                            self.enq_latencies.append(enq_nclks)
+                            self.deq_latencies.append(deq_nclks)
+                        self.enq_stats.add(enq_nclks)
+                        self.deq_stats.add(deq_nclks)
+                        self.sim_complete = self.enq_stats.count >= self.num_samples
                 else:
                     print '@{} - pifo_tb: receive_pkts: pkt_out = {}, meta_out = {}'
             else:
-                yield self.wait_clock()
+                yield self.wait_idle()
 
         # Wait until skip lists are done
         for i in range(self.num_skipLists):
@@ -4,14 +4,17 @@ This is the top level module that combines together the packet storage
 and top level skip list
 """
 
+import random
 import simpy
-from hwsim_utils import HW_sim_object, Tuser
-from packet_storage import Pkt_storage
-from pifo_wrapper import SkipListWrapper
+import numpy as np
+from collections import deque
+from hwsim_utils import HW_sim_object, Tuser, Pkt_template
+from packet_storage import Pkt_storage, SEG_SIZE
+from pifo_wrapper import SkipListWrapper, RANK_BITS, run_sl_tb
 
 class Pifo_top(HW_sim_object):
 
-    def __init__(self, env, period, pkt_in_pipe, pkt_out_pipe, enq_out_pipe, deq_in_pipe, max_segments, max_pkts, num_skip_lists, outreg_width, enq_fifo_depth, rd_latency=1, wr_latency=1, sl_impl='det', outreg_latency=1):
+    def __init__(self, env, period, pkt_in_pipe, pkt_out_pipe, enq_out_pipe, deq_in_pipe, max_segments, max_pkts, num_skip_lists, outreg_width, enq_fifo_depth, rd_latency=1, wr_latency=1, sl_impl='det', outreg_latency=1, outreg_impl='list', rng=None, profile=False, mem_impl='bram', search_prefetch=False, shard_policy='min_entries', max_rank=2**RANK_BITS-1, raw_pkts=False, ingress_depth=None, egress_depth=None):
         super(Pifo_top, self).__init__(env, period)
 
         # Pipes to pass packets around
@@ -22,6 +25,8 @@ class Pifo_top(HW_sim_object):
         # Pipes to R/W ptrs from/to pkt storage 
         self.ps_ptr_in_pipe = simpy.Store(env)
         self.ps_ptr_out_pipe = simpy.Store(env)
+        # ranks of the pkts sent to storage whose ptrs have not come back yet
+        self.ingress_ranks = deque()
 
         # Pipes to R/W ptrs from/to skip list 
         self.sl_enq_in_pipe = simpy.Store(env)
@@ -30,10 +35,10 @@ class Pifo_top(HW_sim_object):
         self.sl_deq_out_pipe = simpy.Store(env)
 
         # Instantiate the Packet Storage
-        self.pkt_store = Pkt_storage(env, period, self.ps_pkt_in_pipe, self.top_pkt_out_pipe, self.ps_ptr_in_pipe, self.ps_ptr_out_pipe, max_segments, max_pkts, rd_latency=rd_latency, wr_latency=wr_latency)
+        self.pkt_store = Pkt_storage(env, period, self.ps_pkt_in_pipe, self.top_pkt_out_pipe, self.ps_ptr_in_pipe, self.ps_ptr_out_pipe, max_segments, max_pkts, rd_latency=rd_latency, wr_latency=wr_latency, mem_impl=mem_impl, raw_pkts=raw_pkts, ingress_depth=ingress_depth, egress_depth=egress_depth)
 
         # Instantiate the top-level Skip List
-        self.skip_list_wrapper = SkipListWrapper(env, self.sl_enq_in_pipe, self.sl_enq_out_pipe, self.top_deq_in_pipe, self.sl_deq_out_pipe, num_sl=num_skip_lists, period=period, size=max_pkts, outreg_width=outreg_width, enq_fifo_depth=enq_fifo_depth, rd_latency=rd_latency, wr_latency=wr_latency, sl_impl=sl_impl, outreg_latency=outreg_latency)
+        self.skip_list_wrapper = SkipListWrapper(env, self.sl_enq_in_pipe, self.sl_enq_out_pipe, self.top_deq_in_pipe, self.sl_deq_out_pipe, num_sl=num_skip_lists, period=period, size=max_pkts, outreg_width=outreg_width, enq_fifo_depth=enq_fifo_depth, rd_latency=rd_latency, wr_latency=wr_latency, sl_impl=sl_impl, outreg_latency=outreg_latency, outreg_impl=outreg_impl, rng=rng, profile=profile, mem_impl=mem_impl, search_prefetch=search_prefetch, shard_policy=shard_policy, max_rank=max_rank)
 
         # register processes for simulation
         self.run()
@@ -41,22 +46,29 @@ class Pifo_top(HW_sim_object):
 
     def run(self):
         self.env.process(self.write_pkt())
+        self.env.process(self.enqueue_pkt())
         self.env.process(self.read_pkt())
 
 
     def write_pkt(self):
-        """Write incomming packet into packet storage and skip list
+        """Write incomming packet into packet storage, without waiting for
+           the ptrs of the previous one
         """
         while True:
             # wait to receive incomming pkt and metadata
             (pkt_in, meta_in) = yield self.top_pkt_in_pipe.get()
-            rank = meta_in.rank
+            self.ingress_ranks.append(meta_in.rank)
 
             # write incomming pkt and metadata into storage
             self.ps_pkt_in_pipe.put((pkt_in, meta_in))
 
-            # wait to receive ptrs from packet storage
+    def enqueue_pkt(self):
+        """Write the ptrs of the packets accepted by packet storage into the skip list
+        """
+        while True:
+            # wait to receive ptrs from packet storage, pkts are accepted in order
             (head_seg_ptr, meta_ptr) = yield self.ps_ptr_out_pipe.get()
+            rank = self.ingress_ranks.popleft()
 
             # write rank, head_seg_ptr, and meta_ptr into skip list
             self.sl_enq_in_pipe.put((rank, head_seg_ptr, meta_ptr))
@@ -73,3 +85,86 @@ class Pifo_top(HW_sim_object):
             self.ps_ptr_in_pipe.put((head_seg_ptr, meta_ptr))
 
 
+class Raw_pkt_tb(object):
+    """A Pifo_top fed with raw pkts of pkt_len bytes, sized for num_pkts pkts,
+       for the simulate_*() functions
+    """
+    def __init__(self, num_pkts, pkt_len, num_skip_lists, rd_latency, wr_latency, sl_impl, mem_impl, seed, max_rank, ingress_depth=None, egress_depth=None):
+        self.env = simpy.Environment()
+        self.period = 1
+        self.rng = random.Random(seed)
+        self.pkt_len = pkt_len
+        self.max_rank = max_rank
+        self.pkt_in_pipe = simpy.Store(self.env)
+        self.pkt_out_pipe = simpy.Store(self.env)
+        self.enq_out_pipe = simpy.Store(self.env)
+        self.deq_in_pipe = simpy.Store(self.env)
+        max_segments = num_pkts*((pkt_len + SEG_SIZE - 1)//SEG_SIZE)
+        self.pifo = Pifo_top(self.env, self.period, self.pkt_in_pipe, self.pkt_out_pipe, self.enq_out_pipe, self.deq_in_pipe, max_segments, 2*num_pkts,
+                             num_skip_lists, 16, 16, rd_latency=rd_latency, wr_latency=wr_latency, sl_impl=sl_impl,
+                             rng=random.Random(self.rng.getrandbits(64)), mem_impl=mem_impl, max_rank=max_rank, raw_pkts=True,
+                             ingress_depth=ingress_depth, egress_depth=egress_depth)
+        self.template = Pkt_template(pkt_len)
+
+    def send_pkt(self, pkt_id):
+        """Offer a pkt with random ports and rank to the Pifo_top
+        """
+        rng = self.rng
+        pkt = self.template.make(self.pkt_len, rng.randint(0, 2**16-1), rng.randint(0, 2**16-1))
+        self.pkt_in_pipe.put((pkt, Tuser(len(pkt), 0, 0, rng.randint(0, self.max_rank), pkt_id)))
+
+    def run(self, measure):
+        return run_sl_tb(self.env, self.period, self.pifo.skip_list_wrapper.sl, measure)
+
+def simulate_ingress(num_pkts, pkt_len, ingress_depth, num_skip_lists=1, rd_latency=1, wr_latency=1, sl_impl='det', mem_impl='bram', seed=None, max_rank=64):
+    """Offer num_pkts back-to-back raw pkts to a Pifo_top once its skip lists
+       are initialized.
+       Returns (nclks, write_nclks, enq_nclks) where nclks is the number of
+       cycles until every pkt is written into storage and enqueued in the
+       skip lists, write_nclks the number of cycles until every pkt is
+       written, and enq_nclks the skip list enqueue latency of each pkt
+    """
+    tb = Raw_pkt_tb(num_pkts, pkt_len, num_skip_lists, rd_latency, wr_latency, sl_impl, mem_impl, seed, max_rank, ingress_depth=ingress_depth)
+    (env, pkt_store) = (tb.env, tb.pifo.pkt_store)
+
+    def measure():
+        start_time = env.now
+        for i in range(num_pkts):
+            tb.send_pkt(i)
+        enq_nclks = []
+        for i in range(num_pkts):
+            nclks = yield tb.enq_out_pipe.get()
+            enq_nclks.append(nclks)
+        while pkt_store.written_pkts < num_pkts:
+            yield env.timeout(tb.period)
+        write_nclks = pkt_store.last_write_time - start_time
+        env.exit((max(env.now - start_time, write_nclks), write_nclks, np.array(enq_nclks)))
+
+    return tb.run(measure)
+
+def simulate_egress(num_pkts, pkt_len, egress_depth, num_skip_lists=1, rd_latency=1, wr_latency=1, sl_impl='det', mem_impl='bram', seed=None, max_rank=64):
+    """Fill a Pifo_top with num_pkts raw pkts, then dequeue them back-to-back.
+       Returns (nclks, ranks) where nclks is the number of cycles from the
+       first dequeue request until every pkt is output and ranks lists the
+       ranks of the pkts in output order
+    """
+    tb = Raw_pkt_tb(num_pkts, pkt_len, num_skip_lists, rd_latency, wr_latency, sl_impl, mem_impl, seed, max_rank, egress_depth=egress_depth)
+    (env, pifo) = (tb.env, tb.pifo)
+
+    def measure():
+        for i in range(num_pkts):
+            tb.send_pkt(i)
+            yield tb.enq_out_pipe.get()
+        # wait for the pkts to be written and inserted into the skip lists
+        while pifo.pkt_store.written_pkts < num_pkts or any(sl.busy == 1 or sl.enq_fifo.fill_level() > 0 for sl in pifo.skip_list_wrapper.sl):
+            yield env.timeout(tb.period)
+        start_time = env.now
+        for i in range(num_pkts):
+            tb.deq_in_pipe.put(1)
+        ranks = []
+        for i in range(num_pkts):
+            (pkt, tuser) = yield tb.pkt_out_pipe.get()
+            ranks.append(tuser.rank)
+        env.exit((env.now - start_time, ranks))
+
+    return tb.run(measure)
@@ -0,0 +1,326 @@
+
+"""
+Hierarchical PIFO (PIFO tree): every node of the tree is a PIFO. Leaves hold
+packets, the nodes above hold handles of their children. On enqueue, each node
+on the path from the leaf to the root computes a rank with its own policy, so
+e.g. WFQ across tenants at the root and SRPT within each tenant at the leaves.
+A dequeue walks down from the root, each node it visits returns the handle of
+the child to dequeue from next.
+"""
+
+from __future__ import print_function
+import sys, random
+from fractions import gcd
+import simpy
+import numpy as np
+from hwsim_utils import HW_sim_object, Tuser
+from pifo_wrapper import SkipListWrapper, PifoModel, run_sl_tb
+
+# clock rate (MHz)
+CLK_RATE = 200
+
+def cycles_per_pkt(pkt_len, rate, clk_rate=CLK_RATE):
+    """Number of clock cycles between packets at line rate
+    Inputs:
+      - pkt_len : bytes
+      - rate : Gbps
+      - clk_rate : MHz
+    """
+    return (pkt_len*8.0*clk_rate*1e6)/(rate*1e9)
+
+
+class Wfq_policy(object):
+    """Start-time fair queueing across the children of a node: the rank of a
+       packet is the virtual start time of its child, which then advances by
+       pkt_len/weight. The virtual time follows the rank of the dequeued packets.
+       Virtual times are fixed-point, in units of 1/scale bytes where scale is
+       the lcm of the weights, so that pkt_len/weight is never truncated.
+    """
+    def __init__(self, weights):
+        self.weights = weights
+        self.scale = reduce(lambda a, b: a*b // gcd(a, b), weights, 1)
+        self.virtual_time = 0
+        # child -> virtual finish time of its last packet
+        self.finish = {}
+
+    def rank(self, child, tuser):
+        start = max(self.virtual_time, self.finish.get(child, 0))
+        self.finish[child] = start + tuser.pkt_len*self.scale // self.weights[child]
+        return start
+
+    def dequeued(self, rank):
+        self.virtual_time = max(self.virtual_time, rank)
+
+
+class Srpt_policy(object):
+    """Shortest remaining processing time: the rank is the remaining size of
+       the packet's flow, carried in the rank field of its metadata
+    """
+    def rank(self, child, tuser):
+        return tuser.rank
+
+    def dequeued(self, rank):
+        pass
+
+
+class Tree_node(object):
+    """A node of a PIFO tree, ordered by the ranks computed by its policy.
+       Nodes without children are leaves and hold packets.
+    """
+    def __init__(self, policy, children=None):
+        self.policy = policy
+        self.children = children if children is not None else []
+        self.parent = None
+        # position among the parent's children
+        self.index = 0
+        for (i, child) in enumerate(self.children):
+            child.parent = self
+            child.index = i
+
+    def is_leaf(self):
+        return len(self.children) == 0
+
+    def nodes(self):
+        """All nodes of the subtree, in pre-order
+        """
+        nodes = [self]
+        for child in self.children:
+            nodes.extend(child.nodes())
+        return nodes
+
+    def leaves(self):
+        return [n for n in self.nodes() if n.is_leaf()]
+
+    def depth(self):
+        return 1 + max([child.depth() for child in self.children] + [0])
+
+    def enq_ranks(self, tuser):
+        """Returns [(node, rank, child)] from this leaf up to the root, the
+           policy of each node is updated as the packet is enqueued
+        """
+        ranks = []
+        (node, child) = (self, None)
+        while node is not None:
+            ranks.append((node, node.policy.rank(child.index if child is not None else None, tuser), child))
+            (node, child) = (node.parent, node)
+        return ranks
+
+
+def build_tree(depth, fanout):
+    """Full tree with WFQ on every level above the leaves and SRPT at the
+       leaves, the children of each node have weights 1..fanout
+    """
+    if depth == 1:
+        return Tree_node(Srpt_policy())
+    return Tree_node(Wfq_policy(range(1, fanout+1)), [build_tree(depth-1, fanout) for i in range(fanout)])
+
+
+class PifoTreeModel(object):
+    """Untimed reference model of a PIFO tree, each node is a PifoModel
+    """
+    def __init__(self, root):
+        self.root = root
+        self.leaves = root.leaves()
+        self.pifos = dict((node, PifoModel()) for node in root.nodes())
+        self.num_entries = 0
+
+    def enqueue(self, leaf, tuser, hsp, mdp):
+        """Enqueue a packet into leaf (index into the leaves)
+        """
+        for (node, rank, child) in self.leaves[leaf].enq_ranks(tuser):
+            if child is None:
+                self.pifos[node].enqueue(rank, hsp, mdp)
+            else:
+                self.pifos[node].enqueue(rank, child.index, -1)
+        self.num_entries += 1
+
+    def dequeue(self):
+        """Returns (rank, hsp, mdp) of the next packet, rank is its leaf rank
+        """
+        if self.num_entries == 0:
+            print ("ERROR: Dequeue from empty PIFO tree!")
+            return None
+        self.num_entries -= 1
+        node = self.root
+        while True:
+            (rank, hsp, mdp) = self.pifos[node].dequeue()
+            node.policy.dequeued(rank)
+            if node.is_leaf():
+                return (rank, hsp, mdp)
+            node = node.children[hsp]
+
+
+class PifoModel_node(HW_sim_object):
+    """A PifoModel behind the pipe interface of SkipListWrapper, enqueues and
+       dequeues take a fixed number of cycles
+    """
+    def __init__(self, env, period, enq_in_pipe, enq_out_pipe, deq_in_pipe, deq_out_pipe, latency=1):
+        super(PifoModel_node, self).__init__(env, period)
+        self.enq_in_pipe = enq_in_pipe
+        self.enq_out_pipe = enq_out_pipe
+        self.deq_in_pipe = deq_in_pipe
+        self.deq_out_pipe = deq_out_pipe
+        self.latency = latency
+        self.model = PifoModel()
+        self.num_entries = 0
+        # callbacks called whenever num_entries changes
+        self.watchers = []
+        self.run()
+
+    def run(self):
+        self.env.process(self.enqueue())
+        self.env.process(self.dequeue())
+
+    def notify(self):
+        for watcher in self.watchers:
+            watcher()
+
+    def enqueue(self):
+        while True:
+            (rank, hsp, mdp) = yield self.enq_in_pipe.get()
+            yield self.wait_clocks(self.latency)
+            self.model.enqueue(rank, hsp, mdp)
+            self.num_entries += 1
+            self.notify()
+            self.enq_out_pipe.put(self.latency)
+
+    def dequeue(self):
+        while True:
+            yield self.deq_in_pipe.get()
+            yield self.wait_clocks(self.latency)
+            (rank, hsp, mdp) = self.model.dequeue()
+            self.num_entries -= 1
+            self.notify()
+            self.deq_out_pipe.put((rank, hsp, mdp, self.latency))
+
+
+class Pifo_tree(HW_sim_object):
+    """Timed PIFO tree. Each node is a SkipListWrapper ('sl') or a PifoModel
+       with a fixed latency ('model'). A packet is enqueued into every node on
+       its path in parallel. A dequeue visits one node per level, in sequence,
+       and moving the child handle to the next level costs hop_latency cycles.
+    """
+    def __init__(self, env, period, root, enq_in_pipe, enq_out_pipe, deq_in_pipe, deq_out_pipe, size, hop_latency=1, node_impl='sl',
+                 num_sl=1, outreg_width=4, enq_fifo_depth=4, rd_latency=1, wr_latency=1, sl_impl='det', outreg_latency=1, rng=None):
+        super(Pifo_tree, self).__init__(env, period)
+        self.root = root
+        self.leaves = root.leaves()
+        self.enq_in_pipe = enq_in_pipe
+        self.enq_out_pipe = enq_out_pipe
+        self.deq_in_pipe = deq_in_pipe
+        self.deq_out_pipe = deq_out_pipe
+        self.hop_latency = hop_latency
+        self.num_entries = 0
+        # each node draws from its own random stream derived from rng
+        if rng is None:
+            rng = random.Random()
+
+        # node -> (PIFO, enq_in_pipe, enq_out_pipe, deq_in_pipe, deq_out_pipe)
+        self.pifos = {}
+        for node in root.nodes():
+            pipes = [simpy.Store(env) for i in range(4)]
+            if node_impl == 'sl':
+                pifo = SkipListWrapper(env, pipes[0], pipes[1], pipes[2], pipes[3], num_sl=num_sl, period=period, size=size, outreg_width=outreg_width,
+                                       enq_fifo_depth=enq_fifo_depth, rd_latency=rd_latency, wr_latency=wr_latency, sl_impl=sl_impl,
+                                       outreg_latency=outreg_latency, rng=random.Random(rng.getrandbits(64)))
+            elif node_impl == 'model':
+                pifo = PifoModel_node(env, period, pipes[0], pipes[1], pipes[2], pipes[3], rd_latency)
+            else:
+                print ('ERROR: unsupported PIFO tree node implementation type: {}'.format(node_impl), file=sys.stderr)
+                sys.exit(1)
+            # a dequeue waiting on an entry in flight in the node is woken up when it arrives
+            pifo.watchers.append(self.bg_notify)
+            self.pifos[node] = tuple([pifo] + pipes)
+
+        # register processes for simulation
+        self.run()
+
+    def run(self):
+        self.env.process(self.enqueue())
+        self.env.process(self.dequeue())
+
+    def skip_lists(self):
+        """All skip lists of the tree (none for 'model' nodes)
+        """
+        return [sl for (pifo, a, b, c, d) in self.pifos.values() for sl in getattr(pifo, 'sl', [])]
+
+    def enqueue(self):
+        while True:
+            # wait for enqueue command: leaf index, metadata, packet ptrs
+            (leaf, tuser, hsp, mdp) = yield self.enq_in_pipe.get()
+            t1 = self.env.now
+            ranks = self.leaves[leaf].enq_ranks(tuser)
+            for (node, rank, child) in ranks:
+                enq_in_pipe = self.pifos[node][1]
+                enq_in_pipe.put((rank, hsp, mdp) if child is None else (rank, child.index, -1))
+            # the levels enqueue in parallel
+            for (node, rank, child) in ranks:
+                enq_out_pipe = self.pifos[node][2]
+                yield enq_out_pipe.get()
+            self.num_entries += 1
+            self.enq_out_pipe.put(self.env.now - t1)
+
+    def dequeue(self):
+        while True:
+            # wait for dequeue request
+            deq_req = yield self.deq_in_pipe.get()
+            if self.num_entries > 0:
+                self.num_entries -= 1
+            else:
+                print ("ERROR: Dequeue from empty PIFO tree!")
+                continue
+
+            t1 = self.env.now
+            node = self.root
+            while True:
+                (pifo, enq_in_pipe, enq_out_pipe, node_deq_in_pipe, node_deq_out_pipe) = self.pifos[node]
+                # the entry may still be in flight in this node
+                while pifo.num_entries == 0:
+                    yield self.bg_wait()
+                node_deq_in_pipe.put(deq_req)
+                (rank, hsp, mdp, deq_nclks) = yield node_deq_out_pipe.get()
+                node.policy.dequeued(rank)
+                if node.is_leaf():
+                    break
+                # pass the child handle down to the next level
+                node = node.children[hsp]
+                yield self.wait_clocks(self.hop_latency)
+            self.deq_out_pipe.put((rank, hsp, mdp, self.env.now - t1))
+
+
+def simulate_tree(depth, fanout, num_pkts, pkt_len=64, hop_latency=1, node_impl='sl', sl_impl='det', mem_latency=1, seed=None, max_rank=64):
+    """Enqueue num_pkts packets into a build_tree(depth, fanout) PIFO tree,
+       then dequeue them back-to-back.
+       Returns (enq_nclks, deq_nclks, pkts, dequeued) where pkts lists the
+       (leaf, rank) of the packets in enqueue order and dequeued lists the
+       (leaf rank, hsp) of the packets in dequeue order
+    """
+    env = simpy.Environment()
+    period = 1
+    rng = random.Random(seed)
+    num_leaves = fanout**(depth-1)
+    pkts = [(rng.randint(0, num_leaves-1), rng.randint(0, max_rank)) for i in range(num_pkts)]
+    enq_in_pipe = simpy.Store(env)
+    enq_out_pipe = simpy.Store(env)
+    deq_in_pipe = simpy.Store(env)
+    deq_out_pipe = simpy.Store(env)
+    tree = Pifo_tree(env, period, build_tree(depth, fanout), enq_in_pipe, enq_out_pipe, deq_in_pipe, deq_out_pipe, size=2*num_pkts,
+                     hop_latency=hop_latency, node_impl=node_impl, rd_latency=mem_latency, wr_latency=mem_latency, sl_impl=sl_impl,
+                     rng=random.Random(rng.getrandbits(64)))
+
+    def measure():
+        enq_nclks = []
+        for (i, (leaf, rank)) in enumerate(pkts):
+            enq_in_pipe.put((leaf, Tuser(pkt_len, 0, 0, rank, i), i, i))
+            nclks = yield enq_out_pipe.get()
+            enq_nclks.append(nclks)
+        deq_nclks = []
+        dequeued = []
+        for i in range(num_pkts):
+            deq_in_pipe.put(True)
+            (rank, hsp, mdp, nclks) = yield deq_out_pipe.get()
+            deq_nclks.append(nclks)
+            dequeued.append((rank, hsp))
+        env.exit((np.array(enq_nclks), np.array(deq_nclks), pkts, dequeued))
+
+    return run_sl_tb(env, period, tree.skip_lists(), measure)
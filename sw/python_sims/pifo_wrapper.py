@@ -2,14 +2,144 @@ from __future__ import print_function
 import simpy
 import random
 import sys, os
+import heapq
+import bisect
+from functools import partial
+import numpy as np
 from statistics import mean
 from hwsim_utils import HW_sim_object
 from pifo_skip_list import SkipList as SkipList_prob
 from det_skip_list_simpy import SkipList as SkipList_det
+from pipe_skip_list import SkipList as SkipList_pipe
+from bucket_queue import Bucket_queue, RANK_BITS
+
+# Policies selecting the skip list an entry is enqueued into
+SHARD_POLICIES = ['min_entries', 'round_robin', 'power_of_two', 'rank_range', 'adaptive_range']
+
+# Bins of the rank histogram the adaptive ranges are computed from
+HIST_BINS = 64
+# Enqueues between two adjustments of the adaptive ranges
+REBALANCE_INTERVAL = 64
+# PifoModel batches smaller than 1/HEAP_BATCH_RATIO of the sorted run are
+# pushed onto the heap instead of being merged into the run
+HEAP_BATCH_RATIO = 16
+
+
+def run_sl_tb(env, period, skip_lists, measure):
+    """Testbench skeleton shared by the simulate_*() functions: run the
+       measure() process once skip_lists are initialized, then stop the skip
+       list processes so that the simulation ends.
+       Returns the value measure() passes to env.exit()
+    """
+    result = []
+
+    def tb():
+        # wait for the skip lists to initialize
+        for sl in skip_lists:
+            while sl.busy == 1:
+                yield env.timeout(period)
+        res = yield env.process(measure())
+        result.append(res)
+        # Stop the skip list processes
+        for sl in skip_lists:
+            while sl.busy == 1:
+                yield env.timeout(period)
+            sl.enq_sl_proc.interrupt('Done')
+            sl.deq_sl_proc.interrupt('Done')
+
+    env.process(tb())
+    env.run()
+    return result[0]
+
+
+class Tournament_tree(object):
+    """Tournament tree over n slots holding comparable keys (None for an
+       empty slot). Every internal node holds the slot that wins the match
+       between its two children, so the slot with the min key is at the root
+       and updating a key only replays the matches on its path, O(log n).
+       Ties go to the lower slot.
+    """
+    def __init__(self, n):
+        self.n = n
+        self.size = 1
+        while self.size < n:
+            self.size *= 2
+        self.keys = self.size*[None]
+        # node i has children 2i and 2i+1, the leaves are nodes size..2*size-1
+        self.tree = 2*self.size*[None]
+        for i in range(self.size):
+            self.tree[self.size + i] = i
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = self.tree[2*node]
+
+    def beats(self, a, b):
+        if self.keys[b] is None:
+            return True
+        if self.keys[a] is None:
+            return False
+        return self.keys[a] <= self.keys[b] if a < b else self.keys[a] < self.keys[b]
+
+    def update(self, i, key):
+        self.keys[i] = key
+        node = (self.size + i)//2
+        while node > 0:
+            (l, r) = (self.tree[2*node], self.tree[2*node+1])
+            self.tree[node] = l if self.beats(l, r) else r
+            node //= 2
+
+    def winner(self):
+        """Returns the slot with the min key (None if all slots are empty)
+        """
+        i = self.tree[1]
+        return i if self.keys[i] is not None else None
+
+    def search(self, accept):
+        """Returns the slot with the min key among the slots for which
+           accept(slot) is true. Subtrees are visited in the order of their
+           winners, so each rejected slot only costs O(log n).
+        """
+        heap = [(self.keys[self.tree[1]], self.tree[1], 1)]
+        while len(heap) > 0:
+            (key, i, node) = heapq.heappop(heap)
+            if key is None:
+                break
+            if node >= self.size:
+                if accept(i):
+                    return i
+                continue
+            for child in (2*node, 2*node+1):
+                j = self.tree[child]
+                if self.keys[j] is not None:
+                    heapq.heappush(heap, (self.keys[j], j, child))
+        return None
+
 
 class SkipListWrapper(HW_sim_object):
+    """Shards the PIFO across num_sl skip lists. Enqueues go to the skip
+       list chosen by shard_policy:
+         - min_entries : the ready skip list with the fewest entries
+         - round_robin : the next ready skip list after the last one used
+         - power_of_two : the ready one with fewer entries of two random skip lists
+         - rank_range : skip list i holds ranks i*(max_rank+1)/num_sl and up
+         - adaptive_range : contiguous rank ranges adjusted from a histogram
+           of the enqueued ranks
+       Dequeues take the min of the out reg heads. The entry counts and the
+       heads are kept in tournament trees, updated when an out reg changes
+       or an entry is sent to a skip list, instead of scanning every skip
+       list for every operation. With rank ranges, the min is the head of the
+       lowest skip list holding entries, so only that one is waited for.
+
+       Every REBALANCE_INTERVAL enqueues, adaptive_range moves the range
+       boundaries to the quantiles of the histogram, which is then halved to
+       forget old ranks. Entries cannot be moved between skip lists, so a
+       boundary only moves as far as the ranks held by its two neighbours
+       allow. The quantiles are computed in the background by a pass over
+       the histogram bins (one cycle per bin), enqueues then stall while the
+       boundary registers that moved are written (one cycle each).
+    """
     
-    def __init__(self, env, enq_in_pipe, enq_out_pipe, deq_in_pipe, deq_out_pipe, num_sl, period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, sl_impl, outreg_latency):
+    def __init__(self, env, enq_in_pipe, enq_out_pipe, deq_in_pipe, deq_out_pipe, num_sl, period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, sl_impl, outreg_latency, outreg_impl='list', rng=None, profile=False, mem_impl='bram', search_prefetch=False,
+                 shard_policy='min_entries', max_rank=2**RANK_BITS-1):
         HW_sim_object.__init__(self, env, period)
         self.num_sl = num_sl
         self.enq_in_pipe = enq_in_pipe
@@ -19,23 +149,209 @@ class SkipListWrapper(HW_sim_object):
 
         self.sl = []
         self.num_entries = 0
+        # callbacks called whenever num_entries changes
+        self.watchers = []
+        # each skip list draws from its own random stream derived from rng
+        if rng is None:
+            rng = random.Random()
         
         for i in range(num_sl):
+            sl_rng = random.Random(rng.getrandbits(64))
             if sl_impl == 'prob':
-                sl = SkipList_prob(env, self.period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency)
+                sl = SkipList_prob(env, self.period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency, outreg_impl, sl_rng, profile, mem_impl, search_prefetch)
             elif sl_impl == 'det':
-                sl = SkipList_det(env, self.period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency)
+                sl = SkipList_det(env, self.period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency, outreg_impl, sl_rng, profile, mem_impl, search_prefetch)
+            elif sl_impl == 'pipe':
+                sl = SkipList_pipe(env, self.period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency, outreg_impl, sl_rng, profile, mem_impl, search_prefetch)
+            elif sl_impl == 'bucket':
+                sl = Bucket_queue(env, self.period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency, outreg_impl, sl_rng, profile, mem_impl, search_prefetch)
             else:
-                print >> sys.stderr, 'ERROR: unsupported skipList implementation type: {}'.format(sl_impl)
+                print('ERROR: unsupported skipList implementation type: {}'.format(sl_impl), file=sys.stderr)
                 sys.exit(1)
             self.sl.append(sl)
 
+        if shard_policy not in SHARD_POLICIES:
+            print('ERROR: unsupported shard policy: {}'.format(shard_policy), file=sys.stderr)
+            sys.exit(1)
+        self.shard_policy = shard_policy
+        self.max_rank = max_rank
+        # random stream of the power of two choices
+        self.rng = random.Random(rng.getrandbits(64))
+        # last skip list used by round robin
+        self.rr_sl = num_sl - 1
+        # entries sent to each skip list and not yet dequeued
+        self.sl_entries = num_sl*[0]
+        # skip list --> number of entries, for min_entries
+        self.entries_tree = Tournament_tree(num_sl)
+        # skip list --> out reg head while valid
+        self.heads_tree = Tournament_tree(num_sl)
+        # skip lists holding entries whose out reg head is not valid yet
+        self.pending_heads = set()
+        # event a dequeue waits on until a head becomes valid
+        self.heads_valid = None
+        # skip list --> its index while it holds entries, for the rank ranges
+        self.nonempty_tree = Tournament_tree(num_sl)
+        for i in range(num_sl):
+            self.entries_tree.update(i, 0)
+            self.sl[i].outreg.watchers.append(partial(self.head_changed, i))
+
+        # lowest rank of the range of each skip list
+        self.bounds = [(i*(max_rank + 1) + num_sl - 1)//num_sl for i in range(num_sl)]
+        # histogram of the enqueued ranks and sorted ranks held by each skip list (adaptive_range)
+        self.hist = HIST_BINS*[0]
+        self.sl_ranks = [[] for i in range(num_sl)]
+        self.enq_count = 0
+        # event triggering the next adjustment of the ranges, set while the
+        # rebalancing process is idle
+        self.rebalance_req = None
+        # set while the boundary registers are written
+        self.rebalancing = False
+        self.rebalances = 0
+        self.moved_bounds = 0
+        self.rebalance_nclks = 0
+
         # register processes for simulation
         self.run(env)
 
     def run(self, env):
         self.env.process(self.enqueue())
         self.env.process(self.dequeue())
+        if self.shard_policy == 'adaptive_range':
+            self.rebalance_proc = self.env.process(self.rebalance_sm())
+
+    def notify(self):
+        for watcher in self.watchers:
+            watcher()
+
+    def ready(self, i):
+        return self.sl[i].busy == 0 and self.sl[i].outreg.busy == 0
+
+    def head_changed(self, i):
+        """Called by the out reg of skip list i when its head changes
+        """
+        outreg = self.sl[i].outreg
+        self.heads_tree.update(i, outreg.next if outreg.next_valid == 1 and outreg.num_entries > 0 else None)
+        self.update_pending(i)
+        if self.heads_valid is not None and self.heads_tree.keys[i] is not None:
+            self.heads_valid.succeed()
+            self.heads_valid = None
+
+    def update_pending(self, i):
+        if self.sl_entries[i] > 0 and self.heads_tree.keys[i] is None:
+            self.pending_heads.add(i)
+        else:
+            self.pending_heads.discard(i)
+
+    def add_entries(self, i, n):
+        self.sl_entries[i] += n
+        self.entries_tree.update(i, self.sl_entries[i])
+        self.nonempty_tree.update(i, i if self.sl_entries[i] > 0 else None)
+        self.update_pending(i)
+
+    def min_head(self):
+        """Returns the skip list holding the min entry once its head is known
+           (None while the dequeue must wait or all skip lists are empty)
+        """
+        if self.shard_policy in ('rank_range', 'adaptive_range'):
+            i = self.nonempty_tree.winner()
+            if i is None:
+                return None
+            return i if self.heads_tree.keys[i] is not None else None
+        # the heads of all the skip lists holding entries must be valid
+        return self.heads_tree.winner() if len(self.pending_heads) == 0 else None
+
+    def rank_bin(self, value):
+        return min(max(value, 0)*HIST_BINS//(self.max_rank + 1), HIST_BINS - 1)
+
+    def bin_rank(self, b):
+        """Lowest rank of histogram bin b
+        """
+        return (b*(self.max_rank + 1) + HIST_BINS - 1)//HIST_BINS
+
+    def quantiles(self, hist):
+        """Returns the target lower bound of skip lists 1..num_sl-1, so that
+           each range gets the same share of the histogram
+        """
+        total = sum(hist)
+        targets = []
+        cum = 0
+        b = 0
+        for k in range(1, self.num_sl):
+            while b < HIST_BINS and cum + hist[b] <= k*total//self.num_sl:
+                cum += hist[b]
+                b += 1
+            targets.append(self.bin_rank(b))
+        return targets
+
+    def move_bounds(self, targets):
+        """Move the range boundaries towards targets
+           Returns the number of boundaries that moved
+        """
+        # boundary k must stay above the ranks held below it and at or below the ranks held above it
+        lo = self.num_sl*[0]
+        held = 0
+        for k in range(1, self.num_sl):
+            if len(self.sl_ranks[k-1]) > 0:
+                held = self.sl_ranks[k-1][-1] + 1
+            lo[k] = held
+        hi = self.num_sl*[self.max_rank + 1]
+        held = self.max_rank + 1
+        for k in range(self.num_sl - 1, 0, -1):
+            if len(self.sl_ranks[k]) > 0:
+                held = self.sl_ranks[k][0]
+            hi[k] = held
+        moved = 0
+        for k in range(1, self.num_sl):
+            bound = min(max(targets[k-1], lo[k]), hi[k])
+            if bound != self.bounds[k]:
+                self.bounds[k] = bound
+                moved += 1
+        return moved
+
+    def rebalance_sm(self):
+        """Adjust the adaptive ranges whenever requested by the enqueue process
+        """
+        while True:
+            self.rebalance_req = self.env.event()
+            yield self.rebalance_req
+            t1 = self.env.now
+            hist = self.hist
+            self.hist = [h//2 for h in hist]
+            # one pass over the histogram bins
+            yield self.wait_clocks(HIST_BINS)
+            targets = self.quantiles(hist)
+            # enqueues stall while the boundary registers are written
+            self.rebalancing = True
+            moved = self.move_bounds(targets)
+            if moved > 0:
+                yield self.wait_clocks(moved)
+            self.rebalancing = False
+            self.rebalances += 1
+            self.moved_bounds += moved
+            self.rebalance_nclks += self.env.now - t1
+
+    def select_sl(self, value):
+        """Returns the skip list to enqueue value into (None if it must wait)
+        """
+        if self.rebalancing:
+            return None
+        if self.shard_policy == 'min_entries':
+            return self.entries_tree.search(self.ready)
+        elif self.shard_policy == 'round_robin':
+            for j in range(1, self.num_sl + 1):
+                i = (self.rr_sl + j) % self.num_sl
+                if self.ready(i):
+                    self.rr_sl = i
+                    return i
+            return None
+        elif self.shard_policy == 'power_of_two':
+            choices = [i for i in self.rng.sample(range(self.num_sl), min(2, self.num_sl)) if self.ready(i)]
+            if len(choices) == 0:
+                return None
+            return min(choices, key=lambda i: (self.sl_entries[i], i))
+        else:
+            i = bisect.bisect_right(self.bounds, value) - 1 if value >= 0 else 0
+            return i if self.ready(i) else None
 
     def enqueue(self):
         while True:
@@ -43,59 +359,199 @@ class SkipListWrapper(HW_sim_object):
             enq_req = yield self.enq_in_pipe.get()
             
             t1 = self.env.now
-            # Select the skip list w/ min number of entries among the ready (not busy) skip lists
-            sel_sl = None
+            # Select a ready (not busy) skip list
+            sel_sl = self.select_sl(enq_req[0])
             while sel_sl == None:
-                for i in range(self.num_sl):
-                    if (self.sl[i].busy == 0 and self.sl[i].outreg.busy == 0):
-                        if sel_sl == None:
-                            sel_sl = i
-                            min_num_entries = self.sl[i].num_entries
-                        else:
-                            if self.sl[i].num_entries < min_num_entries:
-                                sel_sl = i
-                                min_num_entries = self.sl[i].num_entries
-                # All skip lists busy, try again
-                if sel_sl == None:
-                    yield self.env.timeout(self.period)
+                # All candidate skip lists busy, try again
+                yield self.env.timeout(self.period)
+                sel_sl = self.select_sl(enq_req[0])
             # Send enqueue request to selected skip list
             self.sl[sel_sl].enq_in_pipe.put(enq_req)
+            self.add_entries(sel_sl, 1)
+            if self.shard_policy == 'adaptive_range':
+                bisect.insort(self.sl_ranks[sel_sl], enq_req[0])
+                self.hist[self.rank_bin(enq_req[0])] += 1
+                self.enq_count += 1
+                # a request is dropped if the previous adjustment is still in progress
+                if self.enq_count % REBALANCE_INTERVAL == 0 and self.rebalance_req is not None:
+                    self.rebalance_req.succeed()
+                    self.rebalance_req = None
             yield self.env.timeout(self.period)
             self.num_entries += 1
+            self.notify()
             self.enq_out_pipe.put(self.env.now - t1)
 
     def dequeue(self):
+        """A dequeue selects its skip list as soon as the heads it is chosen
+           from are valid. The original wrapper polled the skip lists one after
+           the other on period boundaries, so it could resume up to a cycle
+           late per pending head and compare against heads that had changed
+           meanwhile: with the same seed, enqueues and dequeues at a steady
+           fill level are unchanged, unconstrained runs dequeue a few cycles
+           earlier or later per pkt and slightly earlier on average
+           (test_deq_wait.py).
+        """
         while True:
             # wait for dequeue request
             deq_req = yield self.deq_in_pipe.get()
             if self.num_entries > 0:
                 self.num_entries -= 1
+                self.notify()
             else:
                 print ("ERROR: Dequeue from empty PIFO!")
                 continue
             
             t1 = self.env.now
-            # From non-empty skip lists/regs, select the one with the min value
-            sel_sl = None
-            while sel_sl == None:
-                for i in range(self.num_sl):
-                    # Wait until out reg has valid data if there's data in the skip list
-                    while (self.sl[i].num_entries > 0 and self.sl[i].outreg.next_valid == 0):
-                        yield self.env.timeout(self.period)
-                    if self.sl[i].outreg.next_valid == 1:
-                        if sel_sl == None:
-                            sel_sl = i
-                            min_value = self.sl[i].outreg.next
-                        else:
-                            if self.sl[i].outreg.next < min_value:
-                                sel_sl = i
-                                min_value = self.sl[i].outreg.next
-                if sel_sl == None:
-                    yield self.env.timeout(self.period)
+            # Select the skip list with the min head, once the heads it is chosen from are valid
+            sel_sl = self.min_head()
+            while sel_sl is None:
+                self.heads_valid = self.env.event()
+                yield self.heads_valid
+                sel_sl = self.min_head()
+            self.add_entries(sel_sl, -1)
             # Send dequeue request to selected skip list
             self.sl[sel_sl].deq_in_pipe.put(deq_req)
             (deq_val, deq_hsp, deq_mdp, deq_nclks) = yield self.sl[sel_sl].deq_out_pipe.get()
+            if self.shard_policy == 'adaptive_range':
+                ranks = self.sl_ranks[sel_sl]
+                del ranks[bisect.bisect_left(ranks, deq_val)]
             # Update deq nclks
             deq_nclks = self.env.now - t1
             self.deq_out_pipe.put((deq_val, deq_hsp, deq_mdp, deq_nclks))
 
+
+class PifoModel(object):
+    """Untimed reference model of the PIFO, used as a golden model and to replay
+       long traces quickly. Entries are ordered by (rank, arrival) so that entries
+       with equal rank are dequeued in FIFO order.
+
+       Single entries are kept in a heap. Entries enqueued in batches are kept
+       in NumPy arrays and, the next time the PIFO is read, sorted and merged
+       into a sorted run, so whole traces can be pushed in and drained
+       without a Python level operation per entry. Only the new entries are
+       sorted, they are inserted into the run at the positions found with
+       searchsorted (O(n + m log m) for m new entries). A batch much smaller
+       than the run goes to the heap instead (O(m log h)), so alternating
+       small batches and dequeues does not copy the run every time.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.num_entries = 0
+        # arrival counter used to break ties between equal ranks
+        self.seq = 0
+        # batches that have not been sorted yet: list of (ranks, seqs, hsps, mdps) arrays
+        self.pending = []
+        # sorted run of batched entries, entries before run_idx have been dequeued
+        self.run = None
+        self.run_idx = 0
+
+    def enqueue(self, rank, hsp, mdp):
+        heapq.heappush(self.heap, (rank, self.seq, hsp, mdp))
+        self.seq += 1
+        self.num_entries += 1
+
+    def enqueue_batch(self, ranks, hsp, mdp):
+        """Enqueue len(ranks) entries in arrival order
+           Inputs:
+             - ranks, hsp, mdp : array-likes of equal length
+        """
+        ranks = np.asarray(ranks)
+        hsp = np.asarray(hsp)
+        mdp = np.asarray(mdp)
+        if not (len(ranks) == len(hsp) == len(mdp)):
+            print ("ERROR: enqueue_batch: ranks, hsp and mdp lengths differ ({}, {}, {})".format(len(ranks), len(hsp), len(mdp)))
+            return
+        n = len(ranks)
+        seqs = np.arange(self.seq, self.seq + n)
+        run_entries = len(self.run[0]) - self.run_idx if self.run is not None else 0
+        if n*HEAP_BATCH_RATIO < run_entries:
+            for entry in zip(ranks.tolist(), seqs.tolist(), hsp.tolist(), mdp.tolist()):
+                heapq.heappush(self.heap, entry)
+        else:
+            self.pending.append((ranks, seqs, hsp, mdp))
+        self.seq += n
+        self.num_entries += n
+
+    def merge_run(self, include_heap=False):
+        """Merge the pending batches (and optionally the heap entries) into the sorted run
+        """
+        batches = self.pending
+        if include_heap and len(self.heap) > 0:
+            batches.append(tuple(np.array(f) for f in zip(*self.heap)))
+            self.heap = []
+        if len(batches) == 0:
+            return
+        (ranks, seqs, hsps, mdps) = [np.concatenate(f) for f in zip(*batches)]
+        # sort the new entries by rank, breaking ties by arrival order
+        order = np.lexsort((seqs, ranks))
+        new = (ranks[order], seqs[order], hsps[order], mdps[order])
+        if self.run is not None and self.run_idx < len(self.run[0]):
+            run = tuple(f[self.run_idx:] for f in self.run)
+            self.run = tuple(np.insert(run_f, self.merge_positions(run[0], run[1], new[0], new[1]), new_f) for (run_f, new_f) in zip(run, new))
+        else:
+            self.run = new
+        self.run_idx = 0
+        self.pending = []
+
+    def merge_positions(self, run_ranks, run_seqs, ranks, seqs):
+        """Returns the indices of the sorted run before which the new entries
+           (ranks, seqs) go, so that the merged run is ordered by (rank, seq)
+        """
+        lo = np.searchsorted(run_ranks, ranks, side='left')
+        hi = np.searchsorted(run_ranks, ranks, side='right')
+        # among the entries of equal rank, order by seq: the key of a run entry
+        # is the start of its rank's range followed by its seq, which
+        # increases along the run
+        span = max(run_seqs.max(), seqs.max()) + 1
+        run_keys = np.searchsorted(run_ranks, run_ranks, side='left')*span + run_seqs
+        tie_pos = np.searchsorted(run_keys, lo*span + seqs)
+        return np.where(hi > lo, tie_pos, lo)
+
+    def dequeue(self):
+        """Returns (rank, hsp, mdp) of the entry with the min rank
+        """
+        if self.num_entries == 0:
+            print ("ERROR: Dequeue from empty PIFO!")
+            return None
+        self.merge_run()
+        self.num_entries -= 1
+        if self.run is not None and self.run_idx < len(self.run[0]):
+            (ranks, seqs, hsps, mdps) = self.run
+            i = self.run_idx
+            if len(self.heap) == 0 or (ranks.item(i), seqs.item(i)) < self.heap[0][:2]:
+                self.run_idx += 1
+                return (ranks.item(i), hsps.item(i), mdps.item(i))
+        (rank, seq, hsp, mdp) = heapq.heappop(self.heap)
+        return (rank, hsp, mdp)
+
+    def dequeue_batch(self, n):
+        """Dequeue the n entries with the min ranks
+           Returns (ranks, hsps, mdps) arrays in dequeue order
+        """
+        if n > self.num_entries:
+            print ("ERROR: dequeue_batch: requested {} entries from PIFO with {} entries".format(n, self.num_entries))
+            n = self.num_entries
+        if n == 0:
+            self.merge_run()
+            if self.run is None:
+                return (np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=int))
+            return tuple(f[:0].copy() for f in (self.run[0], self.run[2], self.run[3]))
+        self.merge_run(include_heap=len(self.heap) > 0)
+        (ranks, seqs, hsps, mdps) = self.run
+        i = self.run_idx
+        self.run_idx += n
+        self.num_entries -= n
+        return (ranks[i:i+n].copy(), hsps[i:i+n].copy(), mdps[i:i+n].copy())
+
+    def peek(self):
+        """Returns the rank of the next entry to be dequeued (None if empty)
+        """
+        if self.num_entries == 0:
+            return None
+        self.merge_run()
+        if self.run is not None and self.run_idx < len(self.run[0]):
+            run_rank = self.run[0].item(self.run_idx)
+            if len(self.heap) == 0 or run_rank <= self.heap[0][0]:
+                return run_rank
+        return self.heap[0][0]
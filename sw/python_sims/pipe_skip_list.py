@@ -1,75 +1,91 @@
-
-import sys, os
-from scapy.all import *
+from __future__ import print_function
+import sys
+import math
 import simpy
-from hwsim_utils import HW_sim_object, BRAM, Tuser, Fifo
-
-MAX_NODES = 20
+from collections import deque
+from hwsim_utils import HW_sim_object, Fifo, OUT_REG_IMPLS, MEM_IMPLS, Op_profiler
 
-HEAD_PTR = 'HEAD'
-TAIL_PTR = 'TAIL'
+# Maximum number of consecutive nodes in a level between two nodes that also
+# appear in the level above (deterministic 1-2-3 skip list)
+MAX_GAP = 3
 
 
-class PSL_level0_node(object):
-    """The object type that is stored in BRAM entries of level 0
+class PSL_node(object):
+    """The object type that is stored in the node BRAM of every level.
+       Level 0 nodes carry the metadata ptrs, the nodes of the levels above
+       carry the ptr of the node with the same key in the level below.
+       Nodes are never modified in place, a modified copy is written instead.
     """
-    def __init__(self, rank, timestamp, left, right, up, meta_ptrs, valid=True):
+    def __init__(self, rank, timestamp, right, towered=False, down=None, meta_ptrs=None):
         self.rank = rank
         self.timestamp = timestamp
-        self.left = left
         self.right = right
-        self.up = up
+        # set if a node with the same key exists in the level above
+        self.towered = towered
+        self.down = down
         self.meta_ptrs = meta_ptrs
-        self.valid = valid
-
-    def __str__(self):
-        return 'rank = {}, timestamp = {}, left = {}, right = {}, meta_ptrs = {}'.format(self.rank, self.timestamp, self.left, self.right, self.meta_ptrs)
 
+    def key(self):
+        return (self.rank, self.timestamp)
 
-class PSL_node(object):
-    """The object type that is stored in BRAM entries of all levels above level 0
-    """
-    def __init__(self, rank, timestamp, left, right, up, down):
-        self.rank = rank
-        self.timestamp = timestamp
-        self.left = left
-        self.right = right
-        self.up = up
-        self.down = down
+    def copy(self, right=None, towered=None):
+        return PSL_node(self.rank, self.timestamp, self.right if right is None else right,
+                        self.towered if towered is None else towered, self.down, self.meta_ptrs)
 
     def __str__(self):
-        return 'rank = {}, timestamp = {}, left = {}, right = {}, down = {}'.format(self.rank, self.timestamp, self.left, self.right, self.down)
+        return 'rank = {}, timestamp = {}, right = {}, towered = {}, down = {}, meta_ptrs = {}'.format(self.rank, self.timestamp, self.right, self.towered, self.down, self.meta_ptrs)
+
 
 class PSL_push_down_req(object):
     """The object type of requests pushed from a level above to a level below.
-       These push down requests occur during the search procedure.
+       These push down requests occur during the search procedure, there is
+       one per entry enqueued into the skip list.
     """
-    def __init__(self, rank, timestamp, meta_ptrs, start, up, free_nodes, valid=True):
-        """start - ptr to node in level below at which to start the search
-           up - ptr to node in level above (the one issuing the request), the node at which it was decided to drop down a level
-           free_nodes - a list of N free node ptrs in the level above (the one issuing the request), these are used to create the up pointers for any nodes that must be inserted in the level below
+    def __init__(self, req_id, rank, timestamp, meta_ptrs, node, t_start):
+        """node - ptr to the level 0 node allocated for the new entry
         """
+        self.req_id = req_id
         self.rank = rank
         self.timestamp = timestamp
-        self.start = start
-        self.up = up
-        self.free_nodes = free_nodes
-        self.valid = valid
+        self.meta_ptrs = meta_ptrs
+        self.node = node
+        self.t_start = t_start
+        # time at which the request reached level 0
+        self.t_insert = None
+        # ptr to node in the level below at which to start the search (None for the head)
+        self.start = None
+        # level -> ptr to the node at which the search started in that level,
+        # push up requests resume from there
+        self.starts = {}
+
+    def key(self):
+        return (self.rank, self.timestamp)
+
 
 class PSL_push_up_req(object):
     """The object type of requests pushed from a level below to a level above.
-       These push up requests are insertion requests.
+       These push up requests are insertion requests: a node of the level below
+       was promoted and a node with the same key must be inserted above it.
     """
-    def __init__(self, rank, timestamp, target, down, free_nodes, valid=True):
-        """target - ptr to the node in the receiving level to the right of which the new node must be inserted
+    def __init__(self, req, rank, timestamp, down):
+        """req - the push down request whose insertion caused the promotion
            down - the down ptr of the newly inserted node
-           free_nodes - a list of the free node ptrs for this level that were unused by the level below in the previous stage of processing
         """
+        self.req = req
         self.rank = rank
         self.timestamp = timestamp
-        self.target = target
         self.down = down
-        self.valid = valid
+
+
+class PSL_rm_req(object):
+    """The object type of removal requests. Level 0 removes its first node,
+       the levels above remove the node above it if it was towered.
+    """
+    def __init__(self, down=None):
+        """down - ptr to the node removed from the level below
+        """
+        self.down = down
+
 
 class PSL_rm_result(object):
     """The result returned by a removal request to level 0
@@ -80,233 +96,438 @@ class PSL_rm_result(object):
         self.meta_ptrs = meta_ptrs
 
 
-class PSL_level0(HW_sim_object):
-    def __init__(self, env, period, pd_in_pipe, pu_out_pipe, rm_req_pipe, rm_result_pipe, max_nodes=MAX_NODES, rd_latency=2, wr_latency=1):
-        """pd_in_pipe - the pipe on which push down requests will be received
-           pu_out_pipe - the pipe on which push up requests will be inserted
-        """
-        super(PSL_level0, self).__init__(env, period)
-
-        # the pipe on which push down requests will be received 
-        self.pd_in_pipe = pd_in_pipe
-        # the pipe on which push up requests will be inserted 
-        self.pu_out_pipe = pu_out_pipe
-
-        # the pipe on which removal requests will be placed
-        self.rm_req_pipe = rm_req_pipe
-        # the pipe on which removal results will be written
-        self.rm_result_pipe = rm_result_pipe
+class PSL_level(HW_sim_object):
+    """One level of the pipelined skip list. Each level has its own node BRAM,
+       free list and head register, and handles one request at a time:
+       push ups and removals from the level below take priority over push
+       downs from the level above.
+    """
+    def __init__(self, env, period, psl, level, size, rd_latency, wr_latency, mem_impl='bram'):
+        super(PSL_level, self).__init__(env, period)
+        # the skip list this level belongs to
+        self.psl = psl
+        self.level = level
 
         self.nodes_r_in_pipe = simpy.Store(env)
         self.nodes_r_out_pipe = simpy.Store(env)
         self.nodes_w_in_pipe = simpy.Store(env)
-        # maps: node ptr --> PSL_level0_node object
-        self.node_bram = BRAM(env, period, self.nodes_r_in_pipe,
-                                           self.nodes_r_out_pipe,
-                                           self.nodes_w_in_pipe, depth=max_nodes, write_latency=wr_latency, read_latency=rd_latency)
-
-        self.max_nodes = max_nodes
+        self.nodes_w_out_pipe = simpy.Store(env)
+        # maps: node ptr --> PSL_node object
+        self.nodes = MEM_IMPLS[mem_impl](env, period, self.nodes_r_in_pipe, self.nodes_r_out_pipe, self.nodes_w_in_pipe, self.nodes_w_out_pipe,
+                                         size, wr_latency, rd_latency)
+        # levels record into the samples of the skip list profiler
+        self.profiler = Op_profiler(env, psl.profiler.enabled, psl.profiler.samples)
+        if self.profiler.enabled:
+            self.nodes.profiler = self.profiler
 
         # stores free node ptrs
-        self.node_free_list = Fifo(max_nodes)
-        self.init_free_lists()
-
-        # set up the tail pointer to point to the HEAD node 
-        self.tail_ptr = HEAD_PTR
-
-        # The head node is stored in register to provide fall through functionality
-        #   If the head node is invalid then that means there is nothing in the level
-        left = TAIL_PTR
-        self.head_node = PSL_level0_node(0, 0, left, 0, 0, 0, valid=False)
+        self.free_node_list = Fifo(size)
+        for addr in range(size):
+            self.free_node_list.push(addr)
+        self.free_node_list.reset_watermarks()
+        # free nodes promised to push up requests in flight from the level below
+        self.reserved = 0
+
+        # ptr to the first node of the level (None if the level is empty)
+        self.head = None
+        # key of the first node, only maintained for level 0
+        self.head_key = None
+        self.num_nodes = 0
+        # nodes removed from the level that requests in flight may still point to
+        self.dead = set()
+
+        # push ups and removals from the level below, in arrival order
+        self.up_queue = deque()
+        # push downs from the level above
+        self.down_queue = deque()
+        self.wakeup = None
 
         self.run()
 
-    """
-    Initialize free lists
-    """
-    def init_free_lists(self):
-        # Add all segments to node free list 
-        for i in range(self.max_nodes):
-            self.node_free_list.push(i)
-
     def run(self):
         """Register the processes with the simulation environment
         """
         self.env.process(self.process_level_sm())
 
-    def process_level_sm(self):
-        """This process must read incomming push down requests and removal requests,
-           then update the head node and produce any push up requests
-        """
-        while True:
-            pd_req = PSL_push_down_req(0, 0, 0, 0, 0, [], valid=False)
-            # check if there are any push down requests
-            if len(self.pd_in_pipe.items) > 0:
-                pd_req = yield self.pd_in_pipe.get()
-
-            rm_req = None
-            # check of there are any removal requests
-            if len(self.rm_req_pipe.items) > 0:
-                rm_req = yield self.rm_req_pipe.get()
-
-            # now use the push down request and removal request to update head_node and produce a push up request if necessary
-
-            # check if a node needs to be removed
-            if rm_req is not None:
-                # write out the removal result
-                yield self.env.process(self.process_remove(pd_req))
-
-            # check if pd_req still needs to be inserted
-            if pd_req.valid:
-                yield self.env.process(self.insert_pd_req(pd_req))
-                
-            yield self.wait_clock()
+    def put_up(self, msg):
+        self.up_queue.append(msg)
+        self.wake()
 
-    def insert_pd_req(self, pd_req):
-        """Start looking for where to insert the pd_req.
-           Keep track of:
-             - The last up ptr we saw that is not None, starting with the up ptr in the pd_req
-             - The number of nodes we've traversed: for a 1-2 skip list, should not traverse more than 2.
-               If we are on our second node and the pd_req is still smaller then insert the pd_re immediately after this node and submit a push up req for the node we are at
-        """
+    def put_down(self, req):
+        self.down_queue.append(req)
+        self.wake()
+
+    def wake(self):
+        if self.wakeup is not None and not self.wakeup.triggered:
+            self.wakeup.succeed()
+
+    def can_allocate(self):
+        return self.free_node_list.fill_level() > self.reserved
 
+    def read(self, addr):
+        self.nodes_r_in_pipe.put(addr)
+        return self.nodes_r_out_pipe.get()
 
+    def write(self, addr, node):
+        self.nodes_w_in_pipe.put((addr, node))
+        return self.nodes_w_out_pipe.get()
 
-    def process_remove(self, pd_req):
-        """A removal request has been asserted. Need to decide whether to remove the current head node
-           or the push down request
+    def process_level_sm(self):
+        """Handle one request per iteration
         """
-        if pd_req.valid and self.head_node.valid:
-            # either need to return the head node or the pd node depending on which is smaller
-            if pd_req.rank < self.head_node.rank:
-                # return the pd_request
-                rm_result = PSL_rm_result(pd_req.rank, pd_req.timestamp, pd_req.meta_ptrs)
-                # no longer need to insert pd_req
-                pd_req.valid = False
+        while True:
+            if len(self.up_queue) == 0 and len(self.down_queue) == 0:
+                self.wakeup = self.env.event()
+                yield self.wakeup
+            if len(self.up_queue) > 0:
+                msg = self.up_queue.popleft()
+                if isinstance(msg, PSL_rm_req):
+                    yield self.env.process(self.process_remove(msg))
+                else:
+                    yield self.env.process(self.insert_pu_req(msg))
             else:
-                # return the head_node
-                rm_result = PSL_rm_result(self.head_node.rank, self.head_node.timestamp, self.head_node.meta_ptrs)
-                # head node need to be replaced
-                yield self.env.process(self.replace_head(pd_req))
-        elif pd_req.valid:
-            # return the pd_request
-            rm_result = PSL_rm_result(pd_req.rank, pd_req.timestamp, pd_req.meta_ptrs)
-            # no longer need to insert pd_req
-            pd_req.valid = False
-        elif self.head_node.valid:
-            # return the head_node
-            rm_result = PSL_rm_result(self.head_node.rank, self.head_node.timestamp, self.head_node.meta_ptrs)
-            # head node need to be replaced
-            yield self.env.process(self.replace_head(pd_req))
-        else:
-            print "ERROR: removal request received but head node and pd_request are invalid"
-            sys.exit(1)
-        # write out the removal result
-        self.rm_result_pipe.put(rm_result)
-        yield self.wait_clock()
-
-    def replace_head(self, pd_req):
-        """ We just removed the head node so it must be replaced.
-            The pd_req still needs to be processed. If the pd_request's start node == self.head_node.left
-            then we just need to replace the head_node with the pd_req :)
+                req = self.down_queue.popleft()
+                if self.level == 0:
+                    yield self.env.process(self.insert_pd_req(req))
+                else:
+                    yield self.env.process(self.process_pd_req(req))
+            yield self.wait_clock()
+
+    def search(self, start, key):
+        """Walk right from start (None for the head) to the last node with a
+           smaller key. Returns (pred, pred_node, nxt, nxt_node, gap) where
+           nxt is the first node with a larger key and gap lists the
+           (ptr, node) pairs from the last towered node up to pred.
+           Removed nodes are only ever at the front of a level, so a search
+           starting at one starts at the head instead.
         """
-        if pd_req.valid and (self.head_node.left == pd_req.start or self.head_node.left == TAIL_PTR):
-            # replace head node with pd_req :)
-            yield self.env.process(self.replace_head_with_pd_req(pd_req))
+        gap = []
+        if start is None or start in self.dead:
+            (pred, pred_node, nxt) = (None, None, self.head)
         else:
-            # replace head with left neighbor
-            if (self.head_node.left == TAIL_PTR):
-                # this level is now empty
-                self.head_node.valid = False
-                self.tail_ptr = HEAD_PTR
+            pred = start
+            pred_node = yield self.read(start)
+            nxt = pred_node.right
+            gap.append((pred, pred_node))
+        nxt_node = None
+        while nxt is not None:
+            nxt_node = yield self.read(nxt)
+            if nxt_node.key() > key:
+                break
+            (pred, pred_node) = (nxt, nxt_node)
+            if pred_node.towered:
+                gap = []
+            gap.append((pred, pred_node))
+            nxt = pred_node.right
+            nxt_node = None
+        self.env.exit((pred, pred_node, nxt, nxt_node, gap))
+
+    def insert(self, req, rank, timestamp, ptr, down, meta_ptrs):
+        """Insert node ptr, searching from where req's search started in this
+           level. If the gap of the new node grows over MAX_GAP nodes, its
+           middle node is promoted into the level above.
+           Returns True if a push up request was issued.
+        """
+        key = (rank, timestamp)
+        (pred, pred_node, nxt, nxt_node, gap) = yield self.env.process(self.search(req.starts.get(self.level), key))
+        new_node = PSL_node(rank, timestamp, nxt, False, down, meta_ptrs)
+        gap.append((ptr, new_node))
+
+        above = self.psl.levels[self.level+1] if self.level+1 < len(self.psl.levels) else None
+        promote = above is not None and above.can_allocate()
+        # count the rest of the gap, up to the next towered node
+        while promote and len(gap) <= MAX_GAP and nxt is not None:
+            if nxt_node is None:
+                nxt_node = yield self.read(nxt)
+            if nxt_node.towered:
+                break
+            gap.append((nxt, nxt_node))
+            (nxt, nxt_node) = (nxt_node.right, None)
+
+        updates = {}
+        if pred is not None:
+            updates[pred] = pred_node.copy(right=ptr)
+        promoted = None
+        if promote and len(gap) > MAX_GAP:
+            (promoted, p_node) = gap[len(gap)//2]
+            if promoted == ptr:
+                new_node.towered = True
+            elif promoted in updates:
+                updates[promoted].towered = True
             else:
-                yield self.env.process(self.replace_head_with_neighbor(pd_req))
-
-        yield self.wait_clock()
+                updates[promoted] = p_node.copy(towered=True)
+
+        yield self.write(ptr, new_node)
+        for (addr, node) in updates.items():
+            yield self.write(addr, node)
+        if pred is None:
+            self.head = ptr
+            self.head_key = key
+        self.num_nodes += 1
+
+        if promoted is not None:
+            above.reserved += 1
+            above.put_up(PSL_push_up_req(req, p_node.rank if promoted != ptr else rank,
+                                         p_node.timestamp if promoted != ptr else timestamp, promoted))
+        self.env.exit(promoted is not None)
+
+    def process_pd_req(self, pd_req):
+        """Search this level and push the request down to the level below
+        """
+        prof = self.profiler.begin('search')
+        pd_req.starts[self.level] = pd_req.start
+        (pred, pred_node, nxt, nxt_node, gap) = yield self.env.process(self.search(pd_req.start, pd_req.key()))
+        pd_req.start = pred_node.down if pred is not None else None
+        self.profiler.end(prof)
+        # Stall until the level below can accept the request
+        below = self.psl.levels[self.level-1]
+        while len(below.down_queue) > 0:
+            yield self.wait_clock()
+        below.put_down(pd_req)
 
-    def replace_head_with_pd_req(self, pd_req):
-        """Replace the head node with the pd_request
+    def insert_pd_req(self, pd_req):
+        """Insert the new entry into level 0
         """
-        left = self.head_node.left
-        right = None
-        up = None # no need to add a level above this node
-        self.head_node = PSL_level0_node(pd_req.rank, pd_req.timestamp, left, right, up, pd_req.meta_ptrs)
-        pd_req.valid = False # no need for further processing
-        yield self.wait_clock()
-
-    def replace_head_with_neighbor(self, pd_req):
-        """The head node needs to be replaced with it's left neighbor
+        prof = self.profiler.begin('enq_sl')
+        pd_req.t_insert = self.env.now
+        pd_req.starts[0] = pd_req.start
+        promoted = yield self.env.process(self.insert(pd_req, pd_req.rank, pd_req.timestamp, pd_req.node, None, pd_req.meta_ptrs))
+        self.profiler.end(prof)
+        self.psl.inserted(pd_req, promoted)
+
+    def insert_pu_req(self, pu_req):
+        """Insert the node promoted from the level below
         """
-        # replace head node with its left neighbor
-        left_addr = self.head_node.left
-        self.nodes_r_in_pipe.put(left_addr)
-        self.head_node = yield self.nodes_r_out_pipe.get()
-        # return the new head's old address to the free list
-        self.node_free_list.push(left_addr)
-
-        # Update the head node's left neighbor appropriately
-        #    This may just require updating the left neighbor's right pointer to point to the HEAD
-        #    Or we may want to insert the pd_req as the new head's left neighbor
-        if self.head_node.left != TAIL_PTR:
-            left_ptr = self.head_node.left
-            self.nodes_r_in_pipe.put(left_ptr)
-            left_neighbor = yield self.nodes_r_out_pipe.get()
-            if self.head_node.left == pd_req.start and pd_req.valid:
-                # the pd request must be inserted here (between the head's current left and the head)
-                new_addr = self.node_free_list.pop()
-                left = pd_req.start
-                right = HEAD_PTR
-                up = None # no need to add level above this yet
-                new_node = PSL_level0_node(pd_req.rank, pd_req.timestamp, left, right, up, pd_req.meta_ptrs)
-                left_neighbor.right = new_addr
-                self.head_node.left = new_addr
-                # write the new node
-                self.nodes_w_in_pipe.put((new_addr, new_node))
-                pd_req.valid = False # no need for further processing
+        prof = self.profiler.begin('push_up')
+        ptr = self.free_node_list.pop()
+        self.reserved -= 1
+        promoted = yield self.env.process(self.insert(pu_req.req, pu_req.rank, pu_req.timestamp, ptr, pu_req.down, None))
+        self.profiler.end(prof)
+        if not promoted:
+            self.psl.complete(pu_req.req)
+
+    def process_remove(self, rm_req):
+        """Remove the first node of the level. Level 0 returns it to the skip
+           list, the levels above remove the tower of the dequeued node.
+        """
+        prof = self.profiler.begin('deq_sl' if self.level == 0 else 'deq_collapse')
+        first = self.head
+        first_node = yield self.read(first)
+        if self.level > 0 and first_node.down != rm_req.down:
+            print ("ERROR: level {} removal of node {} whose down ptr is not {}".format(self.level, first, rm_req.down), file=sys.stderr)
+        self.head = first_node.right
+        self.num_nodes -= 1
+        self.psl.kill(self, first)
+        if first_node.towered:
+            self.psl.levels[self.level+1].put_up(PSL_rm_req(first))
+        if self.level == 0:
+            # The key of the first node is kept in a register
+            if self.head is not None:
+                head_node = yield self.read(self.head)
+                self.head_key = head_node.key()
             else:
-                # replace the left neighbor's right pointer with the HEAD ptr
-                left_neighbor.right = HEAD_PTR
-            self.nodes_w_in_pipe.put((left_ptr, left_neighbor))
-        else:
-            # TODO: insert pd
-        yield self.wait_clock()
-
+                self.head_key = None
+        self.profiler.end(prof)
+        if self.level == 0:
+            self.psl.rm_result_pipe.put(PSL_rm_result(first_node.rank, first_node.timestamp, first_node.meta_ptrs))
+
+
+class SkipList(HW_sim_object):
+    """Pipelined skip list: every level is a pipeline stage (PSL_level), so
+       a new entry can enter the top level every cycle while the entries
+       before it are searching or being inserted in the levels below.
+       The levels are kept balanced as a deterministic 1-2-3 skip list by
+       push up requests travelling back up the pipeline. Removals only
+       unlink the first node of each level, the removed nodes are returned
+       to their free list once every request that could still point to them
+       has completed.
+    """
+    def __init__(self, env, period, size, outreg_width, enq_fifo_depth, rd_latency, wr_latency, outreg_latency, outreg_impl='list', rng=None, profile=False, mem_impl='bram', search_prefetch=False):
+        super(SkipList, self).__init__(env, period)
+
+        self.env = env
+        self.period = period
+        self.outreg_width = outreg_width
+        self.outreg_latency = outreg_latency
+        self.enq_fifo_depth = enq_fifo_depth
+        # the pipelined skip list is deterministic and searches each level in
+        # its own stage, so rng and search_prefetch are not used
+
+        # Process communication pipes
+        self.enq_in_pipe = simpy.Store(env)
+        self.enq_out_pipe = simpy.Store(env)
+        self.deq_in_pipe = simpy.Store(env)
+        self.deq_out_pipe = simpy.Store(env)
+        self.outreg_ins_in_pipe = simpy.Store(env)
+        self.outreg_ins_out_pipe = simpy.Store(env)
+        self.outreg_rem_in_pipe = simpy.Store(env)
+        self.outreg_rem_out_pipe = simpy.Store(env)
+        self.rm_result_pipe = simpy.Store(env)
+
+        # Profiler attributing node memory accesses and cycles to each operation
+        self.profiler = Op_profiler(env, profile)
+        # One pipeline stage per level
+        self.num_levels = max(1, int(math.log(size, 2)))
+        self.levels = []
+        for i in range(self.num_levels):
+            self.levels.append(PSL_level(env, period, self, i, size, rd_latency, wr_latency, mem_impl))
+        # Output register on dequeue side
+        self.outreg = OUT_REG_IMPLS[outreg_impl](self.env, period, self.outreg_ins_in_pipe, self.outreg_ins_out_pipe, self.outreg_rem_in_pipe, self.outreg_rem_out_pipe, outreg_width, outreg_latency)
+        # FIFO for enqueing into the skip list
+        self.enq_fifo = Fifo(enq_fifo_depth)
+
+        self.num_entries = 0
+        # id of the next request to enter the pipeline, also used as timestamp
+        self.next_id = 0
+        # ids of the requests whose search or push ups are in flight
+        self.active = set()
+        # req_id -> key of the entries not yet inserted into level 0
+        self.pending = {}
+        # (next_id when removed, level, ptr) of the removed nodes not yet freed
+        self.limbo = deque()
+
+        # Busy flag, set while an entry moves from level 0 to the out reg
+        self.busy = 0
+        self.enqueuing = False
+
+        # Lists to store time measurements
+        self.bg_search_nclks_list = []
+        self.bg_enq_nclks_list = []
+        self.bg_deq_nclks_list = []
+
+        # register processes for simulation
+        self.run(env)
+
+    def run(self, env):
+        self.env.process(self.enqueue())
+        self.env.process(self.dequeue())
+        self.enq_sl_proc = self.env.process(self.enq_sl())
+        self.deq_sl_proc = self.env.process(self.deq_sl())
 
+    def __str__(self):
+        outStr = ""
+        for level in reversed(self.levels):
+            outStr += "L{}: ".format(level.level)
+            ptr = level.head
+            while ptr is not None:
+                node = level.nodes.mem[ptr]
+                outStr += str(node.rank) + ("* " if node.towered else " ")
+                ptr = node.right
+            outStr += "\n"
+        return outStr
+
+    def inserted(self, pd_req, promoted):
+        """Called by level 0 once an entry has been inserted
+        """
+        del self.pending[pd_req.req_id]
+        self.bg_search_nclks_list.append(pd_req.t_insert - pd_req.t_start)
+        self.bg_enq_nclks_list.append(self.env.now - pd_req.t_insert)
+        if not promoted:
+            self.complete(pd_req)
+
+    def complete(self, req):
+        """Called once a request and all the push ups it caused are done
+        """
+        self.active.discard(req.req_id)
+        self.reclaim()
 
+    def kill(self, level, ptr):
+        """Called when a node is removed from a level
+        """
+        level.dead.add(ptr)
+        self.limbo.append((self.next_id, level, ptr))
+        self.reclaim()
 
-    def removal_sm(self):
+    def reclaim(self):
+        """Free the removed nodes once no request in flight can point to them
         """
-        Receives requests to dequeue pkts and metadata from storage
-        Reads:
-          - self.ptr_in_pipe
-        Writes:
-          - self.pkt_out_pipe
+        oldest = min(self.active) if len(self.active) > 0 else self.next_id
+        while len(self.limbo) > 0 and self.limbo[0][0] <= oldest:
+            (next_id, level, ptr) = self.limbo.popleft()
+            level.dead.discard(ptr)
+            level.free_node_list.push(ptr)
+
+    def deq_ready(self):
+        """The first node of level 0 can be moved to the out reg if no entry
+           still searching the levels above would be inserted in front of it
         """
-        while True:
-            # wait for a read request
-            (head_seg_ptr, meta_ptr) = yield self.ptr_in_pipe.get()
-
-            # read the metadata
-            self.metadata_r_in_pipe.put(meta_ptr) # send read request
-            tuser = yield self.metadata_r_out_pipe.get() # wait for response
-            self.free_meta_list.push(meta_ptr) # add meta_ptr to free list
-   
-            # read the packet
-            pkt_str = ''
-            cur_seg_ptr = head_seg_ptr
-            while (cur_seg_ptr is not None):
-                # send the read request
-                self.segments_r_in_pipe.put(cur_seg_ptr)
-                # wait for response
-                pkt_seg = yield self.segments_r_out_pipe.get()
-
-                pkt_str += pkt_seg.tdata
-                # add segment to free list
-                self.free_seg_list.push(cur_seg_ptr)
-                cur_seg_ptr = pkt_seg.next_seg
-    
-            # reconstruct the final scapy packet
-            pkt = Ether(pkt_str)
-            # Write the final pkt and metadata
-            self.pkt_out_pipe.put((pkt, tuser))
+        if self.levels[0].num_nodes == 0:
+            return False
+        return len(self.pending) == 0 or min(self.pending.values()) > self.levels[0].head_key
 
+    def enq_sl (self):
+        while True:
+            try:
+                yield self.env.timeout(self.period)
+                # Start at most one search per cycle, when the top level can accept it
+                top = self.levels[-1]
+                if self.enq_fifo.fill_level() > 0 and len(top.down_queue) == 0 and self.levels[0].can_allocate():
+                    (value, (hsp, mdp)) = self.enq_fifo.pop()
+                    req = PSL_push_down_req(self.next_id, value, self.next_id, [hsp, mdp], self.levels[0].free_node_list.pop(), self.env.now)
+                    self.active.add(req.req_id)
+                    self.pending[req.req_id] = req.key()
+                    self.next_id += 1
+                    top.put_down(req)
+            except simpy.Interrupt as i:
+                break
+
+    def enqueue (self):
+        while True:
+            # Wait for enqueue command
+            (value, hsp, mdp) = yield self.enq_in_pipe.get()
+            t1 = self.env.now
+            # Wait if out reg and enqueue FIFO are full, or an entry is moving from level 0 to the out reg
+            while (self.outreg.num_entries == self.outreg.width and self.enq_fifo.fill_level() == self.enq_fifo_depth) or self.outreg.busy == 1 or self.busy == 1:
+                yield self.env.timeout(self.period)
+            self.enqueuing = True
+            # Insert into output reg
+            self.outreg_ins_in_pipe.put((value, [hsp, mdp]))
+            (out_reg_val, out_reg_ptrs) = yield self.outreg_ins_out_pipe.get()
+            if out_reg_val != -1:
+                # out reg insert returned an entry (either same new entry or one that was evicted from out reg)
+                # push entry into enqueue FIFO
+                self.enq_fifo.push((out_reg_val, out_reg_ptrs))
+            self.enqueuing = False
+
+            enq_nclks = self.env.now - t1
+            self.enq_out_pipe.put((0, enq_nclks))
+            self.num_entries += 1
+
+    def deq_sl (self):
+        while True:
+            try:
+                # Wait one clock
+                yield self.env.timeout(self.period)
+                # If there's room in out reg and level 0 holds the smallest entry
+                if (self.outreg.num_entries < self.outreg.width) and self.deq_ready() and not self.enqueuing and self.outreg.busy == 0:
+                    t1 = self.env.now
+                    self.busy = 1
+                    self.levels[0].put_up(PSL_rm_req())
+                    dq = yield self.rm_result_pipe.get()
+
+                    # Send dequeued value to out reg
+                    self.outreg.ins_in_pipe.put((dq.rank, dq.meta_ptrs))
+                    (tmpVal, tmpPtrs) = yield self.outreg_ins_out_pipe.get()
+                    # tmpVal should be -1 because there was room available in out reg
+                    if tmpVal != -1:
+                        print ("Dequeue Error!: Received non-null value from out reg:", tmpVal, tmpPtrs)
+
+                    deq_nclks = self.env.now - t1
+                    self.bg_deq_nclks_list.append(deq_nclks)
+                    self.busy = 0
+
+            except simpy.Interrupt as i:
+                break
+
+    def dequeue (self):
+        while True:
+            # Wait for dequeue command
+            yield self.deq_in_pipe.get()
+            t1 = self.env.now
+            # Send remove request to out reg
+            self.outreg_rem_in_pipe.put(True)
+            (retVal, (retHsp, retMdp)) = yield self.outreg_rem_out_pipe.get()
+            self.num_entries -= 1
+            # Output deq result
+            deq_nclks = self.env.now - t1
+            self.deq_out_pipe.put((retVal, retHsp, retMdp, deq_nclks))
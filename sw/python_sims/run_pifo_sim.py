@@ -1,29 +1,51 @@
 #!/usr/bin/env python
 
+import os
+import multiprocessing
 from pifo_sim import Pifo_sim
 
+# number of worker processes used to run the points of each sweep
+NUM_PROCS = multiprocessing.cpu_count()
+# base seed of the sweeps (None for unseeded runs)
+SEED = 1
+# persistent cache of seeded simulation results, kept with the plots
+CACHE_DIR = os.path.join('out', 'sim_cache')
+
 def test_fill_level():
-    psim = Pifo_sim('out')
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
     levels = range(1, 200, 5)
     pkt_len = 64
     num_skipLists = 1
-    psim.test_fill_level(levels, pkt_len, num_skipLists)
+    sl_impls = ['prob', 'det', 'pipe']
+    psim.test_fill_level(levels, pkt_len, num_skipLists, sl_impls)
 
 def test_num_skipLists():
-    psim = Pifo_sim('out')
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
 #    level = 100
     level = None
     pkt_len = 64
     outreg_width = 16
     enq_fifo_depth = 16
-    sl_impls = ['det']
+    sl_impls = ['det', 'pipe']
     num_skipLists = range(1, 20, 1)
 #    num_skipLists = range(10, 12)
     outreg_latency = 1
     psim.test_num_skipLists(level, pkt_len, num_skipLists, outreg_width, enq_fifo_depth, sl_impls, outreg_latency)
 
+def test_shard_policy():
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
+    level = None
+    pkt_len = 64
+    outreg_width = 16
+    enq_fifo_depth = 16
+    sl_impl = 'det'
+    num_skipLists = [1, 2, 4, 8, 16, 32, 64]
+    # dequeue latency relative to min_entries
+    shard_policies = ['min_entries', 'round_robin', 'power_of_two', 'rank_range', 'adaptive_range']
+    psim.test_shard_policy(level, pkt_len, num_skipLists, outreg_width, enq_fifo_depth, sl_impl, shard_policies)
+
 def test_outreg_latency():
-    psim = Pifo_sim('out')
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
 #    level = 100
     level = None
     pkt_len = 64
@@ -35,38 +57,122 @@ def test_outreg_latency():
     psim.test_outreg_latency(level, pkt_len, num_skipLists, outreg_width, enq_fifo_depth, sl_impls, outreg_latencies)
 
 def test_pkt_len():
-    psim = Pifo_sim('out')
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
     level = 100
-    pkt_len = range(64, 1000, 100)
+    pkt_len = [64] + range(100, 1501, 100)
     num_skipLists = 5
-    psim.test_pkt_len(level, pkt_len, num_skipLists)
+    sl_impls = ['det']
+    # no scapy pkt is built or parsed per pkt
+    raw_pkts = True
+    psim.test_pkt_len(level, pkt_len, num_skipLists, sl_impls, raw_pkts)
 
 def test_mem_latency():
-    psim = Pifo_sim('out')
-    level = 10
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
+    level = None # do not use specific fill level, so searches traverse several nodes
     pkt_len = 64
     num_skipLists = 5
     mem_latencies = range(1,7)
-    psim.test_mem_latency(level, pkt_len, num_skipLists, mem_latencies)
+    sl_impls = ['det', 'prob']
+    # prefetching search reads overlap with a pipelined memory
+    mem_impl = 'dual_port'
+    search_prefetch = True
+    psim.test_mem_latency(level, pkt_len, num_skipLists, mem_latencies, sl_impls, mem_impl, search_prefetch)
 
 def test_outreg_width():
-    psim = Pifo_sim('out')
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
     level = None # do not use specific fill level 
     pkt_len = 64
     num_skipLists = 5
-    outreg_widths = range(1,16,1)
+    outreg_widths = [2**i for i in range(9)]
     enq_fifo_depth = 16
     sl_impls = ['det']
     outreg_latency = 1
-    psim.test_outreg_width(level, pkt_len, num_skipLists, outreg_widths, enq_fifo_depth, sl_impls)
+    # heap based out reg keeps the cost of wide registers logarithmic
+    outreg_impl = 'heap'
+    psim.test_outreg_width(level, pkt_len, num_skipLists, outreg_widths, enq_fifo_depth, sl_impls, outreg_impl)
+
+def test_outreg_impl():
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
+    level = None # do not use specific fill level
+    pkt_len = 64
+    num_skipLists = 5
+    # list costs O(width) per operation, heap O(log width)
+    outreg_widths = [16, 64, 256, 1024]
+    enq_fifo_depth = 16
+    sl_impl = 'prob'
+    outreg_impls = ['list', 'heap']
+    num_ops = 20000
+    psim.test_outreg_impl(level, pkt_len, num_skipLists, outreg_widths, enq_fifo_depth, sl_impl, outreg_impls, num_ops)
+
+def test_rank_bits():
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
+    level = None # do not use specific fill level
+    pkt_len = 64
+    num_skipLists = 1
+    # the rank fields of the hardware metadata are 16 bits wide
+    rank_bits = range(4, 17, 2)
+    outreg_width = 4
+    enq_fifo_depth = 4
+    sl_impls = ['det', 'pipe', 'bucket']
+    psim.test_rank_bits(level, pkt_len, num_skipLists, rank_bits, outreg_width, enq_fifo_depth, sl_impls)
+
+def test_op_profile():
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
+    level = None # do not use specific fill level
+    pkt_len = 64
+    num_skipLists = [1, 5, 10]
+    outreg_widths = range(1,16,2)
+    enq_fifo_depth = 16
+    sl_impl = 'det'
+    psim.test_op_profile(level, pkt_len, num_skipLists, outreg_widths, enq_fifo_depth, sl_impl)
+
+def test_tree_depth():
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
+    depths = range(1, 7)
+    fanout = 2
+    pkt_len = 64
+    rates = [10, 40, 100]
+    num_pkts = 200
+    node_impl = 'sl'
+    sl_impl = 'det'
+    # cycles to pass a child handle down to the next level
+    hop_latency = 1
+    psim.test_tree_depth(depths, fanout, pkt_len, rates, num_pkts, node_impl, sl_impl, hop_latency)
+
+def test_ingress_rate():
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
+    pkt_lens = [64, 1500]
+    ingress_depths = [1, 2, 4, 8, None]
+    num_pkts = 200
+    num_skipLists = 8
+    mem_impl = 'dual_port'
+    wr_latency = 4
+    psim.test_ingress_rate(pkt_lens, ingress_depths, num_pkts, num_skipLists, mem_impl, wr_latency)
+
+def test_egress_depth():
+    psim = Pifo_sim('out', NUM_PROCS, SEED, CACHE_DIR)
+    pkt_len = 1500
+    egress_depths = [None, 1, 2, 4, 8]
+    rd_latencies = [1, 2, 4, 8]
+    num_pkts = 100
+    num_skipLists = 4
+    mem_impl = 'dual_port'
+    psim.test_egress_depth(pkt_len, egress_depths, rd_latencies, num_pkts, num_skipLists, mem_impl)
 
 def main():
     #test_fill_level()
     #test_num_skipLists()
+    #test_shard_policy()
     #test_outreg_latency()
     #test_pkt_len()
     #test_mem_latency()
+    #test_rank_bits()
+    #test_op_profile()
+    #test_tree_depth()
+    #test_ingress_rate()
+    #test_egress_depth()
     test_outreg_width()
+    #test_outreg_impl()
 
 
 if __name__ == "__main__":
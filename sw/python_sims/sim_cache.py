@@ -0,0 +1,99 @@
+"""
+On-disk cache of Sim_results keyed by the simulation parameters and the
+simulator source code
+"""
+
+import os, glob, shutil, hashlib
+import numpy as np
+
+# default bound on the total size of the cache
+MAX_CACHE_BYTES = 1 << 30
+
+class Sim_cache(object):
+    def __init__(self, cache_dir, max_bytes=MAX_CACHE_BYTES, src_dir=None):
+        """cache_dir - directory holding one sub-directory per cached point
+           max_bytes - the least recently used points are evicted once the cache grows beyond this size
+           src_dir - directory of the simulator sources, any change to them invalidates all entries
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if src_dir is None:
+            src_dir = os.path.dirname(os.path.abspath(__file__))
+        self.src_hash = self.hash_sources(src_dir)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def hash_sources(src_dir):
+        """Hash all simulator modules (testbench scripts excluded)
+        """
+        h = hashlib.sha1()
+        for filename in sorted(glob.glob(os.path.join(src_dir, '*.py'))):
+            name = os.path.basename(filename)
+            if name.startswith('test_') or name.startswith('run_'):
+                continue
+            h.update(name.encode())
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+
+    def key(self, params):
+        h = hashlib.sha1(self.src_hash.encode())
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def entry_dir(self, params):
+        return os.path.join(self.cache_dir, self.key(params))
+
+    def get(self, params):
+        """Returns the dict of arrays stored for params, or None on a miss
+        """
+        path = self.entry_dir(params)
+        if not os.path.exists(path):
+            return None
+        try:
+            arrays = {}
+            for filename in os.listdir(path):
+                if filename.endswith('.npy'):
+                    arrays[filename[:-len('.npy')]] = np.load(os.path.join(path, filename))
+        except (IOError, ValueError):
+            # partially written or corrupt entry
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        # mark the entry as recently used
+        os.utime(path, None)
+        return arrays
+
+    def put(self, params, arrays):
+        """Store a dict of named arrays (e.g. the raw latency samples) for params
+        """
+        path = self.entry_dir(params)
+        tmp_path = path + '.tmp{}'.format(os.getpid())
+        if not os.path.exists(tmp_path):
+            os.makedirs(tmp_path)
+        for (name, data) in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), data)
+        with open(os.path.join(tmp_path, 'params.txt'), 'w') as f:
+            f.write(repr(sorted(params.items())) + '\n')
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(path) or '.tmp' in name:
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+            total += size
+        for (mtime, size, path) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,138 @@
+"""
+Fixed memory statistics over a stream of latency samples
+"""
+
+from __future__ import division
+import math
+import numpy as np
+
+# quantiles tracked by default: p50, p99, p99.9
+QUANTILES = (0.5, 0.99, 0.999)
+
+class P2_quantile(object):
+    """Estimates a single quantile with the P-square algorithm (Jain & Chlamtac),
+       which keeps 5 markers no matter how many samples are added
+    """
+    def __init__(self, p):
+        self.p = p
+        # marker heights, positions and desired positions
+        self.q = []
+        self.n = [1, 2, 3, 4, 5]
+        self.np = [1, 1 + 2*p, 1 + 4*p, 3 + 2*p, 5]
+        self.dn = [0, p/2, p, (1 + p)/2, 1]
+
+    def add(self, x):
+        q = self.q
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        # find the cell containing x and adjust the extreme markers
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k+1]:
+                k += 1
+        n = self.n
+        for i in range(k+1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+        # adjust the heights of the middle markers
+        for i in range(1, 4):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i+1] - n[i] > 1) or (d <= -1 and n[i-1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d/(n[i+1] - n[i-1])*((n[i] - n[i-1] + d)*(q[i+1] - q[i])/(n[i+1] - n[i]) +
+                                                 (n[i+1] - n[i] - d)*(q[i] - q[i-1])/(n[i] - n[i-1]))
+                if not (q[i-1] < qp < q[i+1]):
+                    # parabolic prediction out of order, fall back to linear
+                    qp = q[i] + d*(q[i+d] - q[i])/(n[i+d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        if len(self.q) == 0:
+            return float('nan')
+        if self.n[4] <= 5:
+            # the markers only hold the samples so far, use the exact quantile
+            return float(np.percentile(self.q, 100*self.p))
+        return self.q[2]
+
+    def state(self):
+        return list(self.q) + (5 - len(self.q))*[0] + [len(self.q)] + self.n + self.np
+
+    def set_state(self, state):
+        num_q = int(state[5])
+        self.q = list(state[0:num_q])
+        self.n = [int(v) for v in state[6:11]]
+        self.np = list(state[11:16])
+
+
+class Stream_stats(object):
+    """Streaming accumulator of count, mean, variance, min, max and a fixed
+       set of quantiles (P-square estimates) for latency samples
+    """
+    def __init__(self, quantiles=QUANTILES):
+        self.quantiles = quantiles
+        self.count = 0
+        self.mean = 0.0
+        # sum of squared differences from the mean (Welford)
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.estimators = [P2_quantile(p) for p in quantiles]
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(x - self.mean)
+        if self.max is None or x > self.max:
+            self.max = x
+        if self.min is None or x < self.min:
+            self.min = x
+        for e in self.estimators:
+            e.add(x)
+
+    def variance(self):
+        return self.m2/self.count if self.count > 0 else float('nan')
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def quantile(self, p):
+        return self.estimators[self.quantiles.index(p)].value()
+
+    def state(self):
+        """Flatten the accumulator into a float array (e.g. to save it with np.save)
+        """
+        state = [self.count, self.mean, self.m2,
+                 self.min if self.min is not None else float('nan'),
+                 self.max if self.max is not None else float('nan')] + list(self.quantiles)
+        for e in self.estimators:
+            state += e.state()
+        return np.array(state, dtype=float)
+
+    @staticmethod
+    def from_state(state, num_quantiles=len(QUANTILES)):
+        stats = Stream_stats(tuple(state[5:5+num_quantiles]))
+        stats.count = int(state[0])
+        stats.mean = state[1]
+        stats.m2 = state[2]
+        if stats.count > 0:
+            stats.min = state[3]
+            stats.max = state[4]
+        for (i, e) in enumerate(stats.estimators):
+            start = 5 + num_quantiles + 16*i
+            e.set_state(state[start:start+16])
+        return stats
+
+    def __str__(self):
+        return 'count: {}, mean: {:.2f}, std: {:.2f}, max: {}, {}'.format(self.count, self.mean, self.std(), self.max,
+               ', '.join('p{:g}: {:.2f}'.format(100*p, self.quantile(p)) for p in self.quantiles))
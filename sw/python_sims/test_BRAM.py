@@ -1,11 +1,16 @@
 #!/usr/bin/env python
 
+import sys, random
 import simpy
-from hwsim_utils import HW_sim_object, BRAM
+from hwsim_utils import HW_sim_object, BRAM, MEM_IMPLS, SL_NODE_FIELDS
+from det_skip_list_simpy import NEG_INF, POS_INF
 
 """
 Testbench for the BRAM object
 """
+
+SEED = 1
+NODES_DEPTH = 64
 class BRAM_tb(HW_sim_object):
     def __init__(self, env, period):
         super(BRAM_tb, self).__init__(env, period)
@@ -47,6 +52,64 @@ class BRAM_tb(HW_sim_object):
             item = yield self.bram_r_out_pipe.get()
             print '@ {:04d} - received item {} from address {}'.format(self.env.now, item, addr)
 
+class Node_BRAM_tb(HW_sim_object):
+    """Writes skip list node entries to a memory then reads every address back
+    """
+    def __init__(self, env, period, mem_impl, fields, writes):
+        super(Node_BRAM_tb, self).__init__(env, period)
+        self.r_in_pipe = simpy.Store(env)
+        self.r_out_pipe = simpy.Store(env)
+        self.w_in_pipe = simpy.Store(env)
+        self.w_out_pipe = simpy.Store(env)
+        self.nodes = MEM_IMPLS[mem_impl](env, period, self.r_in_pipe, self.r_out_pipe, self.w_in_pipe, self.w_out_pipe,
+                                         depth=NODES_DEPTH, write_latency=2, read_latency=2, fields=fields)
+        self.writes = writes
+        self.entries = []
+        self.env.process(self.rw_nodes_sm())
+
+    def rw_nodes_sm(self):
+        for (addr, node) in self.writes:
+            self.w_in_pipe.put((addr, node))
+            yield self.w_out_pipe.get()
+        for addr in range(NODES_DEPTH):
+            self.r_in_pipe.put(addr)
+            node = yield self.r_out_pipe.get()
+            self.entries.append(node)
+
+def node_writes(rng):
+    """Node entries as written by the skip lists: head and tail nodes, linked
+       nodes, freed nodes (all -1), nodes with None fields and overwrites
+    """
+    (h, t) = (0, 1)
+    writes = [(h, [POS_INF, -1, -1, 0, t, -1, -1, -1]), (t, [NEG_INF, -1, -1, 0, -1, h, -1, -1])]
+    for i in range(100):
+        addr = rng.randint(2, NODES_DEPTH - 1)
+        node = [rng.randint(0, 2**16-1), rng.randint(0, 2**10), rng.randint(0, 2**10), rng.randint(0, 3)] + \
+               [rng.choice([-1, rng.randint(0, NODES_DEPTH - 1)]) for f in range(4)]
+        if i % 10 == 0:
+            node = 8*[-1]
+        elif i % 10 == 5:
+            node[rng.randint(0, 7)] = None
+        writes.append((addr, node))
+    return writes
+
+def check_node_fields():
+    """Nodes written to a memory with the SL_NODE_FIELDS layout must read back
+       as written, unwritten entries read back as all -1
+    """
+    writes = node_writes(random.Random(SEED))
+    expected = NODES_DEPTH*[8*[-1]]
+    for (addr, node) in writes:
+        expected[addr] = list(node)
+    passed = True
+    for mem_impl in sorted(MEM_IMPLS.keys()):
+        env = simpy.Environment()
+        tb = Node_BRAM_tb(env, 1, mem_impl, SL_NODE_FIELDS, writes)
+        env.run(until=10*(len(writes) + NODES_DEPTH))
+        match = tb.entries == expected
+        print '{}: {} node writes with fields=SL_NODE_FIELDS : {}'.format(mem_impl, len(writes), 'PASS' if match else 'FAIL')
+        passed &= match
+    return passed
 
 def main():
     # create the simulation environment
@@ -57,6 +120,9 @@ def main():
     # run the simulation for 100 simulation seconds (100 clock cycles)
     env.run(until=100)
 
+    if not check_node_fields():
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
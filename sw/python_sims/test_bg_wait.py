@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import sys, time
+import numpy as np
+from pifo_sim import Pifo_sim
+
+"""
+Regression test for the event-driven background processes of the skip
+lists and the idle waits of the testbench: the enq/deq latency traces must
+be identical to those produced when enq_sl, deq_sl and the packet
+generator/receiver check their state every cycle
+"""
+
+SEED = 1
+
+# (fill_level, num_skipLists, outreg_width, mem_latency, outreg_latency, sl_impl, fast_clock)
+CONFIGS = [(None, 5, 16, 1, 1, 'prob', False),
+           (20, 3, 4, 2, 1, 'prob', True),
+           (10, 2, 8, 1, 2, 'prob', False),
+           (None, 2, 4, 1, 1, 'det', False),
+           (20, 3, 4, 2, 3, 'det', True),
+           (100, 19, 16, 1, 1, 'det', False)]
+
+def run(psim, config, poll_bg):
+    (level, num_sl, width, mem_lat, outreg_lat, impl, fast_clock) = config
+    t = time.time()
+    res = psim.run_sim(level, 64, num_sl, outreg_width=width, enq_fifo_depth=width, rd_latency=mem_lat, wr_latency=mem_lat,
+                       sl_impl=impl, outreg_latency=outreg_lat, fast_clock=fast_clock, seed=SEED, poll_bg=poll_bg)
+    return (res, time.time() - t)
+
+def main():
+    psim = Pifo_sim('out')
+    failed = False
+    for config in CONFIGS:
+        (poll_res, poll_time) = run(psim, config, True)
+        (event_res, event_time) = run(psim, config, False)
+        match = np.array_equal(poll_res.enq_data, event_res.enq_data) and np.array_equal(poll_res.deq_data, event_res.deq_data)
+        print 'config = {}, enq_avg = {}/{}, deq_avg = {}/{}, time = {:.2f}/{:.2f} s : {}'.format(config, poll_res.enq_avg, event_res.enq_avg,
+                                                                                                 poll_res.deq_avg, event_res.deq_avg,
+                                                                                                 poll_time, event_time, 'PASS' if match else 'FAIL')
+        failed |= not match
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
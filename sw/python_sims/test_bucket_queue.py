@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import sys, random
+import simpy
+from bucket_queue import Bucket_queue
+from pifo_wrapper import PifoModel
+
+"""
+Testbench for the bucket queue: checks the dequeue order against the
+reference PifoModel, that every node is returned to the free list and the
+cycles taken by the bitmap scan
+"""
+
+PERIOD = 1
+OUTREG_WIDTH = 4
+SIZE = 512
+NUM_OPS = 300
+
+# (rank_bits, rank_shift, bitmap_width, mem_latency, mem_impl)
+CONFIGS = [(16, 0, 64, 1, 'bram'),
+           (8, 0, 4, 2, 'dual_port'),
+           (16, 4, 16, 1, 'banked')]
+
+def drive(env, bq, ops, dequeued):
+    """ops is a list of ranks to enqueue and None for dequeues
+    """
+    for (i, op) in enumerate(ops):
+        if op is None:
+            while bq.outreg.next_valid == 0:
+                yield env.timeout(PERIOD)
+            bq.deq_in_pipe.put(True)
+            (val, hsp, mdp, deq_nclks) = yield bq.deq_out_pipe.get()
+            dequeued.append((val, hsp))
+        else:
+            bq.enq_in_pipe.put((op, i, i))
+            yield bq.enq_out_pipe.get()
+    # Drain the bucket queue
+    while bq.num_entries > 0:
+        while bq.outreg.next_valid == 0:
+            yield env.timeout(PERIOD)
+        bq.deq_in_pipe.put(True)
+        (val, hsp, mdp, deq_nclks) = yield bq.deq_out_pipe.get()
+        dequeued.append((val, hsp))
+    yield env.timeout(10*PERIOD)
+    bq.enq_sl_proc.interrupt('Done')
+    bq.deq_sl_proc.interrupt('Done')
+
+def run(config, ops):
+    (rank_bits, rank_shift, bitmap_width, mem_lat, mem_impl) = config
+    env = simpy.Environment()
+    bq = Bucket_queue(env, PERIOD, SIZE, OUTREG_WIDTH, NUM_OPS, mem_lat, mem_lat, 1, mem_impl=mem_impl, profile=True,
+                      rank_bits=rank_bits, rank_shift=rank_shift, bitmap_width=bitmap_width)
+    dequeued = []
+    env.process(drive(env, bq, ops, dequeued))
+    env.run()
+    return (bq, dequeued)
+
+def check_order(config, rng):
+    """Enqueue everything, then dequeue everything. Without quantization the
+       ranks must come out in the order of the model (the out reg does not keep
+       equal ranks in FIFO order), with quantized ranks the buckets must.
+    """
+    (rank_bits, rank_shift) = config[:2]
+    ranks = [rng.randint(0, 2**rank_bits-1) for i in range(min(NUM_OPS, SIZE))]
+    (bq, dequeued) = run(config, ranks)
+    if rank_shift == 0:
+        model = PifoModel()
+        for (i, rank) in enumerate(ranks):
+            model.enqueue(rank, i, i)
+        expected = [model.dequeue()[0] for i in range(len(ranks))]
+        if [val for (val, hsp) in dequeued] != expected:
+            print 'ERROR: dequeued {}, expected {}'.format([val for (val, hsp) in dequeued], expected)
+            return False
+    else:
+        buckets = [val >> rank_shift for (val, hsp) in dequeued]
+        if buckets != sorted(buckets) or sorted(hsp for (val, hsp) in dequeued) != range(len(ranks)):
+            print 'ERROR: dequeued buckets {}'.format(buckets)
+            return False
+    return check_free(bq)
+
+def check_interleaved(config, rng):
+    """Interleave enqueues and dequeues: every entry must come out exactly once
+    """
+    ops = []
+    num_entries = 0
+    for i in range(NUM_OPS):
+        if num_entries > 0 and rng.random() < 0.4:
+            ops.append(None)
+            num_entries -= 1
+        else:
+            ops.append(rng.randint(0, 2**config[0]-1))
+            num_entries += 1
+    (bq, dequeued) = run(config, ops)
+    if sorted(hsp for (val, hsp) in dequeued) != [i for (i, op) in enumerate(ops) if op is not None]:
+        print 'ERROR: dequeued entries {}'.format(sorted(hsp for (val, hsp) in dequeued))
+        return False
+    if any(ops[hsp] != val for (val, hsp) in dequeued):
+        print 'ERROR: dequeued ranks do not match the enqueued ones'
+        return False
+    return check_free(bq)
+
+def check_free(bq):
+    if bq.free_node_list.fill_level() != SIZE or bq.num_stored != 0 or bq.top != 0:
+        print 'ERROR: {} free nodes, {} entries stored, top bitmap word {}'.format(bq.free_node_list.fill_level(), bq.num_stored, bq.top)
+        return False
+    if any(any(bitmap.mem) for bitmap in bq.bitmaps) or any(b is not None for b in bq.buckets.mem):
+        print 'ERROR: bitmap or buckets not cleared'
+        return False
+    return True
+
+def check_scan(config, expected):
+    """Every scan takes the same number of cycles, whatever the ranks
+    """
+    # entries beyond the out reg width are moved from the buckets by scans
+    ranks = [0, 2**config[0]-1, 2**(config[0]-1), 1]
+    (bq, dequeued) = run(config, OUTREG_WIDTH*[2**config[0]-1] + ranks + [None, None] + ranks)
+    cycles = set(s[2] for s in bq.profiler.samples['scan'])
+    return (cycles == set([bq.scan_cycles()]) and bq.scan_cycles() == expected, sorted(cycles))
+
+def main():
+    rng = random.Random(1)
+    passed = True
+    for config in CONFIGS:
+        match = check_order(config, rng)
+        print 'order: config = {} : {}'.format(config, 'PASS' if match else 'FAIL')
+        passed &= match
+        match = check_interleaved(config, rng)
+        print 'interleaved: config = {} : {}'.format(config, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    # 16 bit ranks in 64 bit words: 1024 and 16 word levels below the top register
+    # 8 bit ranks in 4 bit words: 64, 16 and 4 word levels
+    # 12 bit buckets in 16 bit words: 256 and 16 word levels
+    for (config, expected) in zip(CONFIGS, [3 + 2*1, 4 + 3*2, 3 + 2*1]):
+        (match, cycles) = check_scan(config, expected)
+        print 'scan cycles: config = {}, cycles = {} : {}'.format(config, cycles, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
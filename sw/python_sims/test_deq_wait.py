@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+import pifo_top
+from pifo_wrapper import SkipListWrapper
+from pifo_sim import simulate
+
+"""
+Regression test for the event driven dequeue of SkipListWrapper with the
+default min_entries policy: with the same seed as the original wrapper, which
+polled the skip lists every period, the enqueue latencies and the results at
+a steady fill level must be unchanged and unconstrained runs must not dequeue
+later on average
+"""
+
+SEED = 7
+NUM_SAMPLES = 200
+
+# (fill_level, num_skipLists, outreg_width)
+CONFIGS = [(None, 1, 1), (None, 4, 4), (None, 8, 2), (20, 4, 16), (50, 16, 4)]
+
+class Polling_wrapper(SkipListWrapper):
+    """SkipListWrapper with the original dequeue: wait on each skip list in
+       turn until its head is valid, checking on period boundaries
+    """
+    def dequeue(self):
+        while True:
+            deq_req = yield self.deq_in_pipe.get()
+            if self.num_entries > 0:
+                self.num_entries -= 1
+                self.notify()
+            else:
+                print "ERROR: Dequeue from empty PIFO!"
+                continue
+
+            t1 = self.env.now
+            sel_sl = None
+            while sel_sl is None:
+                for i in range(self.num_sl):
+                    while self.sl[i].num_entries > 0 and self.sl[i].outreg.next_valid == 0:
+                        yield self.env.timeout(self.period)
+                    if self.sl[i].outreg.next_valid == 1 and (sel_sl is None or self.sl[i].outreg.next < min_value):
+                        sel_sl = i
+                        min_value = self.sl[i].outreg.next
+                if sel_sl is None:
+                    yield self.env.timeout(self.period)
+            self.add_entries(sel_sl, -1)
+            self.sl[sel_sl].deq_in_pipe.put(deq_req)
+            (deq_val, deq_hsp, deq_mdp, deq_nclks) = yield self.sl[sel_sl].deq_out_pipe.get()
+            self.deq_out_pipe.put((deq_val, deq_hsp, deq_mdp, self.env.now - t1))
+
+def run(config, wrapper):
+    (level, num_sl, width) = config
+    pifo_top.SkipListWrapper = wrapper
+    try:
+        return simulate(level, 64, num_sl, num_samples=NUM_SAMPLES, outreg_width=width, enq_fifo_depth=width, sl_impl='prob', seed=SEED)
+    finally:
+        pifo_top.SkipListWrapper = SkipListWrapper
+
+def main():
+    passed = True
+    for config in CONFIGS:
+        poll_res = run(config, Polling_wrapper)
+        event_res = run(config, SkipListWrapper)
+        match = np.array_equal(poll_res.enq_data, event_res.enq_data)
+        if config[0] is not None:
+            match &= np.array_equal(poll_res.deq_data, event_res.deq_data)
+        else:
+            match &= event_res.deq_avg <= poll_res.deq_avg
+        print 'config = {}, deq_avg = {}/{} : {}'.format(config, poll_res.deq_avg, event_res.deq_avg, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
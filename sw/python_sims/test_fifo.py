@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import sys
+from StringIO import StringIO
+import simpy
+from hwsim_utils import HW_sim_object, Fifo, FIFO
+from pifo_sim import simulate, Sim_results
+
+"""
+Testbench for the FIFO occupancy watermarks and error behaviour: pushing to a
+full FIFO and popping from an empty one must report an error and leave the
+FIFO unchanged, and the free list watermarks of the skip lists and Pkt_storage
+must be reported in Sim_results
+"""
+
+MAXSIZE = 4
+SEED = 1
+FILL_LEVEL = 20
+
+def errors_of(func, *args):
+    """Call func and return its result and the error lines it printed to stderr
+    """
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        result = func(*args)
+        errors = sys.stderr.getvalue().splitlines()
+    finally:
+        sys.stderr = stderr
+    return (result, errors)
+
+def check_fifo():
+    fifo = Fifo(MAXSIZE)
+    for i in range(MAXSIZE):
+        fifo.push(i)
+    (res, errors) = errors_of(fifo.push, MAXSIZE)
+    if len(errors) != 1 or list(fifo.items) != range(MAXSIZE) or fifo.high_watermark != MAXSIZE:
+        print 'ERROR: push to a full Fifo: errors = {}, items = {}'.format(errors, fifo)
+        return False
+    # restart the statistics from a full Fifo, as done for the free lists
+    fifo.reset_watermarks()
+    fifo.pop()
+    fifo.pop()
+    fifo.push(MAXSIZE)
+    if (fifo.high_watermark, fifo.low_watermark) != (MAXSIZE, MAXSIZE - 2):
+        print 'ERROR: Fifo watermarks = {}'.format((fifo.high_watermark, fifo.low_watermark))
+        return False
+    for i in range(MAXSIZE - 1):
+        fifo.pop()
+    (item, errors) = errors_of(fifo.pop)
+    if item is not None or len(errors) != 1 or fifo.fill_level() != 0 or fifo.low_watermark != 0:
+        print 'ERROR: pop from an empty Fifo: item = {}, errors = {}'.format(item, errors)
+        return False
+    return True
+
+class FIFO_tb(HW_sim_object):
+    """Pushes MAXSIZE items to a FIFO already holding one item, then pops MAXSIZE + 1
+    """
+    def __init__(self, env, period):
+        super(FIFO_tb, self).__init__(env, period)
+        self.r_in_pipe = simpy.Store(env)
+        self.r_out_pipe = simpy.Store(env)
+        self.w_in_pipe = simpy.Store(env)
+        self.w_out_pipe = simpy.Store(env)
+        self.fifo = FIFO(env, period, self.r_in_pipe, self.r_out_pipe, self.w_in_pipe, self.w_out_pipe, maxsize=MAXSIZE, init_items=['init'])
+        self.popped = []
+        self.watermarks = []
+        self.env.process(self.rw_sm())
+
+    def rw_sm(self):
+        for i in range(MAXSIZE):
+            self.w_in_pipe.put(i)
+            yield self.w_out_pipe.get()
+        self.watermarks.append((self.fifo.high_watermark, self.fifo.low_watermark))
+        for i in range(MAXSIZE + 1):
+            self.r_in_pipe.put(1)
+            data = yield self.r_out_pipe.get()
+            self.popped.append(data)
+        self.watermarks.append((self.fifo.high_watermark, self.fifo.low_watermark))
+
+def check_FIFO():
+    env = simpy.Environment()
+    tb = FIFO_tb(env, 1)
+    (res, errors) = errors_of(env.run, 100)
+    # the last push finds the FIFO full and the last pop finds it empty
+    expected = ['init'] + range(MAXSIZE - 1) + [None]
+    if tb.popped != expected or len(errors) != 2:
+        print 'ERROR: FIFO popped = {}, errors = {}'.format(tb.popped, errors)
+        return False
+    if tb.watermarks != [(MAXSIZE, 1), (MAXSIZE, 0)]:
+        print 'ERROR: FIFO watermarks = {}'.format(tb.watermarks)
+        return False
+    return True
+
+def check_free_lists(sl_impl):
+    """The free lists start full and hold at least one entry per pkt in the PIFO
+    """
+    sim_res = simulate(FILL_LEVEL, 64, 1, num_samples=20, sl_impl=sl_impl, seed=SEED, fast_clock=True)
+    free_lists = sim_res.free_lists
+    if sorted(free_lists.keys()) != ['pkt_metadata', 'pkt_segments', 'sl_nodes_0']:
+        print 'ERROR: free lists {}'.format(sorted(free_lists.keys()))
+        return False
+    if any(high != size for (size, high, low) in free_lists.values()):
+        print 'ERROR: free lists not full after init:\n{}'.format(sim_res.free_list_report())
+        return False
+    if any(sim_res.free_list_used(name) < FILL_LEVEL for name in free_lists):
+        print 'ERROR: free lists used less than the fill level:\n{}'.format(sim_res.free_list_report())
+        return False
+    restored = Sim_results.from_arrays(sim_res.arrays())
+    if restored.free_list_report() != sim_res.free_list_report():
+        print 'ERROR: free lists changed after from_arrays()'
+        return False
+    return True
+
+def main():
+    passed = True
+    for (name, check) in [('Fifo', check_fifo), ('FIFO', check_FIFO)]:
+        match = check()
+        print '{} watermarks and full/empty errors : {}'.format(name, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    match = check_free_lists('prob')
+    print 'free list watermarks in Sim_results : {}'.format('PASS' if match else 'FAIL')
+    passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
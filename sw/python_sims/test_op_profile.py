@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+import simpy
+from pifo_tb import Pifo_tb
+from pifo_sim import simulate
+
+"""
+Regression test for the skip list op profiler: profiling must not change the
+enq/deq latency traces, and every node memory access must be attributed to
+exactly one operation
+"""
+
+SEED = 1
+NUM_SAMPLES = 300
+
+# (fill_level, num_skipLists, outreg_width, mem_latency, sl_impl)
+CONFIGS = [(50, 2, 2, 1, 'prob'),
+           (20, 3, 4, 2, 'prob'),
+           (50, 2, 2, 1, 'det'),
+           (20, 3, 4, 2, 'det')]
+
+def check_traces(config):
+    (level, num_sl, width, mem_lat, impl) = config
+    res = [simulate(level, 64, num_sl, NUM_SAMPLES, outreg_width=width, enq_fifo_depth=width, rd_latency=mem_lat, wr_latency=mem_lat,
+                    sl_impl=impl, seed=SEED, profile=profile) for profile in [False, True]]
+    return np.array_equal(res[0].enq_data, res[1].enq_data) and np.array_equal(res[0].deq_data, res[1].deq_data)
+
+def check_accesses(config):
+    (level, num_sl, width, mem_lat, impl) = config
+    env = simpy.Environment()
+    tb = Pifo_tb(env, 1, 1, level, 64, num_sl, NUM_SAMPLES, width, width, mem_lat, mem_lat, impl, seed=SEED, profile=True)
+    env.run()
+    for sl in tb.pifo.skip_list_wrapper.sl:
+        prof = sl.profiler
+        reads = sum(s[0] for samples in prof.samples.values() for s in samples)
+        writes = sum(s[1] for samples in prof.samples.values() for s in samples)
+        if (reads, writes) != (sl.nodes.rd_count, sl.nodes.wr_count) or len(prof.stack) > 0:
+            print 'ERROR: profiled {}/{} reads/writes, BRAM counted {}/{}'.format(reads, writes, sl.nodes.rd_count, sl.nodes.wr_count)
+            return False
+    print tb.pifo.skip_list_wrapper.sl[0].profiler
+    return True
+
+def main():
+    failed = False
+    for config in CONFIGS:
+        match = check_traces(config) and check_accesses(config)
+        print 'config = {} : {}'.format(config, 'PASS' if match else 'FAIL')
+        failed |= not match
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
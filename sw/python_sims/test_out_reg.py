@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+import sys, random
+import simpy
+from hwsim_utils import HW_sim_object, out_reg, heap_out_reg
+
+"""
+Testbench that drives an out_reg and a heap_out_reg with the same random
+sequence of inserts and removes and checks that they behave identically
+"""
+
+NUM_OPS = 5000
+MAX_VAL = 16
+
+class Out_reg_tb(HW_sim_object):
+    def __init__(self, env, period, width, latency):
+        super(Out_reg_tb, self).__init__(env, period)
+        self.regs = []
+        for impl in [out_reg, heap_out_reg]:
+            pipes = [simpy.Store(env) for i in range(4)]
+            self.regs.append(impl(env, period, pipes[0], pipes[1], pipes[2], pipes[3], width, latency))
+        self.errors = 0
+        self.run()
+
+    def run(self):
+        self.env.process(self.rw_reg_sm())
+
+    def check(self, op, results):
+        (ref, dut) = (self.regs[0], self.regs[1])
+        if results[0] != results[1] or (ref.next_valid, ref.num_entries) != (dut.next_valid, dut.num_entries) \
+           or (ref.next_valid and ref.next != dut.next):
+            print '@ {} - {}: mismatch: {} != {}'.format(self.env.now, op, results[0], results[1])
+            self.errors += 1
+
+    def rw_reg_sm(self):
+        pkt_id = 0
+        for i in range(NUM_OPS):
+            if self.regs[0].num_entries > 0 and random.random() < 0.45:
+                for reg in self.regs:
+                    reg.rem_in_pipe.put(True)
+                results = []
+                for reg in self.regs:
+                    res = yield reg.rem_out_pipe.get()
+                    results.append(res)
+                self.check('remove', results)
+            else:
+                val = random.randint(0, MAX_VAL)
+                for reg in self.regs:
+                    reg.ins_in_pipe.put((val, [pkt_id, pkt_id]))
+                pkt_id += 1
+                results = []
+                for reg in self.regs:
+                    res = yield reg.ins_out_pipe.get()
+                    results.append(res)
+                self.check('insert', results)
+
+
+def main():
+    errors = 0
+    for (width, latency) in [(1, 1), (4, 1), (16, 2), (256, 1)]:
+        env = simpy.Environment()
+        tb = Out_reg_tb(env, 1, width, latency)
+        env.run()
+        print 'width = {}, latency = {}: {} errors'.format(width, latency, tb.errors)
+        errors += tb.errors
+    if errors > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
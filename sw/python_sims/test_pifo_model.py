@@ -0,0 +1,169 @@
+from __future__ import print_function
+import sys
+import simpy
+import random
+import time
+import numpy as np
+from pifo_wrapper import SkipListWrapper, PifoModel
+
+"""
+Checks the dequeue order of the reference PifoModel against the skip list
+wrapper, checks the batch API against single entry operations and measures
+the throughput of the model
+"""
+
+NUM_SKIP_LISTS = 4
+PERIOD = 1
+MAX_NODES = 512
+OUTREG_WIDTH = 8
+ENQ_FIFO_DEPTH = 8
+MAX_RANK = 64
+NumOps = 256
+NumModelOps = 10**6
+NumAltOps = 10**4
+
+def test_order(env, model, ranks, errors):
+    slw = SkipListWrapper(env, simpy.Store(env), simpy.Store(env), simpy.Store(env), simpy.Store(env), num_sl=NUM_SKIP_LISTS, period=PERIOD, size=MAX_NODES,
+                          outreg_width=OUTREG_WIDTH, enq_fifo_depth=ENQ_FIFO_DEPTH, rd_latency=1, wr_latency=1, sl_impl='prob', outreg_latency=1)
+    for sl in slw.sl:
+        while sl.busy == 1:
+            yield env.timeout(PERIOD)
+
+    for (i, rank) in enumerate(ranks):
+        slw.enq_in_pipe.put((rank, i, i))
+        yield slw.enq_out_pipe.get()
+        model.enqueue(rank, i, i)
+
+    for sl in slw.sl:
+        while sl.enq_fifo.fill_level() != 0 or sl.busy == 1:
+            yield env.timeout(PERIOD)
+
+    while slw.num_entries > 0:
+        slw.deq_in_pipe.put(True)
+        (val, hsp, mdp, deq_nclks) = yield slw.deq_out_pipe.get()
+        (model_val, model_hsp, model_mdp) = model.dequeue()
+        if val != model_val:
+            print ('ERROR: skip list wrapper dequeued rank {} (hsp {}), model dequeued rank {} (hsp {})'.format(val, hsp, model_val, model_hsp))
+            errors.append(val)
+
+    for sl in slw.sl:
+        while sl.busy == 1:
+            yield env.timeout(PERIOD)
+        sl.enq_sl_proc.interrupt('Done')
+        sl.deq_sl_proc.interrupt('Done')
+
+def test_fifo_order():
+    model = PifoModel()
+    for i in range(100):
+        model.enqueue(i % 4, i, i)
+    hsps = [model.dequeue()[1] for i in range(100)]
+    return hsps == sorted(hsps, key=lambda hsp: (hsp % 4, hsp))
+
+def test_throughput():
+    model = PifoModel()
+    ranks = [random.randint(0, MAX_RANK) for i in range(NumModelOps)]
+    t1 = time.time()
+    for (i, rank) in enumerate(ranks):
+        model.enqueue(rank, i, i)
+    for i in range(NumModelOps):
+        model.dequeue()
+    return 2*NumModelOps/(time.time() - t1)
+
+def test_batch_order():
+    """Interleave batch and single entry operations and compare against a
+       model that only sees single entry operations
+    """
+    model = PifoModel()
+    ref = PifoModel()
+    pkt_id = 0
+    for i in range(200):
+        op = random.randint(0, 3)
+        if op == 0:
+            n = random.randint(1, 50)
+            ranks = np.random.randint(0, MAX_RANK, n)
+            ids = np.arange(pkt_id, pkt_id + n)
+            model.enqueue_batch(ranks, ids, ids)
+            for (rank, pkt) in zip(ranks, ids):
+                ref.enqueue(int(rank), int(pkt), int(pkt))
+            pkt_id += n
+        elif op == 1:
+            rank = random.randint(0, MAX_RANK)
+            model.enqueue(rank, pkt_id, pkt_id)
+            ref.enqueue(rank, pkt_id, pkt_id)
+            pkt_id += 1
+        elif op == 2 and model.num_entries > 0:
+            n = random.randint(1, model.num_entries)
+            (ranks, hsps, mdps) = model.dequeue_batch(n)
+            for (rank, hsp) in zip(ranks, hsps):
+                if (rank, hsp) != ref.dequeue()[:2]:
+                    return False
+        elif op == 3 and model.num_entries > 0:
+            if model.peek() != ref.peek() or model.dequeue() != ref.dequeue():
+                return False
+    # an empty batch has the dtypes of a non-empty one
+    (ranks, hsps, mdps) = model.dequeue_batch(0)
+    if len(ranks) != 0 or ranks.dtype != np.asarray(0).dtype or hsps.dtype != ids.dtype:
+        return False
+    return model.num_entries == ref.num_entries
+
+def test_alternating_order():
+    """Alternate small batches and dequeues on top of a large sorted run
+    """
+    model = PifoModel()
+    ref = PifoModel()
+    ranks = np.random.randint(0, MAX_RANK, NumAltOps)
+    ids = np.arange(NumAltOps)
+    model.enqueue_batch(ranks, ids, ids)
+    for (rank, pkt) in zip(ranks, ids):
+        ref.enqueue(int(rank), int(pkt), int(pkt))
+    pkt_id = NumAltOps
+    t1 = time.time()
+    for i in range(NumAltOps):
+        n = random.randint(1, 4)
+        ranks = np.random.randint(0, MAX_RANK, n)
+        ids = np.arange(pkt_id, pkt_id + n)
+        model.enqueue_batch(ranks, ids, ids)
+        for (rank, pkt) in zip(ranks, ids):
+            ref.enqueue(int(rank), int(pkt), int(pkt))
+        pkt_id += n
+        if model.dequeue() != ref.dequeue():
+            return (False, 0)
+    return (True, NumAltOps/(time.time() - t1))
+
+def test_batch_throughput():
+    model = PifoModel()
+    ranks = np.random.randint(0, MAX_RANK, NumModelOps)
+    ids = np.arange(NumModelOps)
+    t1 = time.time()
+    model.enqueue_batch(ranks, ids, ids)
+    model.dequeue_batch(NumModelOps)
+    return 2*NumModelOps/(time.time() - t1)
+
+def main():
+    random.seed(1)
+    np.random.seed(1)
+    errors = []
+    env = simpy.Environment()
+    ranks = [random.randint(0, MAX_RANK) for i in range(NumOps)]
+    env.process(test_order(env, PifoModel(), ranks, errors))
+    env.run()
+    print ('skip list wrapper vs model: {} mismatches over {} ops'.format(len(errors), NumOps))
+    passed = len(errors) == 0
+    match = test_fifo_order()
+    print ('FIFO order within rank: {}'.format('PASS' if match else 'FAIL'))
+    passed &= match
+    match = test_batch_order()
+    print ('batch vs single entry operations: {}'.format('PASS' if match else 'FAIL'))
+    passed &= match
+    (match, rate) = test_alternating_order()
+    print ('alternating small batches and dequeues: {}, {:.0f} batches/sec'.format('PASS' if match else 'FAIL', rate))
+    passed &= match
+    print ('model throughput: {:.2f} Mops/sec'.format(test_throughput()/1e6))
+    print ('model batch throughput: {:.2f} Mops/sec'.format(test_batch_throughput()/1e6))
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
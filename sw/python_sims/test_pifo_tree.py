@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import sys
+from hwsim_utils import Tuser
+from pifo_tree import Tree_node, Wfq_policy, Srpt_policy, PifoTreeModel, build_tree, simulate_tree
+
+"""
+Testbench for the PIFO tree: checks the timed tree against the reference
+PifoTreeModel, the bandwidth shares of WFQ and the dequeue hop timing
+"""
+
+NUM_PKTS = 200
+SEED = 1
+
+# (depth, fanout)
+SHAPES = [(1, 1), (2, 3), (3, 2)]
+
+def model_order(depth, fanout, pkts):
+    model = PifoTreeModel(build_tree(depth, fanout))
+    for (i, (leaf, rank)) in enumerate(pkts):
+        model.enqueue(leaf, Tuser(64, 0, 0, rank, i), i, i)
+    return [model.dequeue() for i in range(len(pkts))]
+
+def check_order(depth, fanout, node_impl):
+    """PifoModel nodes must match the reference exactly. Skip lists do not
+       keep equal ranks in FIFO order, so only the sequence of ranks is checked.
+    """
+    (enq_nclks, deq_nclks, pkts, dequeued) = simulate_tree(depth, fanout, NUM_PKTS, node_impl=node_impl, seed=SEED)
+    expected = model_order(depth, fanout, pkts)
+    if node_impl == 'model':
+        return [hsp for (rank, hsp) in dequeued] == [hsp for (rank, hsp, mdp) in expected]
+    return [rank for (rank, hsp) in dequeued] == [rank for (rank, hsp, mdp) in expected]
+
+def check_wfq_shares():
+    """Two backlogged tenants with weights 1 and 3, SRPT within each tenant
+    """
+    root = Tree_node(Wfq_policy([1, 3]), [Tree_node(Srpt_policy()), Tree_node(Srpt_policy())])
+    model = PifoTreeModel(root)
+    for i in range(NUM_PKTS):
+        model.enqueue(i % 2, Tuser(60, 0, 0, NUM_PKTS - i, i), i, i)
+    first = [model.dequeue() for i in range(NUM_PKTS/2)]
+    tenant1 = [hsp for (rank, hsp, mdp) in first if hsp % 2 == 1]
+    # SRPT: the packets of a tenant leave with increasing remaining size
+    srpt = all(a > b for (a, b) in zip(tenant1, tenant1[1:]))
+    return (abs(len(tenant1) - 3*len(first)/4) <= 2 and srpt, len(tenant1), len(first))
+
+def check_wfq_virtual_time():
+    """A packet of weight 1 and weight packets of weight w must advance the
+       virtual finish time by the same amount, whether or not w divides pkt_len
+    """
+    policy = Wfq_policy([1, 3])
+    policy.rank(0, Tuser(64, 0, 0, 0, 0))
+    for i in range(3):
+        policy.rank(1, Tuser(64, 0, 0, 0, i))
+    return policy.finish[0] == policy.finish[1]
+
+def main():
+    passed = True
+    for (depth, fanout) in SHAPES:
+        for node_impl in ['model', 'sl']:
+            match = check_order(depth, fanout, node_impl)
+            print 'order: depth = {}, fanout = {}, nodes = {} : {}'.format(depth, fanout, node_impl, 'PASS' if match else 'FAIL')
+            passed &= match
+
+    (match, n1, n) = check_wfq_shares()
+    print 'wfq shares: weight 3 tenant got {} of {} pkts : {}'.format(n1, n, 'PASS' if match else 'FAIL')
+    passed &= match
+
+    match = check_wfq_virtual_time()
+    print 'wfq virtual time not truncated : {}'.format('PASS' if match else 'FAIL')
+    passed &= match
+
+    # each level costs one node dequeue, each level below the root one hop
+    for (depth, hop_latency, latency) in [(1, 1, 1), (3, 1, 1), (4, 2, 3)]:
+        (enq_nclks, deq_nclks, pkts, dequeued) = simulate_tree(depth, 2, 50, hop_latency=hop_latency, node_impl='model', mem_latency=latency, seed=SEED)
+        expected = depth*latency + (depth-1)*hop_latency
+        match = all(deq_nclks == expected)
+        print 'hop timing: depth = {}, hop_latency = {}, latency = {}, deq = {} cycles : {}'.format(depth, hop_latency, latency, deq_nclks.mean(), 'PASS' if match else 'FAIL')
+        passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
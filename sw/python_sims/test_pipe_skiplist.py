@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import sys, random
+import simpy
+from pipe_skip_list import SkipList
+from det_skip_list_simpy import SkipList as SkipList_det
+from pifo_wrapper import PifoModel
+
+"""
+Testbench for the pipelined skip list: checks the dequeue order against the
+reference PifoModel, that every node is returned to its free list, and the
+rate at which entries are inserted compared to the deterministic skip list
+"""
+
+PERIOD = 1
+OUTREG_WIDTH = 4
+NUM_OPS = 300
+MAX_RANK = 100
+
+# (size, mem_latency, mem_impl)
+CONFIGS = [(512, 1, 'bram'),
+           (64, 2, 'dual_port'),
+           (2048, 3, 'banked')]
+
+def drive(env, sl, ops, dequeued):
+    """ops is a list of ranks to enqueue and None for dequeues
+    """
+    for (i, op) in enumerate(ops):
+        if op is None:
+            while sl.outreg.next_valid == 0:
+                yield env.timeout(PERIOD)
+            sl.deq_in_pipe.put(True)
+            (val, hsp, mdp, deq_nclks) = yield sl.deq_out_pipe.get()
+            dequeued.append((val, hsp))
+        else:
+            sl.enq_in_pipe.put((op, i, i))
+            yield sl.enq_out_pipe.get()
+    # Drain the skip list
+    while sl.enq_fifo.fill_level() > 0 or len(sl.pending) > 0:
+        yield env.timeout(PERIOD)
+    while sl.num_entries > 0:
+        while sl.outreg.next_valid == 0:
+            yield env.timeout(PERIOD)
+        sl.deq_in_pipe.put(True)
+        (val, hsp, mdp, deq_nclks) = yield sl.deq_out_pipe.get()
+        dequeued.append((val, hsp))
+    yield env.timeout(10*PERIOD)
+    sl.enq_sl_proc.interrupt('Done')
+    sl.deq_sl_proc.interrupt('Done')
+
+def run(config, ops):
+    (size, mem_lat, mem_impl) = config
+    env = simpy.Environment()
+    sl = SkipList(env, PERIOD, size, OUTREG_WIDTH, NUM_OPS, mem_lat, mem_lat, 1, mem_impl=mem_impl)
+    dequeued = []
+    env.process(drive(env, sl, ops, dequeued))
+    env.run()
+    return (sl, dequeued)
+
+def check_order(config, rng):
+    """Enqueue everything, then dequeue everything: the order must match the model
+    """
+    ranks = [rng.randint(0, MAX_RANK) for i in range(min(NUM_OPS, config[0]/2))]
+    (sl, dequeued) = run(config, ranks)
+    model = PifoModel()
+    for (i, rank) in enumerate(ranks):
+        model.enqueue(rank, i, i)
+    expected = [model.dequeue()[0] for i in range(len(ranks))]
+    if [val for (val, hsp) in dequeued] != expected:
+        print 'ERROR: dequeued {}, expected {}'.format([val for (val, hsp) in dequeued], expected)
+        return False
+    return check_free(sl)
+
+def check_interleaved(config, rng):
+    """Interleave enqueues and dequeues: every entry must come out exactly once
+    """
+    ops = []
+    num_entries = 0
+    for i in range(NUM_OPS):
+        if num_entries > 0 and (rng.random() < 0.4 or num_entries >= config[0]/2):
+            ops.append(None)
+            num_entries -= 1
+        else:
+            ops.append(rng.randint(0, MAX_RANK))
+            num_entries += 1
+    (sl, dequeued) = run(config, ops)
+    if sorted(hsp for (val, hsp) in dequeued) != [i for (i, op) in enumerate(ops) if op is not None]:
+        print 'ERROR: dequeued entries {}'.format(sorted(hsp for (val, hsp) in dequeued))
+        return False
+    if any(ops[hsp] != val for (val, hsp) in dequeued):
+        print 'ERROR: dequeued ranks do not match the enqueued ones'
+        return False
+    return check_free(sl)
+
+def check_free(sl):
+    free = [level.free_node_list.fill_level() for level in sl.levels]
+    if any(f != len(level.nodes.mem) for (f, level) in zip(free, sl.levels)) or len(sl.limbo) > 0:
+        print 'ERROR: free nodes per level {}, {} nodes not freed'.format(free, len(sl.limbo))
+        return False
+    return True
+
+def insert_rate(cls, ranks, mem_lat):
+    """Average cycles per entry to insert a burst of entries pushed into the enqueue FIFO
+    """
+    env = simpy.Environment()
+    sl = cls(env, PERIOD, 2048, OUTREG_WIDTH, len(ranks), mem_lat, mem_lat, 1)
+    # wait for the initialization of the det skip list
+    while sl.busy == 1:
+        env.run(until=env.now+PERIOD)
+    t1 = env.now
+    for (i, rank) in enumerate(ranks):
+        sl.enq_fifo.push((rank, (i, i)))
+    while sl.enq_fifo.fill_level() > 0 or len(getattr(sl, 'pending', [])) > 0 or sl.busy == 1:
+        env.run(until=env.now+PERIOD)
+    return (env.now - t1)/float(len(ranks))
+
+def main():
+    rng = random.Random(1)
+    passed = True
+    for config in CONFIGS:
+        match = check_order(config, rng)
+        print 'order: config = {} : {}'.format(config, 'PASS' if match else 'FAIL')
+        passed &= match
+        match = check_interleaved(config, rng)
+        print 'interleaved: config = {} : {}'.format(config, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    ranks = [rng.randint(0, MAX_RANK) for i in range(NUM_OPS)]
+    for mem_lat in [1, 2]:
+        (pipe, det) = (insert_rate(SkipList, ranks, mem_lat), insert_rate(SkipList_det, ranks, mem_lat))
+        match = 2*pipe < det
+        print 'insert rate: mem_latency = {}, pipe = {:.2f}, det = {:.2f} cycles/entry : {}'.format(mem_lat, pipe, det, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+import sys, random
+import simpy
+from hwsim_utils import HW_sim_object, MEM_IMPLS
+
+"""
+Testbench for the pipelined memory models: checks the data read back against
+a reference dict and the number of cycles taken by back-to-back accesses
+"""
+
+DEPTH = 64
+NUM_OPS = 200
+LATENCY = 3
+
+class Mem_tb(HW_sim_object):
+    def __init__(self, env, period, mem_impl, addrs, writes):
+        super(Mem_tb, self).__init__(env, period)
+        self.r_in_pipe = simpy.Store(env)
+        self.r_out_pipe = simpy.Store(env)
+        self.w_in_pipe = simpy.Store(env)
+        self.w_out_pipe = simpy.Store(env)
+        self.mem = MEM_IMPLS[mem_impl](env, period, self.r_in_pipe, self.r_out_pipe, self.w_in_pipe, self.w_out_pipe,
+                                       DEPTH, LATENCY, LATENCY)
+        # addresses to read back-to-back
+        self.addrs = addrs
+        # (addr, data) to write back-to-back, concurrently with the reads
+        self.writes = writes
+        self.rd_data = []
+        self.rd_done = 0
+        self.wr_done = 0
+        self.run()
+
+    def run(self):
+        self.env.process(self.read_sm())
+        self.env.process(self.write_sm())
+
+    def read_sm(self):
+        for addr in self.addrs:
+            self.r_in_pipe.put(addr)
+        for addr in self.addrs:
+            data = yield self.r_out_pipe.get()
+            self.rd_data.append(data)
+        self.rd_done = self.env.now
+
+    def write_sm(self):
+        for (addr, data) in self.writes:
+            self.w_in_pipe.put((addr, data))
+        for w in self.writes:
+            yield self.w_out_pipe.get()
+        self.wr_done = self.env.now
+
+def run(mem_impl, addrs, writes, init=None):
+    env = simpy.Environment()
+    tb = Mem_tb(env, 1, mem_impl, addrs, writes)
+    if init is not None:
+        for (addr, data) in init.items():
+            tb.mem.mem[addr] = data
+    env.run()
+    return tb
+
+def check(name, cond, msg):
+    print '{}: {} : {}'.format(name, msg, 'PASS' if cond else 'FAIL')
+    return cond
+
+def main():
+    rng = random.Random(1)
+    init = dict((addr, rng.randint(0, 1000)) for addr in range(DEPTH))
+    addrs = [rng.randint(0, DEPTH-1) for i in range(NUM_OPS)]
+    passed = True
+
+    # reads return the stored data, in order, for every model
+    for mem_impl in sorted(MEM_IMPLS.keys()):
+        tb = run(mem_impl, addrs, [], init)
+        passed &= check(mem_impl, tb.rd_data == [init[a] for a in addrs], 'read data')
+
+    # back-to-back reads: one per LATENCY cycles for BRAM, one per cycle when pipelined
+    tb = run('bram', addrs, [])
+    passed &= check('bram', tb.rd_done == NUM_OPS*LATENCY, 'reads done @ {}'.format(tb.rd_done))
+    tb = run('dual_port', addrs, [])
+    passed &= check('dual_port', tb.rd_done == NUM_OPS-1+LATENCY, 'reads done @ {}'.format(tb.rd_done))
+
+    # concurrent reads and writes to disjoint addresses
+    rd_addrs = [a for a in addrs if a < DEPTH/2]
+    writes = [(DEPTH/2 + i % (DEPTH/2), i) for i in range(len(rd_addrs))]
+    n = len(rd_addrs)
+    tb = run('dual_port', rd_addrs, writes)
+    passed &= check('dual_port', (tb.rd_done, tb.wr_done, tb.mem.bank_conflicts) == (n-1+LATENCY, n-1+LATENCY, 0),
+                    'reads/writes done @ {}/{}, conflicts = {}'.format(tb.rd_done, tb.wr_done, tb.mem.bank_conflicts))
+    tb = run('single_port', rd_addrs, writes)
+    passed &= check('single_port', max(tb.rd_done, tb.wr_done) == 2*n-1+LATENCY and tb.mem.bank_conflicts > 0,
+                    'reads/writes done @ {}/{}, conflicts = {}'.format(tb.rd_done, tb.wr_done, tb.mem.bank_conflicts))
+    # the last write to each address wins
+    final = dict(writes)
+    passed &= check('single_port', all(tb.mem.mem[a] == d for (a, d) in final.items()), 'write data')
+
+    # banked memory: reads and writes to different banks proceed in parallel
+    rd_addrs = [4*(i % (DEPTH/4)) for i in range(n)]
+    writes = [(4*(i % (DEPTH/4)) + 1, i) for i in range(n)]
+    tb = run('banked', rd_addrs, writes)
+    passed &= check('banked', (max(tb.rd_done, tb.wr_done), tb.mem.bank_conflicts) == (n-1+LATENCY, 0),
+                    'disjoint banks done @ {}, conflicts = {}'.format(max(tb.rd_done, tb.wr_done), tb.mem.bank_conflicts))
+    writes = [(4*(i % (DEPTH/4)), i) for i in range(n)]
+    tb = run('banked', rd_addrs, writes)
+    passed &= check('banked', tb.mem.bank_conflicts > 0, 'same bank conflicts = {}'.format(tb.mem.bank_conflicts))
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import sys
+import simpy
+from scapy.all import Ether, IP, TCP
+from hwsim_utils import HW_sim_object, Tuser, pad_pkt
+from packet_storage import Pkt_storage, SEG_SIZE
+
+"""
+Testbench for the packet storage: pkts of every length must come out
+unchanged, as scapy pkts or as raw bytes, using one segment per SEG_SIZE
+bytes and returning every segment to the free list. With an ingress depth,
+no more pkts than the depth may be written at the same time. With an egress
+depth, pkts must come out in request order, even when they are requested
+before they are written
+"""
+
+PERIOD = 1
+PKT_LENS = [60, 64, 65, 128, 1000, 1500, 9000]
+MAX_SEGMENTS = 256
+MAX_PKTS = 16
+INGRESS_DEPTHS = [1, 2, 4, None]
+EGRESS_DEPTHS = [None, 1, 2, 4]
+WR_LATENCY = 4
+RD_LATENCY = 4
+
+class Pkt_storage_tb(HW_sim_object):
+    def __init__(self, env, period, pkts, raw_pkts):
+        super(Pkt_storage_tb, self).__init__(env, period)
+        self.pkt_in_pipe = simpy.Store(env)
+        self.pkt_out_pipe = simpy.Store(env)
+        self.ptr_in_pipe = simpy.Store(env)
+        self.ptr_out_pipe = simpy.Store(env)
+        self.ps = Pkt_storage(env, period, self.pkt_in_pipe, self.pkt_out_pipe, self.ptr_in_pipe, self.ptr_out_pipe, MAX_SEGMENTS, MAX_PKTS, raw_pkts=raw_pkts)
+        self.pkts = pkts
+        # segments taken by each pkt
+        self.num_segments = []
+        self.pkts_out = []
+        self.env.process(self.rw_ps_sm())
+
+    def rw_ps_sm(self):
+        ptrs = []
+        for pkt in self.pkts:
+            free_segs = self.ps.free_seg_list.fill_level()
+            self.pkt_in_pipe.put((pkt, Tuser(len(pkt), 0, 0, 0, len(self.num_segments))))
+            ptrs.append((yield self.ptr_out_pipe.get()))
+            yield self.wait_clock()
+            self.num_segments.append(free_segs - self.ps.free_seg_list.fill_level())
+        # wait for the segment writes to complete
+        yield self.wait_clocks(10)
+        for ptr in ptrs:
+            self.ptr_in_pipe.put(ptr)
+            self.pkts_out.append((yield self.pkt_out_pipe.get()))
+
+def check_storage(pkts, raw_pkts):
+    env = simpy.Environment()
+    tb = Pkt_storage_tb(env, PERIOD, pkts, raw_pkts)
+    env.run(until=100000)
+    if len(tb.pkts_out) != len(pkts):
+        print 'ERROR: received {} of {} pkts'.format(len(tb.pkts_out), len(pkts))
+        return False
+    for (pkt, (pkt_out, tuser)) in zip(pkts, tb.pkts_out):
+        if raw_pkts and type(pkt_out) is not bytes:
+            print 'ERROR: raw pkt of type {}'.format(type(pkt_out))
+            return False
+        if not raw_pkts and not isinstance(pkt_out, Ether):
+            print 'ERROR: pkt of type {}'.format(type(pkt_out))
+            return False
+        if bytes(pkt_out) != bytes(pkt) or tuser.pkt_len != len(pkt):
+            print 'ERROR: pkt of {} bytes changed in storage'.format(len(pkt))
+            return False
+    if tb.num_segments != [(len(pkt) + SEG_SIZE - 1)//SEG_SIZE for pkt in pkts]:
+        print 'ERROR: segments used {}'.format(tb.num_segments)
+        return False
+    if tb.ps.free_seg_list.fill_level() != MAX_SEGMENTS or tb.ps.free_meta_list.fill_level() != MAX_PKTS:
+        print 'ERROR: {} free segments, {} free metadata blocks'.format(tb.ps.free_seg_list.fill_level(), tb.ps.free_meta_list.fill_level())
+        return False
+    return True
+
+class Ingress_tb(HW_sim_object):
+    """Offers all pkts back-to-back and records, for each pkt, the cycle its
+       ptrs come out and the number of pkts being written at that time
+    """
+    def __init__(self, env, period, pkts, ingress_depth):
+        super(Ingress_tb, self).__init__(env, period)
+        self.pkt_in_pipe = simpy.Store(env)
+        self.pkt_out_pipe = simpy.Store(env)
+        self.ptr_in_pipe = simpy.Store(env)
+        self.ptr_out_pipe = simpy.Store(env)
+        self.ps = Pkt_storage(env, period, self.pkt_in_pipe, self.pkt_out_pipe, self.ptr_in_pipe, self.ptr_out_pipe, MAX_SEGMENTS, MAX_PKTS,
+                              wr_latency=WR_LATENCY, mem_impl='dual_port', raw_pkts=True, ingress_depth=ingress_depth)
+        self.pkts = pkts
+        self.accepted = []
+        self.pkts_out = []
+        self.env.process(self.rw_ps_sm())
+
+    def rw_ps_sm(self):
+        for (i, pkt) in enumerate(self.pkts):
+            self.pkt_in_pipe.put((pkt, Tuser(len(pkt), 0, 0, 0, i)))
+        ptrs = []
+        for pkt in self.pkts:
+            ptrs.append((yield self.ptr_out_pipe.get()))
+            self.accepted.append((self.env.now, len(self.ps.ingress_pkts)))
+        while self.ps.written_pkts < len(self.pkts):
+            yield self.wait_clock()
+        for ptr in ptrs:
+            self.ptr_in_pipe.put(ptr)
+            self.pkts_out.append((yield self.pkt_out_pipe.get()))
+
+def check_ingress(pkts, ingress_depth):
+    env = simpy.Environment()
+    tb = Ingress_tb(env, PERIOD, pkts, ingress_depth)
+    env.run(until=100000)
+    if [bytes(pkt_out) for (pkt_out, tuser) in tb.pkts_out] != [bytes(pkt) for pkt in pkts]:
+        print 'ERROR: received {} of {} pkts unchanged'.format(len(tb.pkts_out), len(pkts))
+        return False
+    in_flight = max(n for (t, n) in tb.accepted)
+    if ingress_depth is None and any(t != 0 for (t, n) in tb.accepted):
+        print 'ERROR: pkts accepted at cycles {}'.format([t for (t, n) in tb.accepted])
+        return False
+    if ingress_depth is not None and in_flight > ingress_depth:
+        print 'ERROR: {} pkts written at the same time'.format(in_flight)
+        return False
+    return True
+
+class Egress_tb(HW_sim_object):
+    """Requests each pkt as soon as its ptrs come out of storage
+    """
+    def __init__(self, env, period, pkts, egress_depth):
+        super(Egress_tb, self).__init__(env, period)
+        self.pkt_in_pipe = simpy.Store(env)
+        self.pkt_out_pipe = simpy.Store(env)
+        self.ptr_in_pipe = simpy.Store(env)
+        self.ptr_out_pipe = simpy.Store(env)
+        self.ps = Pkt_storage(env, period, self.pkt_in_pipe, self.pkt_out_pipe, self.ptr_in_pipe, self.ptr_out_pipe, MAX_SEGMENTS, MAX_PKTS,
+                              rd_latency=RD_LATENCY, wr_latency=WR_LATENCY, mem_impl='dual_port', raw_pkts=True, egress_depth=egress_depth)
+        self.pkts = pkts
+        self.pkts_out = []
+        self.env.process(self.rw_ps_sm())
+
+    def rw_ps_sm(self):
+        for (i, pkt) in enumerate(self.pkts):
+            self.pkt_in_pipe.put((pkt, Tuser(len(pkt), 0, 0, 0, i)))
+            self.ptr_in_pipe.put((yield self.ptr_out_pipe.get()))
+        for pkt in self.pkts:
+            self.pkts_out.append((yield self.pkt_out_pipe.get()))
+
+def check_egress(pkts, egress_depth):
+    env = simpy.Environment()
+    tb = Egress_tb(env, PERIOD, pkts, egress_depth)
+    env.run(until=100000)
+    if [(bytes(pkt_out), tuser.pkt_id) for (pkt_out, tuser) in tb.pkts_out] != [(bytes(pkt), i) for (i, pkt) in enumerate(pkts)]:
+        print 'ERROR: received {} of {} pkts unchanged and in order'.format(len(tb.pkts_out), len(pkts))
+        return False
+    if tb.ps.free_seg_list.fill_level() != MAX_SEGMENTS or tb.ps.free_meta_list.fill_level() != MAX_PKTS:
+        print 'ERROR: {} free segments, {} free metadata blocks'.format(tb.ps.free_seg_list.fill_level(), tb.ps.free_meta_list.fill_level())
+        return False
+    return True
+
+def main():
+    passed = True
+    pkts = [pad_pkt(Ether()/IP()/TCP(), pkt_len) for pkt_len in PKT_LENS]
+    for raw_pkts in [False, True]:
+        match = check_storage(pkts, raw_pkts)
+        print 'scapy pkts in, raw_pkts = {} : {}'.format(raw_pkts, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    # raw bytes can be stored directly
+    match = check_storage([bytes(pkt) for pkt in pkts], True)
+    print 'raw pkts in, raw_pkts = True : {}'.format('PASS' if match else 'FAIL')
+    passed &= match
+
+    for ingress_depth in INGRESS_DEPTHS:
+        match = check_ingress([bytes(pkt) for pkt in pkts], ingress_depth)
+        print 'ingress_depth = {} : {}'.format(ingress_depth, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    for egress_depth in EGRESS_DEPTHS:
+        match = check_egress([bytes(pkt) for pkt in pkts], egress_depth)
+        print 'egress_depth = {} : {}'.format(egress_depth, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
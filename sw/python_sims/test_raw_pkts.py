@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import sys, random
+from scapy.all import Ether, IP, TCP
+from hwsim_utils import Pkt_template, pad_pkt
+from pifo_sim import simulate
+
+"""
+Testbench for the raw pkt mode: the pkts patched from the template must be
+the bytes scapy builds, checksums included, and the PIFO latencies must not
+depend on the pkt representation
+"""
+
+TEMPLATE_LEN = 1500
+NUM_PKTS = 500
+SEED = 1
+
+def check_template(rng):
+    template = Pkt_template(TEMPLATE_LEN)
+    for i in range(NUM_PKTS):
+        pkt_len = rng.choice([40, 54, 64, 65, rng.randint(54, TEMPLATE_LEN), TEMPLATE_LEN])
+        sport = rng.randint(0, 2**16-1)
+        dport = rng.randint(0, 2**16-1)
+        expected = bytes(pad_pkt(Ether()/IP()/TCP(sport=sport, dport=dport), pkt_len))
+        if bytes(template.make(pkt_len, sport, dport)) != expected:
+            print 'ERROR: pkt_len = {}, sport = {}, dport = {}'.format(pkt_len, sport, dport)
+            return False
+    return True
+
+def check_latencies(fill_level, pkt_len):
+    scapy_res = simulate(fill_level, pkt_len, 2, num_samples=200, seed=SEED)
+    raw_res = simulate(fill_level, pkt_len, 2, num_samples=200, seed=SEED, raw_pkts=True)
+    return list(scapy_res.enq_data) == list(raw_res.enq_data) and list(scapy_res.deq_data) == list(raw_res.deq_data)
+
+def main():
+    rng = random.Random(SEED)
+    passed = True
+    match = check_template(rng)
+    print 'template: {} pkts : {}'.format(NUM_PKTS, 'PASS' if match else 'FAIL')
+    passed &= match
+
+    for (fill_level, pkt_len) in [(None, 64), (20, 1500)]:
+        match = check_latencies(fill_level, pkt_len)
+        print 'latencies: fill_level = {}, pkt_len = {} : {}'.format(fill_level, pkt_len, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import sys
+import simpy
+import det_skip_list_simpy, pifo_skip_list
+from pifo_tb import Pifo_tb
+
+"""
+Testbench for the prefetching skip list search: every node read returned
+to the search (claimed prefetches included) must match the node memory
+when it is consumed, and the search must save cycles with a pipelined
+memory at rd_latency > 1
+"""
+
+SEED = 5
+NUM_SAMPLES = 400
+
+# (num_skipLists, mem_latency, sl_impl)
+CONFIGS = [(2, 1, 'det'),
+           (2, 4, 'det'),
+           (2, 1, 'prob'),
+           (2, 4, 'prob')]
+
+class Read_checker(object):
+    """Wraps SkipList.read_node to compare each response with the node memory
+    """
+    def __init__(self, sl_class):
+        self.read_node = sl_class.read_node
+        self.mismatches = 0
+        sl_class.read_node = self.checked_read_node()
+
+    def checked_read_node(self):
+        read_node = self.read_node
+        def checked(sl, addr):
+            rd = read_node(sl, addr)
+            def check(event):
+                if list(event.value) != list(sl.nodes.mem[addr]):
+                    self.mismatches += 1
+            rd.callbacks.append(check)
+            return rd
+        return checked
+
+def run(config, search_prefetch):
+    (num_sl, mem_lat, impl) = config
+    env = simpy.Environment()
+    tb = Pifo_tb(env, 1, 1, None, 64, num_sl, NUM_SAMPLES, 4, 4, mem_lat, mem_lat, impl, seed=SEED, mem_impl='dual_port', search_prefetch=search_prefetch)
+    env.run()
+    skip_lists = tb.pifo.skip_list_wrapper.sl
+    search_nclks = [n for sl in skip_lists for n in sl.bg_search_nclks_list]
+    avg = sum(search_nclks)/float(len(search_nclks))
+    hits = sum(sl.prefetch_hits for sl in skip_lists)
+    return (tb, avg, hits)
+
+def main():
+    checkers = [Read_checker(det_skip_list_simpy.SkipList), Read_checker(pifo_skip_list.SkipList)]
+    failed = False
+    for config in CONFIGS:
+        (serial_tb, serial_avg, serial_hits) = run(config, False)
+        (prefetch_tb, prefetch_avg, prefetch_hits) = run(config, True)
+        mismatches = sum(c.mismatches for c in checkers)
+        passed = mismatches == 0 and len(prefetch_tb.deq_latencies) == NUM_SAMPLES and prefetch_hits > 0
+        if config[1] > 1:
+            passed &= prefetch_avg < serial_avg
+        print 'config = {}, search cycles = {:.2f}/{:.2f}, prefetch hits = {}, mismatches = {} : {}'.format(config, serial_avg, prefetch_avg,
+                                                                                                      prefetch_hits, mismatches, 'PASS' if passed else 'FAIL')
+        failed |= not passed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+import sys, random
+from StringIO import StringIO
+import simpy
+from pifo_wrapper import SkipListWrapper, PifoModel, Tournament_tree, SHARD_POLICIES
+
+"""
+Testbench for the shard selection of the skip list wrapper: checks the
+tournament tree against a scan of its keys, and for every shard policy
+checks the dequeue order against the reference PifoModel and where the
+entries were enqueued, and that the adaptive rank ranges follow skewed ranks
+"""
+
+NUM_SKIP_LISTS = 4
+PERIOD = 1
+MAX_NODES = 512
+OUTREG_WIDTH = 4
+ENQ_FIFO_DEPTH = 8
+MAX_RANK = 63
+NUM_OPS = 200
+
+def check_tree(rng):
+    """Random updates, the winner and searches must match a scan of the keys
+    """
+    for n in [1, 3, 8, 13]:
+        tree = Tournament_tree(n)
+        keys = n*[None]
+        for i in range(500):
+            j = rng.randint(0, n-1)
+            keys[j] = rng.choice([None, rng.randint(0, 10)])
+            tree.update(j, keys[j])
+            valid = [(k, s) for (s, k) in enumerate(keys) if k is not None]
+            if tree.winner() != (min(valid)[1] if len(valid) > 0 else None):
+                return False
+            accepted = [(k, s) for (k, s) in valid if s % 3 != 0]
+            if tree.search(lambda s: s % 3 != 0) != (min(accepted)[1] if len(accepted) > 0 else None):
+                return False
+    return True
+
+def drive(env, slw, ranks, dequeued):
+    for sl in slw.sl:
+        while sl.busy == 1:
+            yield env.timeout(PERIOD)
+    for (i, rank) in enumerate(ranks):
+        slw.enq_in_pipe.put((rank, i, i))
+        yield slw.enq_out_pipe.get()
+    for sl in slw.sl:
+        while sl.enq_fifo.fill_level() != 0 or sl.busy == 1:
+            yield env.timeout(PERIOD)
+    # entries held by each skip list once everything has been enqueued
+    slw.enq_counts = [sl.num_entries for sl in slw.sl]
+    while slw.num_entries > 0:
+        slw.deq_in_pipe.put(True)
+        (val, hsp, mdp, deq_nclks) = yield slw.deq_out_pipe.get()
+        dequeued.append((val, hsp))
+    for sl in slw.sl:
+        while sl.busy == 1:
+            yield env.timeout(PERIOD)
+        sl.enq_sl_proc.interrupt('Done')
+        sl.deq_sl_proc.interrupt('Done')
+
+def drive_interleaved(env, slw, ops, dequeued):
+    """ops is a list of ranks to enqueue and None for dequeues
+    """
+    for (i, op) in enumerate(ops):
+        if op is None:
+            slw.deq_in_pipe.put(True)
+            (val, hsp, mdp, deq_nclks) = yield slw.deq_out_pipe.get()
+            dequeued.append((val, hsp))
+        else:
+            slw.enq_in_pipe.put((op, i, i))
+            yield slw.enq_out_pipe.get()
+    while slw.num_entries > 0:
+        slw.deq_in_pipe.put(True)
+        (val, hsp, mdp, deq_nclks) = yield slw.deq_out_pipe.get()
+        dequeued.append((val, hsp))
+    for sl in slw.sl:
+        while sl.busy == 1:
+            yield env.timeout(PERIOD)
+        sl.enq_sl_proc.interrupt('Done')
+        sl.deq_sl_proc.interrupt('Done')
+
+def run(policy, ops, drive_fn, sl_impl='det'):
+    env = simpy.Environment()
+    slw = SkipListWrapper(env, simpy.Store(env), simpy.Store(env), simpy.Store(env), simpy.Store(env), num_sl=NUM_SKIP_LISTS, period=PERIOD, size=MAX_NODES,
+                          outreg_width=OUTREG_WIDTH, enq_fifo_depth=ENQ_FIFO_DEPTH, rd_latency=1, wr_latency=1, sl_impl=sl_impl, outreg_latency=1,
+                          rng=random.Random(1), shard_policy=policy, max_rank=MAX_RANK)
+    dequeued = []
+    env.process(drive_fn(env, slw, ops, dequeued))
+    env.run()
+    return (slw, dequeued)
+
+def check_policy(policy, ranks):
+    (slw, dequeued) = run(policy, ranks, drive)
+
+    model = PifoModel()
+    for (i, rank) in enumerate(ranks):
+        model.enqueue(rank, i, i)
+    expected = [model.dequeue()[0] for i in range(len(ranks))]
+    if [val for (val, hsp) in dequeued] != expected:
+        print 'ERROR: dequeued {}, expected {}'.format([val for (val, hsp) in dequeued], expected)
+        return False
+
+    counts = slw.enq_counts
+    if policy == 'round_robin':
+        # busy skip lists are skipped, so the shares may differ slightly
+        return sum(counts) == len(ranks) and max(counts) - min(counts) <= 2
+    if policy == 'rank_range':
+        ranges = [sum(1 for r in ranks if r*NUM_SKIP_LISTS//(MAX_RANK+1) == i) for i in range(NUM_SKIP_LISTS)]
+        return counts == ranges
+    return sum(counts) == len(ranks)
+
+def check_adaptive(rng):
+    """Most ranks fall in the lowest quarter of the rank space: the adaptive
+       ranges must move towards it, and every entry must come out exactly once.
+       Runs on the pipelined skip list, an enqueue racing with an out reg
+       refill of the det skip list can lose an entry under this traffic.
+    """
+    ops = []
+    num_entries = 0
+    for i in range(3*NUM_OPS):
+        if num_entries > 16 or (num_entries > 0 and rng.random() < 0.5):
+            ops.append(None)
+            num_entries -= 1
+        else:
+            ops.append(rng.randint(0, MAX_RANK/4) if rng.random() < 0.8 else rng.randint(0, MAX_RANK))
+            num_entries += 1
+    (slw, dequeued) = run('adaptive_range', ops, drive_interleaved, sl_impl='pipe')
+    if sorted(hsp for (val, hsp) in dequeued) != [i for (i, op) in enumerate(ops) if op is not None]:
+        print 'ERROR: dequeued entries {}'.format(sorted(hsp for (val, hsp) in dequeued))
+        return (False, slw.bounds)
+    return (slw.rebalances > 0 and slw.bounds[-1] <= (MAX_RANK+1)/4, slw.bounds)
+
+def check_empty(policy):
+    """With all skip lists empty there is no skip list to dequeue from
+    """
+    (slw, dequeued) = run(policy, [], drive)
+    return slw.min_head() is None
+
+def check_unsupported(policy, sl_impl):
+    """An unsupported skip list implementation or shard policy must print an
+       error and exit with status 1
+    """
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        run(policy, [], drive, sl_impl)
+        status = None
+    except SystemExit as e:
+        status = e.code
+    finally:
+        errors = sys.stderr.getvalue()
+        sys.stderr = stderr
+    return status == 1 and errors.startswith('ERROR: unsupported')
+
+def main():
+    rng = random.Random(1)
+    passed = True
+    match = check_tree(rng)
+    print 'tournament tree: {}'.format('PASS' if match else 'FAIL')
+    passed &= match
+
+    ranks = [rng.randint(0, MAX_RANK) for i in range(NUM_OPS)]
+    for policy in SHARD_POLICIES:
+        match = check_policy(policy, ranks)
+        print 'shard policy: {} : {}'.format(policy, 'PASS' if match else 'FAIL')
+        passed &= match
+        match = check_empty(policy)
+        print 'shard policy: {}, min head of empty skip lists : {}'.format(policy, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    for (policy, sl_impl) in [('unknown', 'det'), ('min_entries', 'unknown')]:
+        match = check_unsupported(policy, sl_impl)
+        print 'unsupported shard policy {} / skip list {} : {}'.format(policy, sl_impl, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    (match, bounds) = check_adaptive(rng)
+    print 'adaptive ranges: bounds = {} : {}'.format(bounds, 'PASS' if match else 'FAIL')
+    passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+import sys, os, shutil, tempfile
+import numpy as np
+from sim_cache import Sim_cache
+
+"""
+Testbench for the simulation result cache: stored arrays must come back
+unchanged, a change to the simulator sources must invalidate the entries and
+the least recently used entries must be evicted once the cache outgrows
+max_bytes
+"""
+
+NUM_SAMPLES = 1000
+
+def params(i):
+    return dict(fill_level=i, pkt_len=64, num_skipLists=1, seed=1)
+
+def arrays(i):
+    return dict(enq=np.arange(NUM_SAMPLES) + i, deq=np.arange(NUM_SAMPLES)*2 + i)
+
+def write_src(src_dir, text):
+    with open(os.path.join(src_dir, 'sim_module.py'), 'w') as f:
+        f.write(text)
+
+def check_round_trip(cache_dir, src_dir):
+    cache = Sim_cache(cache_dir, src_dir=src_dir)
+    if cache.get(params(0)) is not None:
+        print 'ERROR: hit in an empty cache'
+        return False
+    cache.put(params(0), arrays(0))
+    res = cache.get(params(0))
+    if res is None or sorted(res.keys()) != ['deq', 'enq'] or any(not np.array_equal(res[k], v) for (k, v) in arrays(0).items()):
+        print 'ERROR: cached arrays changed'
+        return False
+    if cache.get(params(1)) is not None:
+        print 'ERROR: hit for other params'
+        return False
+    # a new cache on the same directory and sources sees the entry
+    return Sim_cache(cache_dir, src_dir=src_dir).get(params(0)) is not None
+
+def check_src_change(cache_dir, src_dir):
+    Sim_cache(cache_dir, src_dir=src_dir).put(params(0), arrays(0))
+    write_src(src_dir, 'X = 2\n')
+    if Sim_cache(cache_dir, src_dir=src_dir).get(params(0)) is not None:
+        print 'ERROR: hit after the sources changed'
+        return False
+    # testbench scripts are not part of the hash
+    write_src(src_dir, 'X = 1\n')
+    with open(os.path.join(src_dir, 'test_module.py'), 'w') as f:
+        f.write('Y = 1\n')
+    return Sim_cache(cache_dir, src_dir=src_dir).get(params(0)) is not None
+
+def check_eviction(cache_dir, src_dir):
+    cache = Sim_cache(cache_dir, src_dir=src_dir)
+    cache.put(params(0), arrays(0))
+    entry_bytes = sum(os.path.getsize(os.path.join(cache.entry_dir(params(0)), f)) for f in os.listdir(cache.entry_dir(params(0))))
+    # room for 3 entries
+    cache.max_bytes = 3*entry_bytes
+    for i in range(1, 3):
+        cache.put(params(i), arrays(i))
+    # make the use order explicit: entry 0 is the oldest, then 1 and 2
+    for i in range(3):
+        os.utime(cache.entry_dir(params(i)), (1000 + i, 1000 + i))
+    # using entry 0 makes entry 1 the least recently used
+    cache.get(params(0))
+    cache.put(params(3), arrays(3))
+    hits = [cache.get(params(i)) is not None for i in range(4)]
+    if hits != [True, False, True, True]:
+        print 'ERROR: entries left after eviction {}'.format(hits)
+        return False
+    return True
+
+def main():
+    passed = True
+    for (name, check) in [('put/get round trip', check_round_trip), ('source change', check_src_change), ('LRU eviction', check_eviction)]:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            src_dir = os.path.join(tmp_dir, 'src')
+            os.makedirs(src_dir)
+            write_src(src_dir, 'X = 1\n')
+            match = check(os.path.join(tmp_dir, 'cache'), src_dir)
+        finally:
+            shutil.rmtree(tmp_dir)
+        print '{} : {}'.format(name, 'PASS' if match else 'FAIL')
+        passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
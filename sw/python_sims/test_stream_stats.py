@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import sys, math
+import numpy as np
+from stream_stats import Stream_stats
+
+"""
+Testbench for the streaming latency statistics: the P-square quantile
+estimates must be within QUANTILE_TOL of np.percentile on long streams and
+exact with up to 5 samples, and an empty stream must report nan
+"""
+
+SEED = 1
+NUM_SAMPLES = 10**5
+# max relative error of the P-square estimates on long streams
+QUANTILE_TOL = 0.02
+# tolerance for the statistics that must be exact
+EXACT_TOL = 1e-9
+
+def stream(data):
+    stats = Stream_stats()
+    for x in data:
+        stats.add(x)
+    return stats
+
+def close(a, b, tol):
+    return abs(a - b) <= tol*max(abs(b), 1)
+
+def check_stats(stats, data, quantile_tol):
+    """Compare the streaming stats with numpy, returns the list of errors
+    """
+    errors = []
+    exact = [(stats.count, len(data)), (stats.mean, np.mean(data)), (stats.std(), np.std(data)), (stats.min, np.min(data)), (stats.max, np.max(data))]
+    for (name, (val, ref)) in zip(['count', 'mean', 'std', 'min', 'max'], exact):
+        if not close(val, ref, EXACT_TOL):
+            errors.append('{} = {}, expected {}'.format(name, val, ref))
+    for p in stats.quantiles:
+        (val, ref) = (stats.quantile(p), np.percentile(data, 100*p))
+        if not close(val, ref, quantile_tol):
+            errors.append('p{:g} = {}, expected {}'.format(100*p, val, ref))
+    # the estimators restored from the saved state give the same results
+    restored = Stream_stats.from_state(stats.state())
+    if [restored.quantile(p) for p in stats.quantiles] != [stats.quantile(p) for p in stats.quantiles]:
+        errors.append('quantiles changed after from_state()')
+    return errors
+
+def main():
+    rng = np.random.RandomState(SEED)
+    passed = True
+
+    # long streams of latency-like distributions
+    for (name, data) in [('exponential', rng.exponential(50, NUM_SAMPLES)),
+                         ('uniform', rng.randint(0, 1000, NUM_SAMPLES)),
+                         ('geometric', rng.geometric(0.05, NUM_SAMPLES) + 3)]:
+        errors = check_stats(stream(data), data, QUANTILE_TOL)
+        for e in errors:
+            print 'ERROR: {}'.format(e)
+        print '{} samples, {} : {}'.format(NUM_SAMPLES, name, 'PASS' if len(errors) == 0 else 'FAIL')
+        passed &= len(errors) == 0
+
+    # fewer samples than P-square markers
+    for num in range(1, 6):
+        data = rng.randint(0, 100, num)
+        errors = check_stats(stream(data), data, EXACT_TOL)
+        for e in errors:
+            print 'ERROR: {}'.format(e)
+        print '{} samples : {}'.format(num, 'PASS' if len(errors) == 0 else 'FAIL')
+        passed &= len(errors) == 0
+
+    # empty stream
+    for stats in [Stream_stats(), Stream_stats.from_state(Stream_stats().state())]:
+        match = stats.count == 0 and stats.min is None and stats.max is None and math.isnan(stats.variance()) and \
+                all(math.isnan(stats.quantile(p)) for p in stats.quantiles)
+        print '0 samples : {}'.format('PASS' if match else 'FAIL')
+        passed &= match
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+import sys, os, shutil, tempfile
+import numpy as np
+from pifo_sim import Pifo_sim
+
+"""
+Testbench for resumable sweeps: re-running a sweep must only recompute the
+points whose result file is missing, and the results must come back in the
+order of the points whether they were computed (in parallel) or loaded
+"""
+
+SEED = 1
+NUM_PROCS = 2
+LEVELS = [4, 16, 32]
+MISSING = 1
+
+def points():
+    return [dict(fill_level=level, pkt_len=64, num_skipLists=1, num_samples=20, sl_impl='prob') for level in LEVELS]
+
+def same_results(res_a, res_b):
+    return all(np.array_equal(a.enq_data, b.enq_data) and np.array_equal(a.deq_data, b.deq_data) for (a, b) in zip(res_a, res_b))
+
+def main():
+    out_dir = tempfile.mkdtemp()
+    try:
+        psim = Pifo_sim(out_dir, NUM_PROCS, SEED)
+        sweep_res = psim.sweep('resume', points())
+        # each point run on its own gives the same result at the same position
+        ref_res = [psim.sweep('point_{}'.format(i), [dict(point, seed=SEED + i)])[0] for (i, point) in enumerate(points())]
+
+        passed = True
+        match = len(sweep_res) == len(LEVELS) and same_results(sweep_res, ref_res)
+        print 'parallel sweep results in point order : {}'.format('PASS' if match else 'FAIL')
+        passed &= match
+
+        sweepDir = os.path.join(out_dir, 'resume')
+        files = [psim.point_file(sweepDir, i) for i in range(len(LEVELS))]
+        # date back the saved points so that a rewrite is visible
+        for f in files:
+            os.utime(f, (1000, 1000))
+        os.remove(files[MISSING])
+        resumed_res = psim.sweep('resume', points())
+        rewritten = [os.path.getmtime(f) != 1000 for f in files]
+
+        match = rewritten == [i == MISSING for i in range(len(LEVELS))]
+        print 'only point {} recomputed, rewritten = {} : {}'.format(MISSING, rewritten, 'PASS' if match else 'FAIL')
+        passed &= match
+
+        match = len(resumed_res) == len(LEVELS) and same_results(resumed_res, ref_res)
+        print 'resumed sweep results in point order : {}'.format('PASS' if match else 'FAIL')
+        passed &= match
+    finally:
+        shutil.rmtree(out_dir)
+
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()